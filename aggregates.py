@@ -0,0 +1,200 @@
+"""
+Анализ воронки по агрегатам (день регистрации × сегменты)
+
+Строки превращаются в небольшую таблицу счетчиков этапов и сумм времени
+между этапами, а также пар месяцев для когорт (с сегментами, чтобы когорты
+можно было фильтровать). Такие агрегаты можно
+строить по частям (новые строки файла, отдельные партиции) и объединять
+суммированием, а все метрики FunnelAnalyzer считаются уже по ним.
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import (DATE_COLUMNS, SEGMENT_COLUMNS, STAGE_COUNTS, STAGE_TRANSITIONS,
+                     PandasEngine, _as_datetime, _hours_between, metrics_from_counts,
+                     segment_table, daily_table, cohorts_from_month_counts, find_daily_anomalies)
+from utils import FunnelAnalyzer
+
+AGGREGATE_KEYS = ['date'] + SEGMENT_COLUMNS
+COHORT_PAIR_KEYS = ['reg_month', 'deposit_month'] + SEGMENT_COLUMNS
+
+
+def aggregate_rows(df, segments=SEGMENT_COLUMNS, cohort_dates=False):
+    """
+    Агрегаты строк: счетчики этапов и суммы времени между этапами
+    по (день регистрации × сегменты), а также пары месяцев для когорт
+
+    Строки без даты регистрации остаются в агрегатах с date = NaT: они входят
+    в метрики по всему набору (как в FunnelAnalyzer), но не в дневные таблицы.
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Строки пользователей
+    segments : list
+        Столбцы сегментов
+    cohort_dates : bool
+        Добавить в пары месяцев день регистрации (столбец date), чтобы их
+        можно было отфильтровать по диапазону дат до merge_aggregates
+
+    Returns:
+    --------
+    tuple
+        (дневные агрегаты, пары месяц регистрации × месяц депозита × сегменты)
+    """
+    dates = {col: _as_datetime(df[col]) for col in DATE_COLUMNS}
+    values = pd.DataFrame({
+        'deposits': dates['deposit_time'].notna(),
+        'first_bets': dates['first_bet_time'].notna(),
+        'second_deposits': dates['second_deposit_time'].notna(),
+    }, index=df.index)
+    for key, start, end in STAGE_TRANSITIONS:
+        hours = _hours_between(dates[start], dates[end])
+        values[f'hours_{key}'] = hours.fillna(0.0)
+        values[f'timed_{key}'] = hours.notna()
+
+    keys = [dates['registration_time'].dt.normalize().rename('date')] + [df[col] for col in segments]
+    grouped = values.groupby(keys, sort=False, dropna=False)
+    daily = grouped.sum()
+    daily.insert(0, 'registrations', grouped.size())
+    daily = daily.reset_index()
+
+    months = pd.DataFrame({
+        'reg_month': dates['registration_time'].dt.to_period('M'),
+        'deposit_month': dates['deposit_time'].dt.to_period('M'),
+        **{col: df[col] for col in segments}
+    })
+    month_keys = ['reg_month', 'deposit_month'] + segments
+    if cohort_dates:
+        months.insert(0, 'date', dates['registration_time'].dt.normalize())
+        month_keys = ['date'] + month_keys
+    cohort_pairs = months.groupby(month_keys, sort=False, dropna=False).size()
+    cohort_pairs = cohort_pairs.rename('users').reset_index()
+
+    return daily, cohort_pairs
+
+
+def merge_aggregates(parts):
+    """
+    Объединение агрегатов нескольких частей суммированием
+
+    Parameters:
+    -----------
+    parts : list
+        Пары (дневные агрегаты, пары месяцев) из aggregate_rows
+
+    Returns:
+    --------
+    tuple
+        (дневные агрегаты, пары месяцев) по всем частям
+    """
+    daily = pd.concat([part[0] for part in parts], ignore_index=True)
+    cohort_pairs = pd.concat([part[1] for part in parts], ignore_index=True)
+
+    value_columns = [col for col in daily.columns if col not in AGGREGATE_KEYS]
+    daily = daily.groupby(AGGREGATE_KEYS, sort=False, dropna=False)[value_columns].sum().reset_index()
+    cohort_pairs = (
+        cohort_pairs.groupby(COHORT_PAIR_KEYS, sort=False, dropna=False)['users']
+                    .sum().reset_index()
+    )
+    return daily, cohort_pairs
+
+
+class AggregateFunnelAnalyzer(FunnelAnalyzer):
+    """
+    Базовый анализатор по агрегатам self.aggregates и self.cohort_pairs
+
+    Наследники отвечают только за построение агрегатов; сырые строки не хранятся
+    (self.df = None), поэтому приближенный режим не требуется. После изменения
+    агрегатов наследник вызывает _reset_caches().
+    """
+
+    def __init__(self):
+        self.aggregates = None
+        self.cohort_pairs = None
+        self.df = None
+        self._reset_caches()
+
+    def prepare_data(self):
+        """Подготовка не требуется: строки агрегируются при чтении"""
+
+    def _select(self, filters):
+        """Агрегаты с учетом фильтров по сегментам"""
+        if self.aggregates is None:
+            daily, _ = aggregate_rows(pd.DataFrame(columns=DATE_COLUMNS + SEGMENT_COLUMNS))
+            return daily
+        if not filters:
+            return self.aggregates
+        return PandasEngine().select(self.aggregates, filters)
+
+    def calculate_funnel_metrics(self, filters=None, approximate=False):
+        """Расчет основных метрик воронки (агрегаты уже малы, approximate не требуется)"""
+        totals = self._select(filters).sum(numeric_only=True)
+        avg_times = {
+            key: (totals[f'hours_{key}'] / totals[f'timed_{key}']) if totals.get(f'timed_{key}', 0) > 0 else None
+            for key, _, _ in STAGE_TRANSITIONS
+        }
+        return metrics_from_counts(
+            int(totals.get('registrations', 0)),
+            int(totals.get('deposits', 0)),
+            int(totals.get('first_bets', 0)),
+            int(totals.get('second_deposits', 0)),
+            avg_times
+        )
+
+    def analyze_by_segments(self, filters=None, approximate=False):
+        """Анализ по сегментам"""
+        selected = self._select(filters)
+        results = {}
+        for segment in SEGMENT_COLUMNS:
+            counts = selected.groupby(segment, sort=False)[STAGE_COUNTS].sum()
+            results[segment] = segment_table(
+                counts.index.to_numpy(),
+                counts['registrations'].to_numpy(),
+                counts['deposits'].to_numpy(),
+                counts['first_bets'].to_numpy(),
+                counts['second_deposits'].to_numpy()
+            )
+        return results
+
+    def calculate_strata_counts(self, filters=None):
+        """Счетчики этапов по комбинациям всех сегментов"""
+        return (
+            self._select(filters)
+                .groupby(SEGMENT_COLUMNS, sort=False, dropna=False)[STAGE_COUNTS]
+                .sum()
+                .reset_index()
+        )
+
+    def calculate_daily_strata_counts(self, filters=None):
+        """Счетчики этапов по дням и комбинациям всех сегментов (без строк без даты)"""
+        selected = self._select(filters)
+        return selected.loc[selected['date'].notna(), AGGREGATE_KEYS + STAGE_COUNTS]
+
+    def calculate_daily_metrics(self, filters=None):
+        """Расчет ежедневных метрик (строки без даты регистрации не попадают ни в один день)"""
+        daily = self._select(filters).groupby('date', sort=True, dropna=True)[STAGE_COUNTS].sum()
+        return daily_table(
+            pd.DatetimeIndex(daily.index).date,
+            daily['registrations'].to_numpy(),
+            daily['deposits'].to_numpy(),
+            daily['second_deposits'].to_numpy()
+        )
+
+    def detect_anomalies(self, threshold=0.5, filters=None):
+        """Детекция аномалий по дневным агрегатам"""
+        daily = self.calculate_daily_metrics(filters)
+        daily['conv_rate'] = daily['reg_to_deposit_conv']
+        return find_daily_anomalies(daily, threshold)
+
+    def calculate_cohort_analysis(self, filters=None):
+        """Когортный анализ по парам месяцев с учетом фильтров по сегментам"""
+        if self.cohort_pairs is None:
+            return pd.DataFrame()
+        pairs = PandasEngine().select(self.cohort_pairs, filters) if filters else self.cohort_pairs
+        return cohorts_from_month_counts(
+            pairs['reg_month'],
+            pairs['deposit_month'],
+            pairs['users'].to_numpy(dtype=np.int64)
+        )
@@ -0,0 +1,285 @@
+"""
+Локальный HTTP JSON API для метрик воронки
+
+Сервер на asyncio принимает запросы, а расчеты выполняются в пуле потоков,
+поэтому медленный запрос не блокирует остальные. Готовые ответы хранятся
+в LRU-кэше, ключ - маршрут и нормализованные параметры (порядок значений
+фильтров не важен), так что повторные запросы отдаются без пересчета.
+
+Маршруты (все GET, фильтры - traffic_source, country, device через запятую):
+    /health
+    /metrics/funnel
+    /metrics/segments
+    /metrics/daily
+    /anomalies?threshold=0.5
+    /anomalies/segments?z_threshold=3&max_order=2
+    /cohorts
+
+Запуск:
+    python api.py data.csv --port 8000
+    python run.py --api --data data.csv
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS, available_engines
+from segment_anomalies import Z_THRESHOLD
+from utils import FunnelAnalyzer
+
+API_CACHE_SIZE = 256  # Число ответов в LRU-кэше
+API_WORKERS = 4  # Потоки для расчетов
+SQL_EXTENSIONS = ('.db', '.sqlite', '.sqlite3', '.duckdb')
+
+# Маршрут -> (расчет по анализатору, фильтрам и параметрам, допустимые параметры со значениями по умолчанию)
+ROUTES = {
+    '/metrics/funnel': (
+        lambda analyzer, filters, params: analyzer.calculate_funnel_metrics(filters), {}
+    ),
+    '/metrics/segments': (
+        lambda analyzer, filters, params: analyzer.analyze_by_segments(filters), {}
+    ),
+    '/metrics/daily': (
+        lambda analyzer, filters, params: analyzer.calculate_daily_metrics(filters), {}
+    ),
+    '/anomalies': (
+        lambda analyzer, filters, params: analyzer.detect_anomalies(params['threshold'], filters),
+        {'threshold': 0.5}
+    ),
+    '/anomalies/segments': (
+        lambda analyzer, filters, params: analyzer.detect_segment_anomalies(
+            filters, max_order=int(params['max_order']), z_threshold=params['z_threshold']
+        ),
+        {'z_threshold': Z_THRESHOLD, 'max_order': 2}
+    ),
+    '/cohorts': (
+        lambda analyzer, filters, params: analyzer.calculate_cohort_analysis(filters), {}
+    ),
+}
+
+HTTP_STATUSES = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                 500: 'Internal Server Error'}
+
+
+def normalize_query(path, query):
+    """
+    Разбор строки запроса в фильтры, числовые параметры и ключ кэша
+
+    Значения фильтров принимаются через запятую или повторением параметра,
+    сортируются и очищаются от дубликатов, поэтому ?country=RU,UA и
+    ?country=UA&country=RU дают один и тот же ключ.
+
+    Returns:
+    --------
+    tuple
+        (фильтры или None, параметры, ключ кэша)
+    """
+    _, defaults = ROUTES[path]
+    filters = {}
+    params = dict(defaults)
+
+    for name, raw_values in parse_qs(query, keep_blank_values=True).items():
+        if name in SEGMENT_COLUMNS:
+            values = {value for raw in raw_values for value in raw.split(',') if value}
+            filters[name] = sorted(values)
+        elif name in defaults:
+            try:
+                params[name] = float(raw_values[-1])
+            except ValueError:
+                raise ValueError(f"Параметр {name} должен быть числом")
+        else:
+            raise ValueError(f"Неизвестный параметр: {name}")
+
+    key = (
+        path,
+        tuple((name, tuple(filters[name])) for name in sorted(filters)),
+        tuple(sorted(params.items()))
+    )
+    return filters or None, params, key
+
+
+def to_jsonable(value):
+    """Приведение результатов анализатора (DataFrame, numpy, NaN) к JSON-совместимым типам"""
+    if isinstance(value, pd.DataFrame):
+        return json.loads(value.to_json(orient='records', date_format='iso'))
+    if isinstance(value, dict):
+        return {str(key): to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+class ResponseCache:
+    """Потокобезопасный LRU-кэш готовых ответов"""
+
+    def __init__(self, maxsize=API_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class FunnelAPI:
+    """JSON API поверх загруженного анализатора"""
+
+    def __init__(self, analyzer, cache_size=API_CACHE_SIZE, workers=API_WORKERS):
+        self.analyzer = analyzer
+        self.cache = ResponseCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='funnel-api')
+        # Анализаторы без DataFrame (одно соединение с БД, агрегаты партиций) обслуживаются по очереди
+        self._analyzer_lock = threading.Lock() if analyzer.df is None else None
+
+    def compute(self, path, filters, params):
+        """Расчет ответа (выполняется в пуле потоков)"""
+        compute, _ = ROUTES[path]
+        if self._analyzer_lock is None:
+            result = compute(self.analyzer, filters, params)
+        else:
+            with self._analyzer_lock:
+                result = compute(self.analyzer, filters, params)
+        return json.dumps(to_jsonable(result), ensure_ascii=False).encode('utf-8')
+
+    async def handle(self, method, target):
+        """
+        Обработка запроса
+
+        Returns:
+        --------
+        tuple
+            (HTTP статус, тело ответа в JSON)
+        """
+        if method != 'GET':
+            return 405, _error_body("Поддерживается только GET")
+
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if path == '/health':
+            body = {'status': 'ok', 'cache': {'hits': self.cache.hits, 'misses': self.cache.misses}}
+            return 200, json.dumps(body).encode('utf-8')
+        if path not in ROUTES:
+            return 404, _error_body(f"Неизвестный маршрут: {path}")
+
+        try:
+            filters, params, key = normalize_query(path, url.query)
+        except ValueError as e:
+            return 400, _error_body(str(e))
+
+        body = self.cache.get(key)
+        if body is None:
+            loop = asyncio.get_running_loop()
+            try:
+                body = await loop.run_in_executor(self.executor, self.compute, path, filters, params)
+            except ValueError as e:
+                return 400, _error_body(str(e))
+            except Exception as e:
+                return 500, _error_body(f"Ошибка расчета: {e}")
+            self.cache.put(key, body)
+        return 200, body
+
+    async def _serve_connection(self, reader, writer):
+        """Один HTTP/1.1 запрос на соединение"""
+        try:
+            request_line = await reader.readline()
+            # Заголовки не используются, но должны быть дочитаны
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                status, body = 400, _error_body("Некорректный запрос")
+            else:
+                status, body = await self.handle(parts[0], parts[1])
+
+            writer.write(
+                f"HTTP/1.1 {status} {HTTP_STATUSES[status]}\r\n"
+                f"Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        """Запуск сервера до остановки"""
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='127.0.0.1', port=8000):
+        """Блокирующий запуск сервера"""
+        try:
+            asyncio.run(self.serve(host, port))
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def _error_body(message):
+    return json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+
+
+def load_analyzer(path, engine='pandas', table='users'):
+    """Анализатор для CSV/Parquet файла, папки с партициями dt=YYYY-MM-DD или базы SQLite/DuckDB"""
+    if os.path.isdir(path):
+        from partitions import PartitionedFunnelAnalyzer
+        return PartitionedFunnelAnalyzer(path)
+    if path.lower().endswith(SQL_EXTENSIONS):
+        from sql_backend import SQLFunnelAnalyzer
+        return SQLFunnelAnalyzer(path, table=table)
+    if path.lower().endswith('.parquet'):
+        return FunnelAnalyzer(pd.read_parquet(path), engine=engine)
+    return FunnelAnalyzer(pd.read_csv(path), engine=engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP JSON API для метрик воронки')
+    parser.add_argument('data', help='CSV/Parquet файл, папка с партициями или база SQLite/DuckDB')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--engine', default='pandas', choices=available_engines())
+    parser.add_argument('--table', default='users', help='Таблица в базе данных')
+    parser.add_argument('--cache-size', type=int, default=API_CACHE_SIZE)
+    parser.add_argument('--workers', type=int, default=API_WORKERS)
+    args = parser.parse_args()
+
+    analyzer = load_analyzer(args.data, args.engine, args.table)
+    print(f"🌐 API доступно по адресу: http://{args.host}:{args.port}/metrics/funnel")
+    FunnelAPI(analyzer, args.cache_size, args.workers).run(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
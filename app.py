@@ -4,8 +4,21 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 import numpy as np
-from utils import FunnelAnalyzer, detect_anomalies
+from utils import FunnelAnalyzer
+from engines import available_engines
+from sampling import APPROX_SAMPLE_SIZE
 from generate_mock_data import generate_mock_data
+from live_tail import LiveFunnelAnalyzer
+from partitions import discover_partitions, prune_partitions, partitions_fingerprint, read_partitions
+from date_parsing import parse_datetime_columns
+from workspace import Workspace, hash_bytes, hash_dataframe
+from registry import DatasetRegistry
+from significance import crosstab_matrix
+from survival import survival_summary
+from windows import REPORT_WINDOWS, window_grid
+from comparison import compare_datasets
+from export import (DOWNLOAD_MAX_ROWS, EXPORT_FORMATS, EXPORT_MIME_TYPES, EXPORT_TABLES, export_table,
+                    export_workbook)
 import base64
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
@@ -46,11 +59,78 @@ st.sidebar.markdown("---")
 # Выбор источника данных
 data_source = st.sidebar.radio(
     "Источник данных:",
-    ["Загрузить CSV файл", "Использовать моковые данные"]
+    ["Загрузить CSV файл", "Использовать моковые данные", "Папка с партициями (dt=YYYY-MM-DD)",
+     "Сохраненный набор данных", "Live-режим (папка или файл)"]
 )
 
+# Движок вычислений
+analysis_engine = st.sidebar.selectbox(
+    "Движок анализа:",
+    available_engines(),
+    help="polars выполняет запросы многопоточно и быстрее на больших файлах"
+)
+
+# Карантин: строки, не прошедшие проверку качества, исключаются из анализа
+quarantine_rows = st.sidebar.checkbox(
+    "Исключить проблемные строки",
+    help="Нарушен порядок этапов, пропущен предыдущий этап, повтор user_id, дата в будущем или неразобранная дата"
+)
+dataset_suffix = '-quarantine' if quarantine_rows else ''
+
+
+@st.cache_resource
+def get_workspace():
+    """Рабочее пространство с сохраненными наборами (общее для всех сессий)"""
+    try:
+        return Workspace()
+    except (ImportError, OSError):
+        return None
+
+
+@st.cache_resource
+def get_registry():
+    """Реестр наборов данных в памяти сервера (один анализатор на набор для всех сессий)"""
+    return DatasetRegistry()
+
+
+def open_shared(key, loader, name=None, slot='dataset_lease'):
+    """
+    Общий анализатор набора данных; сессия держит аренду одного набора на слот
+    (основной набор и набор для сравнения)
+    
+    loader вызывается, только если набора с этим движком еще нет в памяти сервера
+    """
+    shared_key = (key, analysis_engine)
+    lease = st.session_state.get(slot)
+    if lease is None or lease.released or lease.key != shared_key:
+        # Предыдущий набор освобождается и выгружается, если его не держат другие сессии
+        if lease is not None:
+            lease.release()
+            del st.session_state[slot]
+        st.session_state[slot] = registry.acquire(shared_key, loader, name)
+    return st.session_state[slot].analyzer
+
+
+def prepare_overview(loaded):
+    """Сводка и графики обзора - часть подготовки набора (один раз на набор)"""
+    loaded.create_overview_charts()
+    return loaded
+
+
+def load_saved(key):
+    """Загрузчик сохраненного набора из рабочего пространства"""
+    return lambda: prepare_overview(workspace.load(key, analysis_engine))
+
+
+workspace = get_workspace()
+registry = get_registry()
+
 # Инициализация данных
 df = None
+live_analyzer = None
+analyzer = None
+dataset_key = None
+dataset_name = None
 
 if data_source == "Загрузить CSV файл":
     uploaded_file = st.sidebar.file_uploader(
@@ -61,11 +141,18 @@ if data_source == "Загрузить CSV файл":
     
     if uploaded_file is not None:
         try:
-            df = pd.read_csv(uploaded_file)
+            content = uploaded_file.getvalue()
+            dataset_key, dataset_name = hash_bytes(content) + dataset_suffix, uploaded_file.name
+            if (dataset_key, analysis_engine) in registry or (workspace is not None and dataset_key in workspace):
+                # Файл уже загружался: общий анализатор из памяти сервера или рабочего пространства
+                analyzer = open_shared(dataset_key, load_saved(dataset_key), dataset_name)
+                df = analyzer.df
+            else:
+                df = pd.read_csv(io.BytesIO(content))
             st.sidebar.success(f"✅ Файл загружен: {len(df)} записей")
         except Exception as e:
             st.sidebar.error(f"❌ Ошибка загрузки файла: {str(e)}")
-else:
+elif data_source == "Использовать моковые данные":
     # Параметры для генерации моковых данных
     st.sidebar.subheader("Параметры генерации данных")
     n_users = st.sidebar.slider("Количество пользователей", 1000, 10000, 5000, 500)
@@ -73,10 +160,186 @@ else:
     if st.sidebar.button("🎲 Сгенерировать данные"):
         with st.spinner("Генерация данных..."):
             df = generate_mock_data(n_users)
+            dataset_key, dataset_name = hash_dataframe(df) + dataset_suffix, f"Моковые данные ({n_users} пользователей)"
             st.sidebar.success(f"✅ Данные сгенерированы: {len(df)} записей")
+elif data_source == "Папка с партициями (dt=YYYY-MM-DD)":
+    partitions_path = st.sidebar.text_input(
+        "Путь к папке с партициями",
+        help="Папки dt=YYYY-MM-DD с CSV или Parquet файлами за день"
+    )
+    
+    if partitions_path:
+        partitions = discover_partitions(partitions_path)
+        if not partitions:
+            st.sidebar.error("❌ Партиции dt=YYYY-MM-DD не найдены")
+        else:
+            partition_dates = list(partitions)
+            date_range = st.sidebar.date_input(
+                "Период",
+                value=(partition_dates[0].date(), partition_dates[-1].date()),
+                min_value=partition_dates[0].date(),
+                max_value=partition_dates[-1].date()
+            )
+            # Пока выбрана только начальная дата, период состоит из одного дня
+            range_start, range_end = (tuple(date_range) * 2)[:2] if date_range else (None, None)
+            
+            try:
+                # Ключ - по метаданным файлов выбранных партиций: при перезапуске скрипта
+                # уже открытый диапазон не перечитывается и не хешируется
+                dataset_key = partitions_fingerprint(
+                    prune_partitions(partitions, range_start, range_end)
+                ) + dataset_suffix
+                dataset_name = f"{os.path.basename(os.path.normpath(partitions_path))} ({range_start} - {range_end})"
+                if (dataset_key, analysis_engine) in registry or (workspace is not None and dataset_key in workspace):
+                    analyzer = open_shared(dataset_key, load_saved(dataset_key), dataset_name)
+                    df = analyzer.df
+                else:
+                    df = read_partitions(partitions_path, range_start, range_end)
+                st.sidebar.success(f"✅ Загружено: {len(df)} записей")
+            except Exception as e:
+                st.sidebar.error(f"❌ Ошибка загрузки партиций: {str(e)}")
+elif data_source == "Сохраненный набор данных":
+    saved = workspace.list() if workspace is not None else []
+    if not saved:
+        st.sidebar.info("Сохраненных наборов пока нет: загрузите файл или сгенерируйте данные")
+    else:
+        st.sidebar.caption(
+            f"Занято: {sum(item['size_bytes'] for item in saved) / 2**20:.1f} МБ "
+            f"из {workspace.budget_bytes / 2**20:.0f} МБ"
+        )
+        entry = st.sidebar.selectbox(
+            "Набор данных",
+            saved,
+            format_func=lambda item: f"{item['name']} - {item['rows']:,} записей, {item['size_bytes'] / 2**20:.1f} МБ"
+        )
+        try:
+            analyzer = open_shared(entry['key'], load_saved(entry['key']), entry['name'])
+            df = analyzer.df
+            dataset_name = entry['name']
+            st.sidebar.success(f"✅ Набор открыт: {len(df)} записей")
+        except Exception as e:
+            st.sidebar.error(f"❌ Ошибка открытия набора: {str(e)}")
+else:
+    # Live-режим: растущий CSV/JSONL файл или папка, в которую поступают новые файлы
+    st.sidebar.subheader("Параметры live-режима")
+    live_path = st.sidebar.text_input(
+        "Путь к файлу или папке",
+        help="CSV или JSONL файл, который дописывается, либо папка с новыми файлами"
+    )
+    refresh_seconds = st.sidebar.slider("Интервал обновления (сек)", 5, 120, 15, 5)
+    
+    if live_path:
+        if not os.path.exists(live_path):
+            st.sidebar.error("❌ Путь не найден")
+        else:
+            # Анализатор хранит смещения файлов и агрегаты между перезапусками скрипта
+            if st.session_state.get('live_path') != live_path:
+                st.session_state['live_path'] = live_path
+                st.session_state['live_analyzer'] = LiveFunnelAnalyzer(live_path)
+            live_analyzer = st.session_state['live_analyzer']
+
+# Набор B для сравнения - из сохраненных в рабочем пространстве
+comparison_analyzer = None
+comparison_name = None
+# Варианты - ключи наборов: записи рабочего пространства меняются при каждом открытии (last_access)
+comparison_candidates = {item['key']: item for item in workspace.list()} if workspace is not None else {}
+if comparison_candidates and live_analyzer is None:
+    st.sidebar.subheader("🆚 Сравнение наборов")
+    comparison_key = st.sidebar.selectbox(
+        "Набор B для сравнения",
+        [None] + sorted(comparison_candidates, key=lambda key: comparison_candidates[key]['name']),
+        format_func=lambda key: (
+            "Без сравнения" if key is None
+            else f"{comparison_candidates[key]['name']} - {comparison_candidates[key]['rows']:,} записей"
+        )
+    )
+    if comparison_key is not None:
+        comparison_entry = comparison_candidates[comparison_key]
+        try:
+            comparison_analyzer = open_shared(
+                comparison_entry['key'], load_saved(comparison_entry['key']), comparison_entry['name'],
+                slot='comparison_lease'
+            )
+            comparison_name = comparison_entry['name']
+        except Exception as e:
+            st.sidebar.error(f"❌ Ошибка открытия набора для сравнения: {str(e)}")
+if comparison_analyzer is None and st.session_state.get('comparison_lease') is not None:
+    # Сравнение выключено: аренда набора B освобождается
+    st.session_state['comparison_lease'].release()
+    del st.session_state['comparison_lease']
+
+# Общие наборы данных в памяти сервера
+shared_datasets = registry.entries()
+if shared_datasets:
+    st.sidebar.caption(
+        f"📦 Наборов в памяти сервера: {len(shared_datasets)}, "
+        f"открыто в сессиях: {sum(item['sessions'] for item in shared_datasets)}"
+    )
 
 # Основной интерфейс
-if df is not None:
+if live_analyzer is not None:
+    st.header("📡 Live-мониторинг воронки")
+    
+    @st.fragment(run_every=refresh_seconds)
+    def live_dashboard():
+        # Перерисовывается только этот фрагмент, читаются только новые строки
+        new_rows = live_analyzer.refresh()
+        st.caption(
+            f"Обновлено: {live_analyzer.last_refresh.strftime('%H:%M:%S')} | "
+            f"всего записей: {live_analyzer.rows_ingested:,} | новых: {new_rows:,}"
+        )
+        
+        live_metrics = live_analyzer.calculate_funnel_metrics()
+        if live_metrics['counts']['registrations'] == 0:
+            st.info("⏳ Ожидание данных...")
+            return
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Регистрации", f"{live_metrics['counts']['registrations']:,}")
+        with col2:
+            st.metric("Регистрация → Депозит", f"{live_metrics['conversions']['reg_to_deposit']:.1f}%")
+        with col3:
+            st.metric("Депозит → Ставка", f"{live_metrics['conversions']['deposit_to_bet']:.1f}%")
+        with col4:
+            st.metric("Общая конверсия", f"{live_metrics['conversions']['overall_conversion']:.1f}%")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.plotly_chart(live_analyzer.create_funnel_chart(live_metrics), use_container_width=True)
+        with col2:
+            live_daily = live_analyzer.calculate_daily_metrics()
+            fig_live_trend = px.line(
+                live_daily,
+                x='date',
+                y='reg_to_deposit_conv',
+                title="Конверсия регистрация → депозит по дням",
+                markers=True
+            )
+            st.plotly_chart(fig_live_trend, use_container_width=True)
+        
+        live_segments = live_analyzer.analyze_by_segments()
+        segment_cols = st.columns(len(live_segments))
+        for segment_col, (segment_name, segment_df) in zip(segment_cols, live_segments.items()):
+            with segment_col:
+                st.write(f"**{segment_name.upper()}:**")
+                st.dataframe(
+                    segment_df[['segment_value', 'users', 'reg_to_deposit_conv']],
+                    use_container_width=True
+                )
+        
+        live_anomalies = live_analyzer.detect_segment_anomalies()
+        if live_anomalies.empty:
+            st.success("✅ Аномалий по сегментам не обнаружено")
+        else:
+            st.warning(f"🚨 Аномалий по сегментам: {len(live_anomalies)}")
+            st.dataframe(live_anomalies.head(20), use_container_width=True)
+    
+    live_dashboard()
+    
+    if st.button("🔄 Обновить сейчас"):
+        st.rerun()
+elif df is not None:
     # Проверка структуры данных
     required_columns = ['user_id', 'registration_time', 'deposit_time', 'first_bet_time', 
                        'second_deposit_time', 'traffic_source', 'country', 'device']
@@ -87,53 +350,109 @@ if df is not None:
         st.error(f"❌ Отсутствуют обязательные поля: {', '.join(missing_columns)}")
         st.stop()
     
-    # Преобразование дат
-    date_columns = ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
-    for col in date_columns:
-        df[col] = pd.to_datetime(df[col], errors='coerce')
+    # Сохраненные наборы уже подготовлены: разбор дат и подготовка пропускаются
+    if analyzer is None:
+        if quarantine_rows and dataset_name is not None:
+            dataset_name += " (без проблемных строк)"
+        
+        def build_analyzer(raw_df=df):
+            # Преобразование дат: формат определяется один раз по выборке, типизированные столбцы не трогаются
+            date_columns = ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
+            parsed_df, date_parse_report = parse_datetime_columns(raw_df, date_columns)
+            
+            failed_dates = {col: info for col, info in date_parse_report.items() if info['failed']}
+            if failed_dates:
+                st.warning(
+                    "⚠️ Не удалось разобрать даты: " + "; ".join(
+                        f"{col} - {info['failed']} строк (например: {', '.join(info['examples'][:3])})"
+                        for col, info in failed_dates.items()
+                    )
+                )
+            ambiguous_dates = {col: info['warning'] for col, info in date_parse_report.items() if info['warning']}
+            if ambiguous_dates:
+                st.warning("⚠️ " + "; ".join(f"{col}: {warning}" for col, warning in ambiguous_dates.items()))
+            
+            # Создание анализатора (с проверкой качества данных)
+            built = FunnelAnalyzer(parsed_df, engine=analysis_engine, quarantine=quarantine_rows, raw=raw_df)
+            
+            # Подготовленный набор сохраняется для следующих сессий
+            if workspace is not None and dataset_key is not None:
+                try:
+                    workspace.save(dataset_key, built, dataset_name)
+                except Exception as e:
+                    st.sidebar.warning(f"⚠️ Набор не сохранен в рабочее пространство: {str(e)}")
+            return prepare_overview(built)
+        
+        # Набор с известным ключом - общий для всех сессий сервера
+        analyzer = open_shared(dataset_key, build_analyzer, dataset_name) if dataset_key is not None else build_analyzer()
+        # Сессия работает с данными анализатора, а не со своей копией (без строк карантина)
+        df = analyzer.df
     
-    # Создание анализатора
-    analyzer = FunnelAnalyzer(df)
+    # Фильтры задаются на вкладке анализа воронки; отчет и выгрузка используют их же
+    filters = None
     
     # Вкладки
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 Обзор данных", "🔄 Анализ воронки", "⚠️ Детекция аномалий", "📄 Отчет"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(
+        ["📊 Обзор данных", "🔄 Анализ воронки", "⚠️ Детекция аномалий", "📄 Отчет", "🆚 Сравнение A/B"]
+    )
     
     with tab1:
         st.header("📊 Обзор данных")
         
+        # Сводка и графики считаются один раз на набор и хранятся в общем анализаторе
+        overview = analyzer.calculate_overview()
+        overview_charts = analyzer.create_overview_charts()
+        
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Всего пользователей", len(df))
+            st.metric("Всего пользователей", overview['users'])
         
         with col2:
-            depositors = len(df[df['deposit_time'].notna()])
-            st.metric("Депозитчики", depositors)
+            st.metric("Депозитчики", overview['depositors'])
         
         with col3:
-            bettors = len(df[df['first_bet_time'].notna()])
-            st.metric("Сделали ставку", bettors)
+            st.metric("Сделали ставку", overview['bettors'])
         
         with col4:
-            second_depositors = len(df[df['second_deposit_time'].notna()])
-            st.metric("Второй депозит", second_depositors)
+            st.metric("Второй депозит", overview['second_depositors'])
+        
+        # Качество данных
+        quality_labels = {
+            'order_violation': 'Этап раньше предыдущего',
+            'orphaned_stage': 'Этап без предыдущего',
+            'duplicate_user': 'Повтор user_id',
+            'future_timestamp': 'Дата в будущем',
+            'unparseable_date': 'Неразобранная дата'
+        }
+        problem_rows = int(analyzer.quality['quarantine'].sum())
+        with st.expander(
+            f"🧪 Качество данных: {'проблем не найдено' if not problem_rows else f'{problem_rows:,} проблемных строк'}"
+            + (" (исключены из анализа)" if analyzer.quarantine and problem_rows else "")
+        ):
+            st.dataframe(
+                pd.DataFrame({
+                    'Проверка': [quality_labels[check] for check in analyzer.quality['counts']],
+                    'Строк': list(analyzer.quality['counts'].values())
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+            for check, examples in analyzer.quality['examples'].items():
+                if not examples.empty:
+                    st.write(f"**{quality_labels[check]}** - примеры:")
+                    st.dataframe(examples, use_container_width=True)
         
         # Распределения
         col1, col2 = st.columns(2)
         
         with col1:
             st.subheader("Распределение по источникам трафика")
-            traffic_dist = df['traffic_source'].value_counts()
-            fig_traffic = px.pie(values=traffic_dist.values, names=traffic_dist.index, 
-                               title="Источники трафика")
-            st.plotly_chart(fig_traffic, use_container_width=True)
+            st.plotly_chart(overview_charts['traffic_source'], use_container_width=True)
         
         with col2:
             st.subheader("Распределение по странам")
-            country_dist = df['country'].value_counts()
-            fig_country = px.bar(x=country_dist.index, y=country_dist.values, 
-                               title="Страны")
-            st.plotly_chart(fig_country, use_container_width=True)
+            st.plotly_chart(overview_charts['country'], use_container_width=True)
         
         # Таблица с данными
         st.subheader("Просмотр данных")
@@ -166,19 +485,83 @@ if df is not None:
                 default=df['device'].unique()
             )
         
-        # Фильтрация данных
-        filtered_df = df[
-            (df['traffic_source'].isin(selected_traffic)) &
-            (df['country'].isin(selected_countries)) &
-            (df['device'].isin(selected_devices))
-        ]
+        # Диапазон дат регистрации: срез по отсортированному индексу анализатора
+        registration_times = analyzer.registration_times
+        if len(registration_times):
+            first_date = pd.Timestamp(registration_times[0]).date()
+            last_date = pd.Timestamp(registration_times[-1]).date()
+            registration_range = st.date_input(
+                "Период регистрации",
+                value=(first_date, last_date),
+                min_value=first_date,
+                max_value=last_date
+            )
+        else:
+            registration_range = ()
+        
+        # Фильтрация данных выполняется движком анализатора
+        filters = {
+            'traffic_source': selected_traffic,
+            'country': selected_countries,
+            'device': selected_devices
+        }
+        if len(registration_range) == 2:
+            filters['registration_date'] = tuple(registration_range)
+        
+        # Быстрая оценка по выборке, которая затем заменяется точным результатом
+        approximate_mode = st.checkbox(
+            "⚡ Сначала показывать оценку по выборке",
+            value=len(df) > APPROX_SAMPLE_SIZE,
+            help="Оценка с 95% доверительными интервалами строится по стратифицированной выборке "
+                 "и уточняется до точных значений после полного расчета"
+        )
+        
+        if approximate_mode:
+            estimate_placeholder = st.empty()
+            with estimate_placeholder.container():
+                approx_metrics = analyzer.calculate_funnel_metrics(filters, approximate=True)
+                st.info(
+                    f"⏳ Предварительная оценка по выборке из {approx_metrics['sample']['size']:,} "
+                    f"пользователей, точный расчет выполняется..."
+                )
+                
+                approx_cols = st.columns(4)
+                approx_labels = [
+                    ("Регистрация → Депозит", 'reg_to_deposit'),
+                    ("Депозит → Ставка", 'deposit_to_bet'),
+                    ("Ставка → Второй депозит", 'bet_to_second_deposit'),
+                    ("Общая конверсия", 'overall_conversion')
+                ]
+                for approx_col, (label, key) in zip(approx_cols, approx_labels):
+                    low, high = approx_metrics['intervals'][key]
+                    with approx_col:
+                        st.metric(
+                            f"{label} (оценка)",
+                            f"≈{approx_metrics['conversions'][key]:.1f}%",
+                            help=f"95% доверительный интервал: {low:.1f}% – {high:.1f}%"
+                        )
+                        st.caption(f"{low:.1f}% – {high:.1f}%")
+                
+                approx_segments = analyzer.analyze_by_segments(filters, approximate=True)
+                for segment_name, segment_df in approx_segments.items():
+                    st.write(f"**{segment_name.upper()} (оценка):**")
+                    st.dataframe(
+                        segment_df[['segment_value', 'users', 'reg_to_deposit_conv',
+                                    'reg_to_deposit_conv_low', 'reg_to_deposit_conv_high']],
+                        use_container_width=True
+                    )
+        
+        # Анализ воронки
+        funnel_metrics = analyzer.calculate_funnel_metrics(filters)
+        segment_analysis = analyzer.analyze_by_segments(filters)
+        
+        # Точный результат готов: оценка убирается
+        if approximate_mode:
+            estimate_placeholder.empty()
         
-        if len(filtered_df) == 0:
+        if funnel_metrics['counts']['registrations'] == 0:
             st.warning("⚠️ Нет данных для выбранных фильтров")
         else:
-            # Анализ воронки
-            funnel_metrics = analyzer.calculate_funnel_metrics(filtered_df)
-            
             # Метрики воронки
             st.subheader("📈 Метрики воронки")
             
@@ -231,24 +614,272 @@ if df is not None:
                             title="Среднее время между этапами")
             st.plotly_chart(fig_time, use_container_width=True)
             
+            # Кривые Каплана-Мейера: не сделавшие следующий шаг учитываются как цензурированные
+            st.subheader("⏳ Время до конверсии (Каплан-Мейер)")
+            st.caption(
+                "Среднее время выше считается только по дошедшим до этапа. Кривая учитывает и тех, "
+                "кто еще не сделал следующий шаг, - до последней даты в данных."
+            )
+            
+            transition_labels = {
+                'reg_to_deposit': 'Регистрация → Депозит',
+                'deposit_to_bet': 'Депозит → Ставка',
+                'bet_to_second_deposit': 'Ставка → Второй депозит'
+            }
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                survival_transition = st.selectbox(
+                    "Переход", list(transition_labels), format_func=transition_labels.get
+                )
+            
+            with col2:
+                survival_dimension = st.selectbox(
+                    "Разрез", ['all', 'traffic_source', 'country', 'device'],
+                    format_func=lambda name: 'Все пользователи' if name == 'all' else name
+                )
+            
+            survival = analyzer.calculate_survival_curves(filters)
+            survival = survival[
+                (survival['transition'] == survival_transition) &
+                (survival['dimension'] == survival_dimension)
+            ].assign(conversion=lambda curves: (1 - curves['survival']) * 100)
+            
+            if survival.empty:
+                st.info("Нет пользователей, дошедших до начального этапа перехода")
+            else:
+                fig_survival = px.line(
+                    survival,
+                    x='hours',
+                    y='conversion',
+                    color='segment_value',
+                    line_shape='hv',
+                    labels={'hours': 'Часы', 'conversion': 'Сделали переход, %', 'segment_value': 'Сегмент'},
+                    title=f"Доля сделавших переход: {transition_labels[survival_transition]}"
+                )
+                st.plotly_chart(fig_survival, use_container_width=True)
+                
+                survival_table = survival_summary(survival).drop(columns=['transition', 'dimension'])
+                st.dataframe(
+                    survival_table.rename(columns={
+                        'segment_value': 'Сегмент',
+                        'users': 'Пользователи',
+                        'events': 'Сделали переход',
+                        'censored': 'Цензурировано',
+                        'median_hours': 'Медиана, ч',
+                        'conversion_24h': 'За 24 ч, %',
+                        'conversion_72h': 'За 72 ч, %',
+                        'conversion_168h': 'За 7 дней, %'
+                    }),
+                    use_container_width=True
+                )
+            
+            # Конверсия в окне для тех же перехода и разреза: вся сетка окон - одна сортировка
+            st.subheader("🪟 Конверсия в окне")
+            
+            windows = np.union1d(window_grid(), REPORT_WINDOWS)
+            windowed = analyzer.calculate_window_conversion(windows, filters)
+            windowed = windowed[
+                (windowed['transition'] == survival_transition) &
+                (windowed['dimension'] == survival_dimension)
+            ]
+            
+            if windowed.empty:
+                st.info("Нет пользователей, дошедших до начального этапа перехода")
+            else:
+                fig_windows = px.line(
+                    windowed,
+                    x='window_hours',
+                    y='conversion',
+                    color='segment_value',
+                    labels={'window_hours': 'Окно, часы', 'conversion': 'Конверсия в окне, %', 'segment_value': 'Сегмент'},
+                    title=f"Конверсия в зависимости от окна: {transition_labels[survival_transition]}"
+                )
+                st.plotly_chart(fig_windows, use_container_width=True)
+                
+                window_labels = {1: 'За 1 ч, %', 24: 'За 24 ч, %', 168: 'За 7 дней, %'}
+                window_table = (
+                    windowed[windowed['window_hours'].isin(REPORT_WINDOWS)]
+                        .pivot(index=['segment_value', 'started'], columns='window_hours', values='conversion')
+                        .rename(columns=lambda hours: window_labels.get(hours, f'За {hours:g} ч, %'))
+                        .reset_index()
+                        .rename(columns={'segment_value': 'Сегмент', 'started': 'Дошли до этапа'})
+                )
+                window_table.columns.name = None
+                st.dataframe(window_table, use_container_width=True, hide_index=True)
+            
             # Анализ по сегментам
             st.subheader("🎯 Анализ по сегментам")
             
-            segment_analysis = analyzer.analyze_by_segments(filtered_df)
+            # Интервалы и значимость для всех значений сегментов и их пар
+            significance = analyzer.analyze_segment_significance(filters)
             
             for segment_name, segment_df in segment_analysis.items():
                 st.write(f"**{segment_name.upper()}:**")
                 
-                # График конверсий по сегменту
+                segment_significance = significance[significance['dimension'] == segment_name]
+                segment_df = segment_df.merge(
+                    segment_significance[['segment_value', 'reg_to_deposit_conv_low',
+                                          'reg_to_deposit_conv_high', 'reg_to_deposit_conv_significant']],
+                    on='segment_value', how='left'
+                )
+                segment_df['error_plus'] = segment_df['reg_to_deposit_conv_high'] - segment_df['reg_to_deposit_conv']
+                segment_df['error_minus'] = segment_df['reg_to_deposit_conv'] - segment_df['reg_to_deposit_conv_low']
+                segment_df['Отличие от среднего'] = np.where(
+                    segment_df['reg_to_deposit_conv_significant'].fillna(False).astype(bool),
+                    'значимо', 'не значимо'
+                )
+                
+                # График конверсий по сегменту с 95% доверительными интервалами
                 fig_segment = px.bar(
                     segment_df, 
                     x='segment_value', 
                     y='reg_to_deposit_conv',
                     title=f"Конверсия в депозит по {segment_name}",
-                    text='reg_to_deposit_conv'
+                    text='reg_to_deposit_conv',
+                    error_y='error_plus',
+                    error_y_minus='error_minus',
+                    color='Отличие от среднего',
+                    color_discrete_map={'значимо': '#d62728', 'не значимо': '#1f77b4'}
                 )
                 fig_segment.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
                 st.plotly_chart(fig_segment, use_container_width=True)
+            
+            with st.expander("📐 Значимые отклонения сегментов и их комбинаций"):
+                st.caption(
+                    "Конверсия в депозит каждого значения сегмента и каждой пары сегментов "
+                    "сравнивается с общей конверсией. Поправка на множественные сравнения: "
+                    "Бенджамини-Хохберг, q < 0.05."
+                )
+                significant_cells = significance[significance['reg_to_deposit_conv_significant']]
+                if significant_cells.empty:
+                    st.info("Значимых отклонений не найдено")
+                else:
+                    st.dataframe(
+                        significant_cells.sort_values('reg_to_deposit_conv_q_value')[[
+                            'dimension', 'segment_value', 'users', 'reg_to_deposit_conv',
+                            'reg_to_deposit_conv_low', 'reg_to_deposit_conv_high',
+                            'reg_to_deposit_conv_q_value'
+                        ]],
+                        use_container_width=True
+                    )
+            
+            # Пересечение двух сегментов: все ячейки из одной группировки счетчиков страт
+            st.subheader("🧩 Пересечение сегментов")
+            
+            conversion_labels = {
+                'reg_to_deposit_conv': 'Регистрация → Депозит',
+                'deposit_to_bet_conv': 'Депозит → Ставка',
+                'bet_to_second_deposit_conv': 'Ставка → Второй депозит',
+                'overall_conv': 'Общая конверсия'
+            }
+            segment_names = ['traffic_source', 'country', 'device']
+            
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                crosstab_rows = st.selectbox("Строки", segment_names, index=0)
+            
+            with col2:
+                crosstab_columns = st.selectbox(
+                    "Столбцы", [name for name in segment_names if name != crosstab_rows]
+                )
+            
+            with col3:
+                crosstab_value = st.selectbox(
+                    "Конверсия", list(conversion_labels), format_func=conversion_labels.get
+                )
+            
+            crosstab = analyzer.analyze_segment_crosstab(crosstab_rows, crosstab_columns, filters)
+            if crosstab.empty:
+                st.info("Нет пользователей с заполненными значениями обоих сегментов")
+            else:
+                crosstab_values = crosstab_matrix(crosstab, crosstab_value)
+                crosstab_users = crosstab_matrix(crosstab, 'registrations')
+                # Значимые отличия от общей конверсии отмечены *, пустые комбинации - без подписи
+                crosstab_significant = crosstab_matrix(crosstab, f'{crosstab_value}_significant').fillna(False)
+                crosstab_text = (
+                    crosstab_values.map(lambda value: f"{value:.1f}")
+                    + crosstab_significant.map(lambda significant: '*' if significant else '')
+                ).where(crosstab_values.notna(), '')
+                
+                fig_crosstab = go.Figure(go.Heatmap(
+                    z=crosstab_values.to_numpy(),
+                    x=crosstab_values.columns.astype(str),
+                    y=crosstab_values.index.astype(str),
+                    text=crosstab_text.to_numpy(),
+                    texttemplate='%{text}',
+                    customdata=crosstab_users.to_numpy(),
+                    hovertemplate='%{y} × %{x}<br>Конверсия: %{z:.1f}%<br>Пользователи: %{customdata}<extra></extra>',
+                    colorscale='RdYlGn',
+                    colorbar={'title': '%'},
+                    hoverongaps=False
+                ))
+                fig_crosstab.update_layout(
+                    title=f"{conversion_labels[crosstab_value]}: {crosstab_rows} × {crosstab_columns}",
+                    xaxis_title=crosstab_columns,
+                    yaxis_title=crosstab_rows,
+                    height=max(400, 28 * len(crosstab_values.index) + 150)
+                )
+                st.plotly_chart(fig_crosstab, use_container_width=True)
+                st.caption(
+                    f"Заполнено комбинаций: {len(crosstab)} из {crosstab_values.size}. "
+                    "* - конверсия значимо отличается от общей (Бенджамини-Хохберг, q < 0.05)."
+                )
+    
+            # Когортный треугольник: куб строится один раз на набор, срезы - выборка из куба
+            st.subheader("👥 Когорты по дням и неделям")
+            st.caption(
+                "Доля когорты, дошедшей до этапа к N-му дню (неделе) после регистрации, по всему набору. "
+                "Пустые ячейки - срок еще не наступил."
+            )
+            
+            cohort_stage_labels = {
+                'deposits': 'Депозит',
+                'first_bets': 'Первая ставка',
+                'second_deposits': 'Второй депозит'
+            }
+            cohort_cube = analyzer.calculate_cohort_cube()
+            
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                cohort_stage = st.selectbox(
+                    "Этап когорт", list(cohort_stage_labels), format_func=cohort_stage_labels.get
+                )
+            
+            with col2:
+                cohort_period = st.selectbox(
+                    "Когорты", ['day', 'week'], format_func={'day': 'По дням', 'week': 'По неделям'}.get
+                )
+            
+            with col3:
+                cohort_dimension = st.selectbox(
+                    "Срез когорт", list(cohort_cube['values']),
+                    format_func=lambda name: 'Все пользователи' if name == 'all' else name
+                )
+            
+            with col4:
+                cohort_value = st.selectbox("Значение среза", cohort_cube['values'][cohort_dimension])
+            
+            triangle = analyzer.calculate_cohort_triangle(
+                cohort_stage, cohort_period, cohort_dimension, cohort_value
+            )
+            if triangle.empty:
+                st.info("Нет пользователей с датой регистрации")
+            else:
+                offset_label = 'День после регистрации' if cohort_period == 'day' else 'Неделя после регистрации'
+                fig_cohorts = px.imshow(
+                    triangle.drop(columns='users'),
+                    y=triangle.index.strftime('%Y-%m-%d'),
+                    labels={'x': offset_label, 'y': 'Когорта', 'color': '%'},
+                    color_continuous_scale='Blues',
+                    aspect='auto',
+                    title=f"{cohort_stage_labels[cohort_stage]}: доля когорты нарастающим итогом"
+                )
+                fig_cohorts.update_layout(height=max(400, min(1200, 12 * len(triangle) + 150)))
+                st.plotly_chart(fig_cohorts, use_container_width=True)
     
     with tab3:
         st.header("⚠️ Детекция аномалий")
@@ -266,35 +897,110 @@ if df is not None:
             )
         
         with col2:
+            comparison_options = {
+                "Предыдущий день": ('day', 'previous'),
+                "Предыдущая неделя": ('week', 'previous'),
+                "Предыдущий месяц": ('month', 'previous'),
+                "Тот же день недели": ('day', 'same_weekday')
+            }
             comparison_period = st.selectbox(
                 "Период сравнения",
-                ["Предыдущий день", "Предыдущая неделя", "Предыдущий месяц"]
+                list(comparison_options),
+                help="Неделя и месяц сравниваются по регистрациям в среднем за день, "
+                     "поэтому неполный период не считается падением"
             )
         
+        # Сравнение - поиск в сводках по дням, неделям и месяцам, построенных один раз на набор
+        rollup_period, comparison_mode = comparison_options[comparison_period]
+        period_comparison = analyzer.compare_periods(rollup_period, comparison_mode)
+        
         # Детекция аномалий
-        anomalies = detect_anomalies(df, threshold=anomaly_threshold/100)
+        anomalies = analyzer.detect_period_anomalies(
+            threshold=anomaly_threshold/100, period=rollup_period, mode=comparison_mode
+        )
         
         if anomalies:
             st.error("🚨 Обнаружены аномалии:")
             for anomaly in anomalies:
                 st.warning(f"• {anomaly}")
+        elif period_comparison.empty:
+            st.info("Недостаточно данных: нет ни одной пары периодов для сравнения")
         else:
             st.success("✅ Аномалий не обнаружено")
         
-        # Тренды конверсий по дням
+        # Тренды конверсий по выбранным периодам
         st.subheader("📈 Тренды конверсий")
         
-        daily_metrics = analyzer.calculate_daily_metrics(df)
-        
-        if not daily_metrics.empty:
+        if not period_comparison.empty:
+            period_labels = {'day': 'дням', 'week': 'неделям', 'month': 'месяцам'}
             fig_trends = px.line(
-                daily_metrics, 
-                x='date', 
-                y='reg_to_deposit_conv',
-                title="Конверсия регистрация → депозит по дням",
+                period_comparison.rename(columns={
+                    'reg_to_deposit_conv': 'Период',
+                    'reg_to_deposit_conv_before': comparison_period
+                }),
+                x='period_start',
+                y=['Период', comparison_period],
+                title=f"Конверсия регистрация → депозит по {period_labels[rollup_period]}",
+                labels={'period_start': 'Начало периода', 'value': 'Конверсия, %', 'variable': ''},
                 markers=True
             )
             st.plotly_chart(fig_trends, use_container_width=True)
+            
+            with st.expander("📋 Сравнение периодов"):
+                st.dataframe(
+                    period_comparison.rename(columns={
+                        'period_start': 'Начало периода',
+                        'compared_start': 'Период сравнения',
+                        'days': 'Дней',
+                        'registrations': 'Регистрации',
+                        'registrations_before': 'Регистрации (сравнение)',
+                        'registrations_change': 'Регистрации в день, изм. %',
+                        'reg_to_deposit_conv': 'Конверсия, %',
+                        'reg_to_deposit_conv_before': 'Конверсия (сравнение), %',
+                        'conv_change': 'Изменение конверсии, %',
+                        'conv_change_pp': 'Изменение конверсии, п.п.'
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
+        
+        # Аномалии по сегментам и их парам
+        st.subheader("🔍 Аномалии по сегментам")
+        
+        segment_z_threshold = st.slider(
+            "Порог z-оценки",
+            min_value=2.0,
+            max_value=6.0,
+            value=3.0,
+            step=0.5,
+            help="Отклонение дня от EWMA-базы ряда в стандартных отклонениях"
+        )
+        
+        segment_anomalies = analyzer.detect_segment_anomalies(z_threshold=segment_z_threshold)
+        
+        if segment_anomalies.empty:
+            st.success("✅ Аномалий по сегментам не обнаружено")
+        else:
+            st.caption(
+                "Проверяются все сегменты и их пары (страна, источник, устройство, источник × страна и т.д.). "
+                "Влияние - депозиты или регистрации сверх ожидания, отрицательное значение означает потери."
+            )
+            segment_anomalies_view = segment_anomalies.head(50).rename(columns={
+                'dimension': 'Сегмент',
+                'segment_value': 'Значение',
+                'date': 'Дата',
+                'metric': 'Метрика',
+                'registrations': 'Регистрации',
+                'actual': 'Факт',
+                'expected': 'Ожидание',
+                'z_score': 'z',
+                'impact': 'Влияние'
+            })
+            segment_anomalies_view['Метрика'] = segment_anomalies_view['Метрика'].map({
+                'deposit_conversion': 'Конверсия в депозит, %',
+                'registrations': 'Регистрации'
+            })
+            st.dataframe(segment_anomalies_view, use_container_width=True)
     
     with tab4:
         st.header("📄 Генерация отчета")
@@ -319,7 +1025,7 @@ if df is not None:
                 try:
                     # Создание PDF отчета
                     pdf_buffer = analyzer.generate_pdf_report(
-                        df=filtered_df if 'filtered_df' in locals() else df,
+                        df=filters,
                         title=report_title,
                         author=report_author,
                         include_overview=include_overview,
@@ -340,6 +1046,178 @@ if df is not None:
                     
                 except Exception as e:
                     st.error(f"❌ Ошибка генерации отчета: {str(e)}")
+        
+        st.markdown("---")
+        st.subheader("📤 Выгрузка данных")
+        
+        export_labels = {
+            'users': 'Пользователи (построчно)',
+            'funnel': 'Метрики воронки',
+            'segments': 'Метрики по сегментам',
+            'daily': 'Дневные метрики',
+            'cohorts': 'Матрица когорт'
+        }
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            export_format = st.selectbox("Формат", EXPORT_FORMATS, format_func=str.upper)
+        
+        with col2:
+            if export_format == 'xlsx':
+                export_sheets = st.multiselect(
+                    "Листы", list(EXPORT_TABLES), default=list(EXPORT_TABLES),
+                    format_func=export_labels.get
+                )
+            else:
+                export_table_name = st.selectbox("Таблица", list(EXPORT_TABLES), format_func=export_labels.get)
+        
+        def build_export():
+            # Файл строится только по нажатию и пишется частями во временный файл на диске;
+            # Streamlit затем читает готовый файл в память целиком, чтобы отдать его браузеру
+            handle = tempfile.TemporaryFile()
+            if export_format == 'xlsx':
+                export_workbook(analyzer, handle, export_sheets, filters)
+            else:
+                export_table(analyzer, export_table_name, handle, export_format, filters)
+            handle.seek(0)
+            return handle
+        
+        # Построчная выгрузка больше лимита держала бы весь файл в памяти сервера
+        exports_users = 'users' in (export_sheets if export_format == 'xlsx' else [export_table_name])
+        user_rows = analyzer.calculate_funnel_metrics(filters)['counts']['registrations'] if exports_users else 0
+        too_large = user_rows > DOWNLOAD_MAX_ROWS
+        if too_large:
+            st.warning(
+                f"В срезе {user_rows:,} пользователей - больше лимита скачивания "
+                f"({DOWNLOAD_MAX_ROWS:,} строк): сузьте фильтры или выгрузите срез "
+                f"в файл функцией export_table из export.py"
+            )
+        
+        st.download_button(
+            label="💾 Скачать выгрузку",
+            data=build_export,
+            file_name=f"funnel_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}",
+            mime=EXPORT_MIME_TYPES[export_format],
+            on_click='ignore',
+            disabled=(export_format == 'xlsx' and not export_sheets) or too_large
+        )
+    
+    with tab5:
+        st.header("🆚 Сравнение наборов A/B")
+        
+        if comparison_analyzer is None:
+            st.info("Выберите набор B для сравнения в боковой панели (из сохраненных наборов)")
+        else:
+            comparison_labels = [
+                f"A - текущий набор{f' ({dataset_name})' if dataset_name else ''}",
+                f"B - {comparison_name}"
+            ]
+            baseline = st.radio("Базовый набор", comparison_labels, horizontal=True)
+            base, other = (
+                (analyzer, comparison_analyzer) if baseline == comparison_labels[0]
+                else (comparison_analyzer, analyzer)
+            )
+            st.caption(
+                "Разница - второй набор относительно базового. Профили наборов считаются параллельно "
+                "один раз и хранятся вместе с наборами, смена базового набора их не пересчитывает. "
+                "Значимость: z-тест двух долей, поправка Бенджамини-Хохберга, q < 0.05."
+            )
+            
+            with st.spinner("Сравнение наборов..."):
+                ab = compare_datasets(base, other)
+            
+            # Воронка
+            st.subheader("🔄 Воронка")
+            conversion_names = {
+                'reg_to_deposit': 'Регистрация → Депозит',
+                'deposit_to_bet': 'Депозит → Ставка',
+                'bet_to_second_deposit': 'Ставка → Второй депозит',
+                'overall_conversion': 'Общая конверсия'
+            }
+            ab_conversions = ab['funnel']['conversions']
+            metric_cols = st.columns(len(ab_conversions))
+            for metric_col, row in zip(metric_cols, ab_conversions.itertuples(index=False)):
+                with metric_col:
+                    st.metric(
+                        conversion_names[row.conversion] + (" *" if row.significant else ""),
+                        f"{row.rate_b:.1f}%",
+                        f"{row.delta_pp:+.1f} п.п."
+                    )
+            st.dataframe(
+                ab['funnel']['counts'].rename(columns={
+                    'stage': 'Этап', 'count_a': 'Базовый', 'count_b': 'Сравнение', 'relative': 'Изменение, %'
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+            
+            # Сегменты
+            st.subheader("🎯 Сегменты: конверсия в депозит")
+            ab_segments = ab['segments']
+            ab_dimension = st.selectbox("Сегмент для сравнения", sorted(ab_segments['dimension'].unique()))
+            ab_segment = ab_segments[ab_segments['dimension'] == ab_dimension].assign(
+                **{'Разница': lambda table: np.where(table['significant'], 'значимо', 'не значимо')}
+            )
+            fig_ab_segments = px.bar(
+                ab_segment,
+                x='segment_value',
+                y='delta_pp',
+                color='Разница',
+                color_discrete_map={'значимо': '#d62728', 'не значимо': '#1f77b4'},
+                hover_data=['rate_a', 'rate_b', 'users_a', 'users_b', 'q_value'],
+                labels={'segment_value': ab_dimension, 'delta_pp': 'Разница, п.п.'},
+                title=f"Разница конверсии в депозит по {ab_dimension}"
+            )
+            st.plotly_chart(fig_ab_segments, use_container_width=True)
+            
+            # Дневные тренды
+            st.subheader("📈 Дневные тренды")
+            ab_daily = ab['daily'].rename(columns={
+                'reg_to_deposit_conv_a': 'Базовый', 'reg_to_deposit_conv_b': 'Сравнение'
+            })
+            fig_ab_daily = px.line(
+                ab_daily,
+                x='day',
+                y=['Базовый', 'Сравнение'],
+                labels={'day': 'День набора', 'value': 'Конверсия в депозит, %', 'variable': ''},
+                title="Конверсия в депозит по дням (день 1 - первый день каждого набора)",
+                markers=True
+            )
+            st.plotly_chart(fig_ab_daily, use_container_width=True)
+            
+            # Время до конверсии
+            st.subheader("⏳ Время до конверсии")
+            if ab['time_to_convert'] is None:
+                st.info("Время до конверсии сравнивается только для наборов с построчными данными")
+            else:
+                ab_windows = ab['time_to_convert']['windows']
+                st.dataframe(
+                    ab_windows.assign(transition=ab_windows['transition'].map(conversion_names))[[
+                        'transition', 'window_hours', 'rate_a', 'rate_b', 'delta_pp', 'q_value', 'significant'
+                    ]].rename(columns={
+                        'transition': 'Переход',
+                        'window_hours': 'Окно, ч',
+                        'rate_a': 'Базовый, %',
+                        'rate_b': 'Сравнение, %',
+                        'delta_pp': 'Разница, п.п.',
+                        'q_value': 'q',
+                        'significant': 'Значимо'
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                ab_medians = ab['time_to_convert']['medians']
+                st.dataframe(
+                    ab_medians.assign(transition=ab_medians['transition'].map(conversion_names)).rename(columns={
+                        'transition': 'Переход',
+                        'median_hours_a': 'Медиана (базовый), ч',
+                        'median_hours_b': 'Медиана (сравнение), ч',
+                        'delta_hours': 'Разница, ч'
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
 else:
     # Стартовая страница
     st.info("👆 Выберите источник данных в боковой панели для начала анализа")
@@ -364,6 +1242,7 @@ else:
     ### 4. Генерация отчетов
     - Создайте PDF отчет с результатами анализа
     - Настройте содержание отчета
+    - Выгрузите таблицы и построчные данные в Excel, CSV или Parquet
     
     ---
     
@@ -0,0 +1,165 @@
+"""
+Когортные треугольники по дням и неделям
+
+Когорта - день регистрации, столбец - число календарных дней от регистрации
+до этапа (0..horizon). Вместо маски по каждой паре (когорта, день) строится
+куб: для каждого значения сегмента, когорты и смещения - число пользователей,
+дошедших до этапа. Куб одного этапа - один bincount по ключу
+(значение, когорта, смещение), поэтому два года когорт × 90 дней считаются
+за один проход по строкам.
+
+Куб строится для всех пользователей и для каждого сегмента отдельно, так что
+срез треугольника по значению сегмента - выборка из готового массива без
+обращения к строкам. Недельные когорты (неделя с понедельника) и смещения в
+неделях получаются суммированием дневных ячеек.
+
+Ячейки, которые еще нельзя наблюдать (когорта + смещение позже последней
+даты в данных), в треугольнике - NaN.
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS
+from segment_anomalies import OVERALL_DIMENSION
+
+COHORT_HORIZON_DAYS = 90  # Дней от регистрации в треугольнике
+TRIANGLE_PERIODS = ['day', 'week']
+COHORT_STAGES = {
+    'deposits': 'deposit_time',
+    'first_bets': 'first_bet_time',
+    'second_deposits': 'second_deposit_time',
+}
+
+
+def cohort_cube(stage_days, segments=SEGMENT_COLUMNS, horizon=COHORT_HORIZON_DAYS):
+    """
+    Счетчики пользователей по (значение сегмента, когорта, смещение в днях)
+
+    Parameters:
+    -----------
+    stage_days : pd.DataFrame
+        Результат engine.stage_days
+    horizon : int
+        Максимальное смещение в днях; более поздние этапы не учитываются
+
+    Returns:
+    --------
+    dict
+        first_day, last_day - номер дня первой когорты и последней даты в данных,
+        horizon, values - измерение ('all' или сегмент) -> значения,
+        users - измерение -> массив (значения × когорты) размеров когорт,
+        stages - измерение -> этап -> массив (значения × когорты × смещения)
+    """
+    registration = stage_days['registration_time'].to_numpy(dtype=float)
+    registered = ~np.isnan(registration)
+    reg_day = registration[registered].astype(np.int64)
+    first_day = int(reg_day.min()) if len(reg_day) else 0
+    cohort = reg_day - first_day
+    n_cohorts = int(cohort.max()) + 1 if len(cohort) else 0
+    width = horizon + 1
+
+    # Смещения этапов от дня регистрации; этап раньше регистрации - день 0
+    offsets = {}
+    last_day = int(reg_day.max()) if len(reg_day) else 0
+    for stage, column in COHORT_STAGES.items():
+        days = stage_days[column].to_numpy(dtype=float)[registered]
+        present = ~np.isnan(days)
+        if present.any():
+            last_day = max(last_day, int(days[present].max()))
+        offset = np.clip(np.where(present, days, 0) - reg_day, 0, None).astype(np.int64)
+        offsets[stage] = (offset, present & (offset <= horizon))
+
+    dimensions = [(OVERALL_DIMENSION, np.zeros(len(reg_day), dtype=np.int64), [OVERALL_DIMENSION])]
+    for segment in segments:
+        codes, values = pd.factorize(stage_days[segment][registered], use_na_sentinel=False)
+        dimensions.append((segment, codes, [str(value) for value in values]))
+
+    cube = {
+        'first_day': first_day, 'last_day': last_day, 'horizon': horizon,
+        'values': {}, 'users': {}, 'stages': {}
+    }
+    for dimension, codes, values in dimensions:
+        cells = codes * n_cohorts + cohort
+        size = len(values) * n_cohorts
+        cube['values'][dimension] = values
+        cube['users'][dimension] = np.bincount(cells, minlength=size).reshape(len(values), n_cohorts)
+        cube['stages'][dimension] = {
+            stage: np.bincount(
+                cells[keep] * width + offset[keep], minlength=size * width
+            ).reshape(len(values), n_cohorts, width).astype(np.int32)
+            for stage, (offset, keep) in offsets.items()
+        }
+    return cube
+
+
+def cohort_triangle(cube, stage='deposits', period='day', dimension=OVERALL_DIMENSION,
+                    value=OVERALL_DIMENSION, cumulative=True):
+    """
+    Треугольник когорт из куба (без обращения к строкам данных)
+
+    Parameters:
+    -----------
+    cube : dict
+        Результат cohort_cube
+    stage : str
+        Этап из COHORT_STAGES
+    period : str
+        'day' - когорты и смещения по дням, 'week' - по неделям
+    dimension, value : str
+        Срез: 'all' или сегмент и его значение
+    cumulative : bool
+        True - доля когорты, дошедшей до этапа к смещению, иначе - в это смещение
+
+    Returns:
+    --------
+    pd.DataFrame
+        Индекс - начало когорты (cohort), users - размер когорты,
+        столбцы 0..N - доля (%) по смещениям; ненаблюдаемые ячейки - NaN.
+        Только когорты с пользователями
+    """
+    if stage not in COHORT_STAGES:
+        raise ValueError(f"Неизвестный этап: {stage}. Доступны: {', '.join(COHORT_STAGES)}")
+    if dimension not in cube['values']:
+        raise ValueError(f"Неизвестный сегмент: {dimension}")
+    if value not in cube['values'][dimension]:
+        raise ValueError(f"Значение {value} не найдено в сегменте {dimension}")
+
+    position = cube['values'][dimension].index(value)
+    users = cube['users'][dimension][position].astype(np.int64)
+    events = cube['stages'][dimension][stage][position].astype(np.int64)
+    if not len(users):
+        return pd.DataFrame(columns=['users'], index=pd.DatetimeIndex([], name='cohort'))
+    cohort_days = cube['first_day'] + np.arange(len(users))
+
+    if period == 'week':
+        # Когорта - неделя с понедельника (1970-01-01 - четверг), смещения - полные недели
+        weeks = (cohort_days + 3) // 7
+        bounds = np.flatnonzero(np.diff(weeks, prepend=weeks[0] - 1))
+        latest = np.append(bounds[1:], len(weeks)) - 1 + cube['first_day']
+        starts = weeks[bounds] * 7 - 3
+        n_weeks = (cube['horizon'] + 1) // 7
+        users = np.add.reduceat(users, bounds)
+        events = np.add.reduceat(events, bounds, axis=0)
+        events = events[:, :n_weeks * 7].reshape(len(events), n_weeks, 7).sum(axis=2)
+        # Неделя k наблюдаема целиком для всех дней когорты
+        ends = latest[:, None] + (np.arange(n_weeks)[None, :] + 1) * 7 - 1
+    elif period == 'day':
+        starts = latest = cohort_days
+        ends = latest[:, None] + np.arange(events.shape[1])[None, :]
+    else:
+        raise ValueError(f"Неизвестный период: {period}. Доступны: {', '.join(TRIANGLE_PERIODS)}")
+
+    if cumulative:
+        events = np.cumsum(events, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = events / users[:, None] * 100
+    rates[ends > cube['last_day']] = np.nan
+
+    triangle = pd.DataFrame(
+        rates,
+        index=pd.DatetimeIndex(pd.to_datetime(np.asarray(starts, dtype=np.int64), unit='D'), name='cohort'),
+        columns=list(range(rates.shape[1]))
+    )
+    triangle.insert(0, 'users', users)
+    return triangle[users > 0]
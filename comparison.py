@@ -0,0 +1,215 @@
+"""
+Сравнение двух наборов данных (A/B): эта неделя и прошлая, бренд A и бренд B
+
+Для каждого набора один раз строится профиль (compare_profile) из агрегатов,
+которые анализатор уже хранит для всего набора: счетчики страт, сводка по
+дням, конверсия в окнах и сводка кривых Каплана-Мейера. Профили двух наборов
+считаются параллельно в пуле потоков и кешируются в анализаторах, поэтому
+смена базового набора пересчитывает только разницы - небольшие таблицы.
+
+Значимость разницы конверсий - z-тест двух долей с поправкой
+Бенджамини-Хохберга внутри каждой таблицы.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from engines import CONVERSIONS, STAGE_COUNTS
+from segment_anomalies import OVERALL_DIMENSION
+from significance import SIGNIFICANCE_LEVEL, benjamini_hochberg, normal_two_sided_p_value, segment_cells
+from survival import survival_summary
+from windows import REPORT_WINDOWS
+
+COMPARISON_WORKERS = 2
+
+
+def two_proportion_test(successes_a, trials_a, successes_b, trials_b, alpha=SIGNIFICANCE_LEVEL):
+    """
+    z-тест разницы двух долей (B - A) для массивов, векторизованно
+
+    Returns:
+    --------
+    dict
+        rate_a, rate_b (%), delta_pp (п.п.), relative (% к A), z, p_value,
+        q_value (Бенджамини-Хохберг) и significant
+    """
+    x_a, n_a = np.asarray(successes_a, dtype=float), np.asarray(trials_a, dtype=float)
+    x_b, n_b = np.asarray(successes_b, dtype=float), np.asarray(trials_b, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate_a = np.where(n_a > 0, x_a / n_a, np.nan)
+        rate_b = np.where(n_b > 0, x_b / n_b, np.nan)
+        pooled = (x_a + x_b) / (n_a + n_b)
+        std_error = np.sqrt(pooled * (1 - pooled) * (1 / n_a + 1 / n_b))
+        z = np.where((n_a > 0) & (n_b > 0) & (std_error > 0), (rate_b - rate_a) / std_error, np.nan)
+        relative = np.where(rate_a > 0, (rate_b - rate_a) / rate_a * 100, np.nan)
+    p_values = np.where(np.isnan(z), np.nan, normal_two_sided_p_value(z))
+    q_values = benjamini_hochberg(p_values)
+    return {
+        'rate_a': rate_a * 100,
+        'rate_b': rate_b * 100,
+        'delta_pp': (rate_b - rate_a) * 100,
+        'relative': relative,
+        'z': z,
+        'p_value': p_values,
+        'q_value': q_values,
+        'significant': q_values < alpha
+    }
+
+
+def compare_profile(analyzer, windows=REPORT_WINDOWS):
+    """
+    Профиль набора для сравнения: только агрегаты, без построчных данных
+
+    У SQL- и агрегатных анализаторов (analyzer.df is None) нет длительностей
+    переходов: профиль строится без windows и survival (None)
+    
+    Returns:
+    --------
+    dict
+        strata - счетчики страт, daily - сводка по дням (rollups),
+        windows - конверсия в окнах по всем пользователям,
+        survival - сводка кривых Каплана-Мейера по всем пользователям
+    """
+    profile = {
+        'strata': analyzer.calculate_strata_counts(),
+        'daily': analyzer.calculate_calendar_rollups()['day'],
+        'windows': None,
+        'survival': None
+    }
+    if analyzer.df is not None:
+        windowed = analyzer.calculate_window_conversion(windows)
+        curves = analyzer.calculate_survival_curves()
+        profile['windows'] = windowed[windowed['dimension'] == OVERALL_DIMENSION].reset_index(drop=True)
+        profile['survival'] = survival_summary(curves[curves['dimension'] == OVERALL_DIMENSION])
+    return profile
+
+
+def compare_funnel(strata_a, strata_b):
+    """Счетчики этапов и конверсии воронки: A, B, разница и значимость"""
+    totals_a = {stage: int(strata_a[stage].sum()) for stage in STAGE_COUNTS}
+    totals_b = {stage: int(strata_b[stage].sum()) for stage in STAGE_COUNTS}
+    test = two_proportion_test(
+        [totals_a[numerator] for _, numerator, _ in CONVERSIONS],
+        [totals_a[denominator] for _, _, denominator in CONVERSIONS],
+        [totals_b[numerator] for _, numerator, _ in CONVERSIONS],
+        [totals_b[denominator] for _, _, denominator in CONVERSIONS]
+    )
+    conversions = pd.DataFrame({'conversion': [key for key, _, _ in CONVERSIONS], **test})
+    counts = pd.DataFrame({
+        'stage': STAGE_COUNTS,
+        'count_a': [totals_a[stage] for stage in STAGE_COUNTS],
+        'count_b': [totals_b[stage] for stage in STAGE_COUNTS]
+    })
+    counts['relative'] = np.where(
+        counts['count_a'] > 0, (counts['count_b'] - counts['count_a']) / counts['count_a'] * 100, np.nan
+    )
+    return {'counts': counts, 'conversions': conversions}
+
+
+def compare_segments(strata_a, strata_b, conversion='reg_to_deposit'):
+    """
+    Конверсия по значениям всех сегментов в A и B с разницей и значимостью
+
+    Значения, которых нет в одном из наборов, остаются с пустой конверсией
+    """
+    _, numerator, denominator = next(item for item in CONVERSIONS if item[0] == conversion)
+    keys = ['dimension', 'segment_value']
+    cells = pd.merge(
+        segment_cells(strata_a, max_order=1)[keys + STAGE_COUNTS],
+        segment_cells(strata_b, max_order=1)[keys + STAGE_COUNTS],
+        on=keys, how='outer', suffixes=('_a', '_b')
+    ).fillna({f'{stage}_{side}': 0 for stage in STAGE_COUNTS for side in 'ab'})
+
+    test = two_proportion_test(
+        cells[f'{numerator}_a'], cells[f'{denominator}_a'],
+        cells[f'{numerator}_b'], cells[f'{denominator}_b']
+    )
+    result = cells[keys].copy()
+    result['users_a'] = cells['registrations_a'].astype(np.int64)
+    result['users_b'] = cells['registrations_b'].astype(np.int64)
+    for name, values in test.items():
+        result[name] = values
+    return result.sort_values(keys, ignore_index=True)
+
+
+def compare_daily(daily_a, daily_b):
+    """
+    Дневные ряды A и B, выровненные по номеру дня от начала каждого набора
+    (наборы за разные недели сравниваются день в день)
+    """
+    def numbered(daily, side):
+        table = daily[['period_start', 'registrations', 'deposits', 'reg_to_deposit_conv']].copy()
+        table.insert(0, 'day', (table['period_start'] - table['period_start'].min()).dt.days + 1)
+        return table.rename(columns={col: f'{col}_{side}' for col in table.columns if col != 'day'})
+
+    merged = pd.merge(numbered(daily_a, 'a'), numbered(daily_b, 'b'), on='day', how='outer')
+    merged = merged.sort_values('day', ignore_index=True)
+    test = two_proportion_test(
+        merged['deposits_a'].fillna(0), merged['registrations_a'].fillna(0),
+        merged['deposits_b'].fillna(0), merged['registrations_b'].fillna(0)
+    )
+    merged['delta_pp'] = test['delta_pp']
+    merged['significant'] = test['significant']
+    return merged
+
+
+def compare_time_to_convert(profile_a, profile_b):
+    """
+    Время до конверсии: доля сделавших переход за окно (1 ч, 24 ч, 7 дней)
+    с разницей и значимостью и медианы кривых Каплана-Мейера
+    """
+    keys = ['transition', 'window_hours']
+    windows = pd.merge(
+        profile_a['windows'][keys + ['started', 'converted']],
+        profile_b['windows'][keys + ['started', 'converted']],
+        on=keys, how='outer', suffixes=('_a', '_b')
+    ).fillna({'started_a': 0, 'converted_a': 0, 'started_b': 0, 'converted_b': 0})
+    test = two_proportion_test(
+        windows['converted_a'], windows['started_a'], windows['converted_b'], windows['started_b']
+    )
+    for name, values in test.items():
+        windows[name] = values
+
+    medians = pd.merge(
+        profile_a['survival'].reindex(columns=['transition', 'median_hours']),
+        profile_b['survival'].reindex(columns=['transition', 'median_hours']),
+        on='transition', how='outer', suffixes=('_a', '_b')
+    )
+    medians['delta_hours'] = medians['median_hours_b'] - medians['median_hours_a']
+    return {'windows': windows, 'medians': medians}
+
+
+def compare_datasets(analyzer_a, analyzer_b, workers=COMPARISON_WORKERS):
+    """
+    Полное сравнение двух наборов (B относительно базового A)
+
+    Профили наборов считаются параллельно и кешируются в анализаторах
+    (FunnelAnalyzer.calculate_comparison_profile), поэтому при смене базового
+    набора местами меняются готовые профили.
+
+    Returns:
+    --------
+    dict
+        funnel (counts, conversions), segments, daily, time_to_convert (windows, medians;
+        None, если у одного из наборов нет построчных данных)
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        profile_a, profile_b = executor.map(
+            lambda analyzer: analyzer.calculate_comparison_profile(), [analyzer_a, analyzer_b]
+        )
+    return compare_profiles(profile_a, profile_b)
+
+
+def compare_profiles(profile_a, profile_b):
+    """Таблицы сравнения по готовым профилям наборов"""
+    return {
+        'funnel': compare_funnel(profile_a['strata'], profile_b['strata']),
+        'segments': compare_segments(profile_a['strata'], profile_b['strata']),
+        'daily': compare_daily(profile_a['daily'], profile_b['daily']),
+        'time_to_convert': (
+            compare_time_to_convert(profile_a, profile_b)
+            if profile_a['windows'] is not None and profile_b['windows'] is not None else None
+        )
+    }
@@ -0,0 +1,229 @@
+"""
+Быстрый разбор дат при загрузке данных
+
+Формат определяется один раз по небольшой выборке значений столбца, после
+чего весь столбец разбирается за один проход по известному формату:
+ISO-строки приводятся к timestamp средствами Arrow, остальные форматы -
+strptime Arrow (при отсутствии pyarrow - pandas с явным форматом),
+числа - как секунды / миллисекунды / микросекунды / наносекунды с эпохи.
+Строки, которые не удалось разобрать, подсчитываются по каждому столбцу.
+Уже типизированные столбцы не разбираются повторно.
+
+Даты вида 03/04/2025 подходят и под день/месяц, и под месяц/день. Если
+выборка разбирается в обоих порядках, порядок определяется по всему столбцу
+(день или месяц больше 12 разбирается только в одном из них); если и весь
+столбец не различает порядки, выбирается месяц первым, как в pd.to_datetime,
+и в отчет о разборе добавляется предупреждение.
+"""
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+DETECT_SAMPLE_SIZE = 1000  # Значений для определения формата
+FAILED_EXAMPLES = 5  # Примеров неразобранных значений в отчете
+ISO_FORMAT = 'ISO8601'
+
+# Кандидаты в порядке проверки: первый, разобравший всю выборку, выбирается
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    ISO_FORMAT,
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%m/%d/%Y %H:%M',
+    '%d/%m/%Y',
+    '%m/%d/%Y',
+]
+
+# Форматы день/месяц и соответствующие им месяц/день (одни и те же строки, другой порядок)
+DAY_FIRST_FORMATS = {
+    fmt: fmt.replace('%d/%m', '%m/%d') for fmt in DATETIME_FORMATS if fmt.startswith('%d/%m')
+}
+_DAY_MONTH_ORDERS = {
+    **{day_first: (day_first, month_first) for day_first, month_first in DAY_FIRST_FORMATS.items()},
+    **{month_first: (day_first, month_first) for day_first, month_first in DAY_FIRST_FORMATS.items()},
+}
+
+# Единицы времени эпохи по величине чисел: (нижняя граница, единица)
+EPOCH_UNITS = [(1e17, 'ns'), (1e14, 'us'), (1e11, 'ms'), (0, 's')]
+
+# Форматы ISO-вида: разбираются приведением строк к timestamp в Arrow
+_ISO_LIKE = {'%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d', ISO_FORMAT}
+
+
+def _sample_values(series, sample_size=DETECT_SAMPLE_SIZE):
+    """Непустые значения из начала столбца (без прохода по всему столбцу, если возможно)"""
+    head = series.iloc[:sample_size * 10].dropna()
+    if head.empty:
+        head = series.dropna()
+    return head.iloc[:sample_size]
+
+
+def detect_datetime_format(series, sample_size=DETECT_SAMPLE_SIZE):
+    """
+    Формат дат столбца по выборке значений
+
+    Returns:
+    --------
+    str или None
+        strptime-формат, 'ISO8601', 'epoch_<единица>' для чисел
+        или None, если формат определить не удалось
+    """
+    return _detect_format(series, sample_size)[0]
+
+
+def _detect_format(series, sample_size=DETECT_SAMPLE_SIZE):
+    """Формат дат столбца и предупреждение о неоднозначном порядке дня и месяца (или None)"""
+    sample = _sample_values(series, sample_size)
+    if sample.empty:
+        return None, None
+
+    if pd.api.types.is_numeric_dtype(sample):
+        magnitude = np.abs(sample.to_numpy(dtype=float)).max()
+        unit = next(unit for bound, unit in EPOCH_UNITS if magnitude >= bound)
+        return f'epoch_{unit}', None
+
+    sample = sample.astype(str).str.strip()
+    best_format, best_parsed = None, 0
+    for fmt in DATETIME_FORMATS:
+        parsed = int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+        if parsed == len(sample):
+            if fmt in _DAY_MONTH_ORDERS:
+                return _resolve_day_month(series, sample, fmt)
+            return fmt, None
+        if parsed > best_parsed:
+            best_format, best_parsed = fmt, parsed
+    return best_format, None
+
+
+def _resolve_day_month(series, sample, fmt):
+    """
+    Порядок дня и месяца для формата, разобравшего всю выборку
+
+    Если выборку разбирает и другой порядок, весь столбец разбирается в обоих:
+    выбирается порядок с меньшим числом неразобранных значений. При равенстве
+    порядок не определить - месяц первым (как pd.to_datetime) с предупреждением
+    """
+    day_first, month_first = _DAY_MONTH_ORDERS[fmt]
+    other = month_first if fmt == day_first else day_first
+    if pd.to_datetime(sample, format=other, errors='coerce').notna().sum() < len(sample):
+        return fmt, None
+
+    failed = {order: int(parse_datetime(series, order).isna().sum()) for order in (day_first, month_first)}
+    if failed[day_first] != failed[month_first]:
+        return min(failed, key=failed.get), None
+    return month_first, (
+        f"Порядок дня и месяца неоднозначен (во всех датах оба числа не больше 12): "
+        f"выбран {month_first}, а не {day_first}"
+    )
+
+
+def _parse_with_arrow(series, fmt):
+    """Разбор строк средствами Arrow; None, если быстрый путь неприменим"""
+    if pa is None or fmt is None or (fmt not in _ISO_LIKE and '%f' in fmt):
+        return None
+    try:
+        values = pa.array(series, from_pandas=True, type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+
+    if fmt in _ISO_LIKE:
+        try:
+            parsed = pc.cast(values, pa.timestamp('us'))
+        except pa.ArrowInvalid:
+            # Есть неразбираемые значения: поэлементный разбор с NaT для них
+            return None
+    else:
+        parsed = pc.strptime(values, format=fmt, unit='us', error_is_null=True)
+    return parsed.to_pandas().set_axis(series.index).rename(series.name)
+
+
+def parse_datetime(series, fmt=None):
+    """
+    Столбец дат в datetime64 за один проход
+
+    Parameters:
+    -----------
+    series : pd.Series
+        Строки, числа эпохи или уже типизированные даты
+    fmt : str, optional
+        Формат (detect_datetime_format); по умолчанию определяется по выборке
+
+    Returns:
+    --------
+    pd.Series
+        datetime64; неразобранные значения - NaT
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    if fmt is None:
+        fmt = detect_datetime_format(series)
+
+    if fmt is not None and fmt.startswith('epoch_'):
+        return pd.to_datetime(pd.to_numeric(series, errors='coerce'), unit=fmt[len('epoch_'):])
+
+    if pd.api.types.is_numeric_dtype(series):
+        # Пустой числовой столбец (например, все значения NaN)
+        return pd.to_datetime(series, errors='coerce')
+
+    parsed = _parse_with_arrow(series, fmt)
+    if parsed is not None:
+        return parsed
+    return pd.to_datetime(series, format=fmt, errors='coerce')
+
+
+def parse_datetime_columns(df, columns):
+    """
+    Разбор столбцов дат с отчетом о неразобранных значениях
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Исходные данные (не изменяются)
+    columns : list
+        Столбцы дат
+
+    Returns:
+    --------
+    tuple
+        (DataFrame с разобранными столбцами, отчет: столбец -> {'format',
+        'failed' - число непустых значений, ставших NaT, 'examples',
+        'warning' - предупреждение о неоднозначном формате или None})
+    """
+    df = df.copy(deep=False)
+    report = {}
+
+    for col in columns:
+        if col not in df.columns:
+            continue
+        raw = df[col]
+        if pd.api.types.is_datetime64_any_dtype(raw):
+            report[col] = {'format': 'datetime64', 'failed': 0, 'examples': [], 'warning': None}
+            continue
+
+        fmt, warning = _detect_format(raw)
+        parsed = parse_datetime(raw, fmt)
+        failed = parsed.isna().to_numpy() & raw.notna().to_numpy()
+        report[col] = {
+            'format': fmt,
+            'failed': int(failed.sum()),
+            'examples': raw[failed].iloc[:FAILED_EXAMPLES].astype(str).tolist(),
+            'warning': warning
+        }
+        df[col] = parsed
+
+    return df, report
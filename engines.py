@@ -0,0 +1,770 @@
+"""
+Движки вычислений для FunnelAnalyzer
+
+Движок отвечает за подготовку данных и все агрегаты анализа: метрики
+воронки, сегменты, дневные метрики, данные для детекции аномалий и когорты.
+Результаты всегда возвращаются в виде небольших pandas-структур одинакового
+формата, поэтому app.py и PDF отчет не зависят от выбранного движка.
+
+Доступные движки:
+    pandas - реализация по умолчанию
+    polars - ленивые запросы Polars (многопоточное выполнение с оптимизацией плана)
+"""
+
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_datetime
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+DATE_COLUMNS = ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
+SEGMENT_COLUMNS = ['traffic_source', 'country', 'device']
+COHORT_PERIODS = 6  # Количество месяцев в когортном анализе
+
+# Переходы между этапами: (ключ метрики, начало, конец)
+STAGE_TRANSITIONS = [
+    ('reg_to_deposit', 'registration_time', 'deposit_time'),
+    ('deposit_to_bet', 'deposit_time', 'first_bet_time'),
+    ('bet_to_second_deposit', 'first_bet_time', 'second_deposit_time'),
+]
+
+# Ключ фильтра по диапазону дат регистрации: {'registration_date': (начало, конец)}
+DATE_RANGE_FILTER = 'registration_date'
+
+# Счетчики этапов воронки
+STAGE_COUNTS = ['registrations', 'deposits', 'first_bets', 'second_deposits']
+
+# Конверсии: (ключ, числитель, знаменатель) по счетчикам этапов
+CONVERSIONS = [
+    ('reg_to_deposit', 'deposits', 'registrations'),
+    ('deposit_to_bet', 'first_bets', 'deposits'),
+    ('bet_to_second_deposit', 'second_deposits', 'first_bets'),
+    ('overall_conversion', 'second_deposits', 'registrations'),
+]
+
+# Названия столбцов конверсий в таблицах сегментов
+SEGMENT_CONVERSION_COLUMNS = {
+    'reg_to_deposit': 'reg_to_deposit_conv',
+    'deposit_to_bet': 'deposit_to_bet_conv',
+    'bet_to_second_deposit': 'bet_to_second_deposit_conv',
+    'overall_conversion': 'overall_conv',
+}
+
+
+def _as_datetime(series):
+    """Приведение Series к datetime64 без повторного разбора уже типизированных данных"""
+    return parse_datetime(series)
+
+
+def _hours_between(start, end):
+    """Время между двумя этапами в часах"""
+    return (end - start).dt.total_seconds() / 3600
+
+
+def _safe_rate(numerator, denominator):
+    """Конверсия в процентах с нулем при пустом знаменателе"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / denominator * 100, 0.0)
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """
+    Доверительный интервал Вильсона для доли (в процентах), векторизованно
+
+    trials может быть дробным (эффективный размер выборки). При trials = 0
+    возвращается интервал [0, 100].
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.where(trials > 0, successes / trials, 0.0)
+        z2_n = np.where(trials > 0, z * z / trials, np.inf)
+        center = (p + z2_n / 2) / (1 + z2_n)
+        half = z * np.sqrt(p * (1 - p) / trials + z2_n / (4 * trials)) / (1 + z2_n)
+    low = np.where(trials > 0, np.clip(center - half, 0, 1), 0.0)
+    high = np.where(trials > 0, np.clip(center + half, 0, 1), 1.0)
+    return low * 100, high * 100
+
+
+def metrics_from_counts(registrations, deposits, first_bets, second_deposits, avg_times):
+    """Сборка словаря метрик воронки из счетчиков этапов и среднего времени"""
+    return {
+        'counts': {
+            'registrations': registrations,
+            'deposits': deposits,
+            'first_bets': first_bets,
+            'second_deposits': second_deposits
+        },
+        'conversions': {
+            'reg_to_deposit': (deposits / registrations * 100) if registrations > 0 else 0,
+            'deposit_to_bet': (first_bets / deposits * 100) if deposits > 0 else 0,
+            'bet_to_second_deposit': (second_deposits / first_bets * 100) if first_bets > 0 else 0,
+            'overall_conversion': (second_deposits / registrations * 100) if registrations > 0 else 0
+        },
+        'avg_times_hours': {
+            key: np.nan if avg_times.get(key) is None else avg_times[key]
+            for key, _, _ in STAGE_TRANSITIONS
+        }
+    }
+
+
+def segment_table(values, registrations, deposits, first_bets, second_deposits):
+    """Таблица конверсий по значениям одного сегмента (формат analyze_by_segments)"""
+    return pd.DataFrame({
+        'segment_value': values,
+        'users': registrations,
+        'reg_to_deposit_conv': _safe_rate(deposits, registrations),
+        'deposit_to_bet_conv': _safe_rate(first_bets, deposits),
+        'bet_to_second_deposit_conv': _safe_rate(second_deposits, first_bets),
+        'overall_conv': _safe_rate(second_deposits, registrations)
+    })
+
+
+def daily_table(dates, registrations, deposits, second_deposits):
+    """Таблица дневных метрик (формат calculate_daily_metrics)"""
+    return pd.DataFrame({
+        'date': dates,
+        'registrations': registrations,
+        'deposits': deposits,
+        'reg_to_deposit_conv': _safe_rate(deposits, registrations),
+        'overall_conv': _safe_rate(second_deposits, registrations)
+    })
+
+
+def cohorts_from_month_counts(reg_months, deposit_months, users):
+    """
+    Когортная таблица из количества пользователей по парам (месяц регистрации, месяц депозита)
+
+    Месяцы передаются как pd.Period (NaT - депозита не было), порядок когорт
+    сохраняется в порядке первого появления.
+    """
+    pairs = pd.DataFrame({
+        'reg_month': pd.PeriodIndex(reg_months, freq='M'),
+        'deposit_month': pd.PeriodIndex(deposit_months, freq='M'),
+        'users': np.asarray(users, dtype=np.int64)
+    })
+    pairs = pairs[pairs['reg_month'].notna()]
+
+    cohorts = []
+    for cohort_month, cohort_pairs in pairs.groupby('reg_month', sort=False):
+        cohort_size = int(cohort_pairs['users'].sum())
+        deposited = cohort_pairs[cohort_pairs['deposit_month'].notna()]
+        offsets = np.array(
+            [(month - cohort_month).n for month in deposited['deposit_month']], dtype=np.int64
+        )
+        deposited_users = deposited['users'].to_numpy()
+
+        # Расчет retention по месяцам
+        for period in range(0, COHORT_PERIODS):
+            retained_users = int(deposited_users[offsets <= period].sum())
+            cohorts.append({
+                'cohort': str(cohort_month),
+                'period': period,
+                'users': cohort_size,
+                'retained': retained_users,
+                'retention_rate': retained_users / cohort_size * 100
+            })
+
+    return pd.DataFrame(cohorts)
+
+
+def find_daily_anomalies(daily_df, threshold=0.5):
+    """Поиск аномалий в готовой таблице дневных метрик (date, registrations, conv_rate)"""
+    anomalies = []
+
+    if len(daily_df) < 2:
+        return anomalies
+
+    # Проверка резких падений конверсии
+    for i in range(1, len(daily_df)):
+        current_conv = daily_df.iloc[i]['conv_rate']
+        prev_conv = daily_df.iloc[i-1]['conv_rate']
+
+        if prev_conv > 0:
+            change = (current_conv - prev_conv) / prev_conv
+
+            if abs(change) > threshold:
+                direction = "упала" if change < 0 else "выросла"
+                anomalies.append(
+                    f"Конверсия в депозит {direction} на {abs(change)*100:.1f}% "
+                    f"({daily_df.iloc[i]['date']})"
+                )
+
+    # Проверка аномально низких объемов регистраций
+    if len(daily_df) >= 7:
+        avg_registrations = daily_df['registrations'].mean()
+        std_registrations = daily_df['registrations'].std()
+
+        for _, row in daily_df.iterrows():
+            if row['registrations'] < (avg_registrations - 2 * std_registrations):
+                anomalies.append(
+                    f"Аномально низкое количество регистраций: {row['registrations']} "
+                    f"({row['date']})"
+                )
+
+    return anomalies
+
+
+def _check_filters(filters):
+    """Проверка, что фильтры заданы только по полям сегментов"""
+    for column in filters:
+        if column not in SEGMENT_COLUMNS:
+            raise ValueError(f"Фильтр по полю {column} не поддерживается")
+
+
+class AnalysisEngine:
+    """
+    Интерфейс движка вычислений
+
+    data - внутреннее представление движка (pandas DataFrame, polars LazyFrame и т.д.)
+    """
+
+    name = None
+
+    def prepare(self, df):
+        """Подготовка основного набора данных анализатора"""
+        raise NotImplementedError
+
+    def wrap(self, df):
+        """Приведение внешнего pandas DataFrame (например, среза из app.py) к формату движка"""
+        raise NotImplementedError
+
+    def select(self, data, filters):
+        """Отбор строк по фильтрам вида {'country': ['RU', 'UA'], ...}"""
+        raise NotImplementedError
+
+    def sort_by_registration(self, data):
+        """
+        Данные, упорядоченные по registration_time (пустые даты в конце),
+        и отсортированный массив непустых дат регистрации (datetime64[ns])
+
+        Неупорядоченные данные переставляются одной полной копией при подготовке,
+        зато каждый диапазон дат дальше - срез без копирования. Уже упорядоченные
+        данные (например, журнал событий по времени) возвращаются без копии.
+        """
+        raise NotImplementedError
+
+    def slice_rows(self, data, start, stop):
+        """Непрерывный срез строк [start, stop) без копирования и маски"""
+        raise NotImplementedError
+
+    def filter_rows(self, data, mask):
+        """Строки, отмеченные в булевом массиве mask (в порядке данных)"""
+        raise NotImplementedError
+
+    def iter_rows(self, data, columns, chunk_rows):
+        """
+        Строки по частям не больше chunk_rows для потоковой выгрузки
+
+        Yields:
+        -------
+        pd.DataFrame
+            Столбцы columns; для пустых данных - один пустой DataFrame
+        """
+        raise NotImplementedError
+
+    def funnel_metrics(self, data):
+        """Метрики воронки (формат calculate_funnel_metrics)"""
+        raise NotImplementedError
+
+    def segment_metrics(self, data, segments=SEGMENT_COLUMNS):
+        """Словарь таблиц по сегментам (формат analyze_by_segments)"""
+        raise NotImplementedError
+
+    def strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        """
+        Счетчики этапов по комбинациям всех сегментов (пустые значения - отдельная группа)
+
+        Returns:
+        --------
+        pd.DataFrame
+            Столбцы segments + registrations, deposits, first_bets, second_deposits
+        """
+        raise NotImplementedError
+
+    def daily_strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        """
+        Счетчики этапов по дням регистрации и комбинациям всех сегментов
+
+        Returns:
+        --------
+        pd.DataFrame
+            date (datetime64, начало дня) + segments + счетчики этапов
+        """
+        raise NotImplementedError
+
+    def daily_metrics(self, data):
+        """Дневные метрики (формат calculate_daily_metrics)"""
+        raise NotImplementedError
+
+    def daily_conversion(self, data):
+        """Дневные регистрации, депозиты и конверсия для detect_anomalies"""
+        daily = self.daily_metrics(data)
+        return pd.DataFrame({
+            'date': daily['date'],
+            'registrations': daily['registrations'],
+            'deposits': daily['deposits'],
+            'conv_rate': daily['reg_to_deposit_conv']
+        })
+
+    def detect_anomalies(self, data, threshold=0.5):
+        """Детекция аномалий по дневной конверсии"""
+        return find_daily_anomalies(self.daily_conversion(data), threshold)
+
+    def cohort_analysis(self, data):
+        """Когортный анализ (формат calculate_cohort_analysis)"""
+        raise NotImplementedError
+
+    def max_timestamp(self, data):
+        """Самая поздняя дата любого этапа (момент наблюдения для цензурирования)"""
+        raise NotImplementedError
+
+    def conversion_durations(self, data, observed_until, segments=SEGMENT_COLUMNS, fractional=False):
+        """
+        Целые длительности переходов между этапами в часах (для кривых дожития)
+
+        Пользователи, не дошедшие до следующего этапа, цензурируются в момент
+        observed_until. fractional=True - точные длительности в дробных часах
+        (для конверсии в окне).
+
+        Returns:
+        --------
+        pd.DataFrame
+            segments + для каждого перехода: hours_<key> (NaN, если начальный
+            этап не достигнут) и event_<key> (следующий этап достигнут)
+        """
+        raise NotImplementedError
+
+    def stage_days(self, data, segments=SEGMENT_COLUMNS):
+        """
+        Календарные дни этапов для когорт по дням
+
+        Returns:
+        --------
+        pd.DataFrame
+            segments + DATE_COLUMNS как номер дня с 1970-01-01 (float, NaN - этапа нет)
+        """
+        raise NotImplementedError
+
+    def sample(self, data, sample_size, strata=SEGMENT_COLUMNS, seed=42):
+        """
+        Стратифицированная выборка в виде pandas DataFrame со столбцом sample_weight
+
+        Каждая страта (комбинация значений strata) получает долю строк,
+        пропорциональную своему размеру, но не меньше одной строки.
+        Вес строки - размер страты, деленный на число выбранных из нее строк.
+        """
+        raise NotImplementedError
+
+
+class PandasEngine(AnalysisEngine):
+    """Движок на pandas"""
+
+    name = 'pandas'
+
+    def prepare(self, df):
+        # Поверхностная копия: разобранные даты не попадают в исходный DataFrame,
+        # а остальные столбцы не дублируются. Флаги этапов и время между этапами
+        # не хранятся - они считаются как локальные Series там, где нужны
+        df = df.copy(deep=False)
+
+        # Преобразование дат
+        for col in DATE_COLUMNS:
+            df[col] = _as_datetime(df[col])
+
+        return df
+
+    def wrap(self, df):
+        # Срезы не копируются и не дополняются столбцами:
+        # все промежуточные значения считаются как локальные Series
+        return df
+
+    def select(self, data, filters):
+        _check_filters(filters)
+        mask = np.ones(len(data), dtype=bool)
+        for column, values in filters.items():
+            mask &= data[column].isin(list(values)).to_numpy()
+        return data[mask]
+
+    def sort_by_registration(self, data):
+        times = data['registration_time'].to_numpy(dtype='datetime64[ns]')
+        present = ~np.isnat(times)
+        valid = int(np.count_nonzero(present))
+        if present[:valid].all() and (np.diff(times[:valid]) >= np.timedelta64(0)).all():
+            return data, times[:valid]
+        # NaT при сортировке numpy оказываются в конце; индекс строк сохраняется
+        order = np.argsort(times, kind='stable')
+        return data.take(order), times[order][:valid]
+
+    def slice_rows(self, data, start, stop):
+        return data.iloc[start:stop]
+
+    def filter_rows(self, data, mask):
+        return data[mask]
+
+    def iter_rows(self, data, columns, chunk_rows):
+        for start in range(0, max(len(data), 1), chunk_rows):
+            yield data.iloc[start:start + chunk_rows][columns]
+
+    def _stage_flags(self, data):
+        """Флаги этапов (депозит, ставка, второй депозит) как локальный DataFrame"""
+        return pd.DataFrame({
+            'deposits': _as_datetime(data['deposit_time']).notna(),
+            'first_bets': _as_datetime(data['first_bet_time']).notna(),
+            'second_deposits': _as_datetime(data['second_deposit_time']).notna()
+        }, index=data.index)
+
+    def funnel_metrics(self, data):
+        flags = self._stage_flags(data)
+        avg_times = {
+            key: _hours_between(_as_datetime(data[start]), _as_datetime(data[end])).mean()
+            for key, start, end in STAGE_TRANSITIONS
+        }
+        return metrics_from_counts(
+            len(data),
+            int(flags['deposits'].sum()),
+            int(flags['first_bets'].sum()),
+            int(flags['second_deposits'].sum()),
+            avg_times
+        )
+
+    def segment_metrics(self, data, segments=SEGMENT_COLUMNS):
+        flags = self._stage_flags(data)
+        results = {}
+
+        for segment in segments:
+            # Одна группировка на измерение, порядок значений - порядок появления
+            grouped = flags.groupby(data[segment].to_numpy(), sort=False)
+            counts = grouped.sum()
+            results[segment] = segment_table(
+                counts.index.to_numpy(),
+                grouped.size().to_numpy(),
+                counts['deposits'].to_numpy(),
+                counts['first_bets'].to_numpy(),
+                counts['second_deposits'].to_numpy()
+            )
+
+        return results
+
+    def strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        flags = self._stage_flags(data)
+        keys = [data[segment] for segment in segments]
+        grouped = flags.groupby(keys, sort=False, dropna=False)
+        counts = grouped.sum()
+        counts.insert(0, 'registrations', grouped.size())
+        return counts.reset_index()
+
+    def daily_strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        reg_day = _as_datetime(data['registration_time']).dt.normalize().rename('date')
+        keys = [reg_day] + [data[segment] for segment in segments]
+        grouped = self._stage_flags(data).groupby(keys, sort=False, dropna=False)
+        counts = grouped.sum()
+        counts.insert(0, 'registrations', grouped.size())
+        counts = counts.reset_index()
+        return counts[counts['date'].notna()].reset_index(drop=True)
+
+    def daily_metrics(self, data):
+        # Группировка по дням регистрации (ключ - локальная Series,
+        # во входной DataFrame столбец не добавляется)
+        reg_day = _as_datetime(data['registration_time']).dt.normalize()
+        grouped = self._stage_flags(data).groupby(reg_day.to_numpy(), sort=True)
+        counts = grouped.sum()
+
+        return daily_table(
+            pd.DatetimeIndex(counts.index).date,
+            grouped.size().to_numpy(),
+            counts['deposits'].to_numpy(),
+            counts['second_deposits'].to_numpy()
+        )
+
+    def cohort_analysis(self, data):
+        # Месяцы регистрации и депозита как локальные Series
+        reg_month = _as_datetime(data['registration_time']).dt.to_period('M')
+        deposit_month = _as_datetime(data['deposit_time']).dt.to_period('M')
+        pairs = pd.DataFrame({'reg_month': reg_month, 'deposit_month': deposit_month})
+        counts = pairs.groupby(['reg_month', 'deposit_month'], sort=False, dropna=False).size()
+
+        return cohorts_from_month_counts(
+            counts.index.get_level_values('reg_month'),
+            counts.index.get_level_values('deposit_month'),
+            counts.to_numpy()
+        )
+
+
+    def max_timestamp(self, data):
+        latest = [_as_datetime(data[col]).max() for col in DATE_COLUMNS]
+        latest = [value for value in latest if pd.notna(value)]
+        return max(latest) if latest else pd.NaT
+
+    def conversion_durations(self, data, observed_until, segments=SEGMENT_COLUMNS, fractional=False):
+        result = {col: data[col] for col in segments}
+        for key, start, end in STAGE_TRANSITIONS:
+            start_time = _as_datetime(data[start])
+            end_time = _as_datetime(data[end])
+            elapsed = end_time.fillna(observed_until) - start_time
+            # Дробные часы - из целых микросекунд одинаково с PolarsEngine
+            hours = (elapsed // pd.Timedelta(microseconds=1)) / 3.6e9 if fractional else elapsed // pd.Timedelta(hours=1)
+            result[f'hours_{key}'] = hours.clip(lower=0)
+            result[f'event_{key}'] = end_time.notna() & start_time.notna()
+        return pd.DataFrame(result)
+
+    def stage_days(self, data, segments=SEGMENT_COLUMNS):
+        result = {col: data[col] for col in segments}
+        for col in DATE_COLUMNS:
+            result[col] = ((_as_datetime(data[col]) - pd.Timestamp(0)) // pd.Timedelta(days=1)).astype(float)
+        return pd.DataFrame(result)
+
+    def sample(self, data, sample_size, strata=SEGMENT_COLUMNS, seed=42):
+        total = len(data)
+        codes = data.groupby(list(strata), sort=False, dropna=False).ngroup().to_numpy()
+        sizes = np.bincount(codes)
+        fraction = min(1.0, sample_size / total) if total else 1.0
+        quota = np.minimum(sizes, np.maximum(1, np.round(sizes * fraction))).astype(np.int64)
+
+        # Случайный порядок внутри страт: сортировка по (страта, случайный ключ)
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(total), codes))
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        ordered_codes = codes[order]
+        rank = np.arange(total) - starts[ordered_codes]
+        chosen = np.sort(order[rank < quota[ordered_codes]])
+
+        # Даты разбираются только у выбранных строк
+        columns = [col for col in DATE_COLUMNS + SEGMENT_COLUMNS if col in data.columns]
+        sample = data.iloc[chosen][columns].copy()
+        for col in DATE_COLUMNS:
+            sample[col] = _as_datetime(sample[col])
+        sample['sample_weight'] = (sizes / quota)[codes[chosen]]
+        return sample
+
+
+class PolarsEngine(AnalysisEngine):
+    """Движок на ленивых запросах Polars"""
+
+    name = 'polars'
+
+    def __init__(self):
+        if pl is None:
+            raise ImportError("Для движка polars установите пакет polars: pip install polars")
+
+    def prepare(self, df):
+        if isinstance(df, pl.LazyFrame):
+            lazy = df
+        elif isinstance(df, pl.DataFrame):
+            lazy = df.lazy()
+        else:
+            columns = [col for col in ['user_id'] + DATE_COLUMNS + SEGMENT_COLUMNS if col in df.columns]
+            lazy = pl.from_pandas(df[columns]).lazy()
+
+        # Строковые даты разбираются внутри запроса, типизированные не трогаются
+        schema = lazy.collect_schema()
+        parse = [
+            pl.col(col).str.to_datetime(strict=False)
+            for col in DATE_COLUMNS if schema[col] == pl.String
+        ]
+        return lazy.with_columns(parse) if parse else lazy
+
+    def wrap(self, df):
+        return self.prepare(df)
+
+    def select(self, data, filters):
+        _check_filters(filters)
+        for column, values in filters.items():
+            data = data.filter(pl.col(column).is_in(list(values)))
+        return data
+
+    def sort_by_registration(self, data):
+        # Сортировка выполняется один раз: дальше срезы работают по готовому DataFrame
+        ordered = data.sort('registration_time', nulls_last=True, maintain_order=True).collect()
+        times = ordered['registration_time'].drop_nulls().cast(pl.Datetime('ns')).to_numpy()
+        return ordered.lazy(), times
+
+    def slice_rows(self, data, start, stop):
+        return data.slice(start, max(stop - start, 0))
+
+    def filter_rows(self, data, mask):
+        return data.filter(pl.lit(pl.Series(mask)))
+
+    def iter_rows(self, data, columns, chunk_rows):
+        # Потоковое выполнение запроса: в памяти только текущая часть
+        query = data.select(columns)
+        empty = True
+        for batch in query.collect_batches(chunk_size=chunk_rows):
+            empty = False
+            yield batch.to_pandas()
+        if empty:
+            yield query.head(0).collect().to_pandas()
+
+    @staticmethod
+    def _hours(start, end):
+        """Выражение: время между этапами в часах"""
+        return (pl.col(end) - pl.col(start)).dt.total_nanoseconds() / 3.6e12
+
+    @staticmethod
+    def _stage_counts():
+        """Выражения: количество пользователей на каждом этапе"""
+        return [
+            pl.len().alias('registrations'),
+            pl.col('deposit_time').is_not_null().sum().alias('deposits'),
+            pl.col('first_bet_time').is_not_null().sum().alias('first_bets'),
+            pl.col('second_deposit_time').is_not_null().sum().alias('second_deposits'),
+        ]
+
+    def funnel_metrics(self, data):
+        row = data.select(
+            self._stage_counts() + [
+                self._hours(start, end).mean().alias(key)
+                for key, start, end in STAGE_TRANSITIONS
+            ]
+        ).collect().row(0, named=True)
+
+        return metrics_from_counts(
+            int(row['registrations']),
+            int(row['deposits']),
+            int(row['first_bets']),
+            int(row['second_deposits']),
+            {key: row[key] for key, _, _ in STAGE_TRANSITIONS}
+        )
+
+    def segment_metrics(self, data, segments=SEGMENT_COLUMNS):
+        # Все группировки выполняются одним вызовом collect_all параллельно
+        queries = [
+            data.filter(pl.col(segment).is_not_null())
+                .group_by(segment, maintain_order=True)
+                .agg(self._stage_counts())
+            for segment in segments
+        ]
+        frames = pl.collect_all(queries)
+
+        return {
+            segment: segment_table(
+                frame[segment].to_list(),
+                frame['registrations'].to_numpy(),
+                frame['deposits'].to_numpy(),
+                frame['first_bets'].to_numpy(),
+                frame['second_deposits'].to_numpy()
+            )
+            for segment, frame in zip(segments, frames)
+        }
+
+    def strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        return (
+            data.group_by(list(segments))
+                .agg(self._stage_counts())
+                .collect()
+                .to_pandas()
+        )
+
+    def daily_strata_counts(self, data, segments=SEGMENT_COLUMNS):
+        return (
+            data.filter(pl.col('registration_time').is_not_null())
+                .group_by([pl.col('registration_time').dt.truncate('1d').alias('date')] + list(segments))
+                .agg(self._stage_counts())
+                .collect()
+                .to_pandas()
+        )
+
+    def daily_metrics(self, data):
+        daily = (
+            data.filter(pl.col('registration_time').is_not_null())
+                .group_by(pl.col('registration_time').dt.date().alias('date'))
+                .agg(self._stage_counts())
+                .sort('date')
+                .collect()
+        )
+
+        return daily_table(
+            np.array(daily['date'].to_list(), dtype=object),
+            daily['registrations'].to_numpy(),
+            daily['deposits'].to_numpy(),
+            daily['second_deposits'].to_numpy()
+        )
+
+    def cohort_analysis(self, data):
+        pairs = (
+            data.group_by(
+                pl.col('registration_time').dt.truncate('1mo').alias('reg_month'),
+                pl.col('deposit_time').dt.truncate('1mo').alias('deposit_month'),
+                maintain_order=True
+            )
+            .agg(pl.len().alias('users'))
+            .collect()
+        )
+
+        return cohorts_from_month_counts(
+            pd.DatetimeIndex(pairs['reg_month'].to_list()).to_period('M'),
+            pd.DatetimeIndex(pairs['deposit_month'].to_list()).to_period('M'),
+            pairs['users'].to_numpy()
+        )
+
+    def max_timestamp(self, data):
+        latest = data.select(pl.max_horizontal([pl.col(col).max() for col in DATE_COLUMNS])).collect().item()
+        return pd.Timestamp(latest) if latest is not None else pd.NaT
+
+    def conversion_durations(self, data, observed_until, segments=SEGMENT_COLUMNS, fractional=False):
+        censor = pl.lit(pd.Timestamp(observed_until).to_pydatetime())
+        columns = list(segments)
+        for key, start, end in STAGE_TRANSITIONS:
+            elapsed = pl.col(end).fill_null(censor) - pl.col(start)
+            # Дробные часы - делением целых микросекунд после сбора, как в PandasEngine
+            hours = elapsed.dt.total_microseconds() if fractional else elapsed.dt.total_hours()
+            columns += [
+                hours.clip(lower_bound=0).alias(f'hours_{key}'),
+                (pl.col(end).is_not_null() & pl.col(start).is_not_null()).alias(f'event_{key}')
+            ]
+        durations = data.select(columns).collect().to_pandas()
+        if fractional:
+            for key, _, _ in STAGE_TRANSITIONS:
+                durations[f'hours_{key}'] = durations[f'hours_{key}'] / 3.6e9
+        return durations
+
+    def stage_days(self, data, segments=SEGMENT_COLUMNS):
+        columns = list(segments) + [pl.col(col).dt.date().cast(pl.Int32).alias(col) for col in DATE_COLUMNS]
+        days = data.select(columns).collect().to_pandas()
+        return days.astype({col: float for col in DATE_COLUMNS})
+
+    def sample(self, data, sample_size, strata=SEGMENT_COLUMNS, seed=42):
+        total = data.select(pl.len()).collect().item()
+        fraction = min(1.0, sample_size / total) if total else 1.0
+        strata = list(strata)
+
+        size = pl.len().over(strata)
+        quota = pl.max_horizontal(pl.lit(1), (size * fraction).round()).clip(upper_bound=size)
+        sample = (
+            data.with_columns(
+                pl.int_range(pl.len()).shuffle(seed=seed).over(strata).alias('_rank'),
+                quota.alias('_quota'),
+                size.alias('_size')
+            )
+            .filter(pl.col('_rank') < pl.col('_quota'))
+            .with_columns((pl.col('_size') / pl.col('_quota')).alias('sample_weight'))
+            .drop('_rank', '_quota', '_size')
+            .collect()
+        )
+        return sample.to_pandas()
+
+
+ENGINES = {
+    PandasEngine.name: PandasEngine,
+    PolarsEngine.name: PolarsEngine,
+}
+
+
+def available_engines():
+    """Список движков, зависимости которых установлены"""
+    return [name for name in ENGINES if name != 'polars' or pl is not None]
+
+
+def get_engine(engine='pandas'):
+    """Движок по имени (или уже созданный экземпляр AnalysisEngine)"""
+    if isinstance(engine, AnalysisEngine):
+        return engine
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок: {engine}. Доступны: {', '.join(ENGINES)}")
+    return ENGINES[engine]()
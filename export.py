@@ -0,0 +1,209 @@
+"""
+Потоковая выгрузка результатов анализа в XLSX, CSV и Parquet
+
+Таблицы выгрузки (EXPORT_TABLES):
+
+    users     - построчные данные пользователей: даты этапов, сегменты, время между этапами
+    funnel    - метрики воронки
+    segments  - метрики по всем сегментам
+    daily     - дневные метрики
+    cohorts   - матрица когорт (доля удержания по периодам)
+
+Построчные данные пишутся частями по EXPORT_CHUNK_ROWS строк: XLSX - в режиме
+write-only openpyxl, CSV - дописыванием, Parquet - по row group на часть.
+Поэтому выгрузка среза из миллионов строк требует памяти на одну часть, а не
+на весь файл. Файл пишется по пути или в открытый бинарный файловый объект.
+Скачивание из приложения этой гарантии не дает (Streamlit отдает файл из памяти),
+поэтому там срез пользователей ограничен DOWNLOAD_MAX_ROWS строками.
+"""
+
+import io
+
+import pandas as pd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_CHUNK_ROWS = 100_000
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+EXCEL_MAX_ROWS = 1_048_576  # Строк на листе, включая заголовок
+# Строк пользователей для скачивания из приложения: Streamlit читает готовый файл
+# в память сервера целиком, поэтому больший срез выгружается export_table из Python
+DOWNLOAD_MAX_ROWS = 1_000_000
+
+EXPORT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def funnel_table(metrics):
+    """Метрики воронки (calculate_funnel_metrics) в виде таблицы section, metric, value"""
+    return pd.DataFrame(
+        [
+            {'section': section, 'metric': name, 'value': float(value)}
+            for section, values in metrics.items() for name, value in values.items()
+        ],
+        columns=['section', 'metric', 'value']
+    )
+
+
+def segments_table(segments):
+    """Таблицы по сегментам (analyze_by_segments) одной таблицей со столбцом segment"""
+    frames = [table.assign(segment=name) for name, table in segments.items()]
+    if not frames:
+        return pd.DataFrame(columns=['segment', 'segment_value'])
+    table = pd.concat(frames, ignore_index=True)
+    return table[['segment'] + [col for col in table.columns if col != 'segment']]
+
+
+def cohort_matrix(cohorts):
+    """Когорты (calculate_cohort_analysis) в виде матрицы: когорта × период, доля удержания"""
+    if cohorts.empty:
+        return pd.DataFrame(columns=['cohort', 'users'])
+    matrix = cohorts.pivot(index='cohort', columns='period', values='retention_rate')
+    matrix.columns = [f'period_{period}' for period in matrix.columns]
+    users = cohorts.groupby('cohort')['users'].first()
+    matrix.insert(0, 'users', users)
+    matrix = matrix.reset_index()
+    matrix['cohort'] = matrix['cohort'].astype(str)
+    return matrix
+
+
+# Таблица -> расчет по анализатору и фильтрам
+EXPORT_TABLES = {
+    'users': None,  # Построчные данные: FunnelAnalyzer.iter_user_rows
+    'funnel': lambda analyzer, filters: funnel_table(analyzer.calculate_funnel_metrics(filters)),
+    'segments': lambda analyzer, filters: segments_table(analyzer.analyze_by_segments(filters)),
+    'daily': lambda analyzer, filters: analyzer.calculate_daily_metrics(filters),
+    'cohorts': lambda analyzer, filters: cohort_matrix(analyzer.calculate_cohort_analysis(filters)),
+}
+
+
+def table_chunks(analyzer, table, filters=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Таблица выгрузки как последовательность pandas DataFrame"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}. Доступны: {', '.join(EXPORT_TABLES)}")
+    if table == 'users':
+        return analyzer.iter_user_rows(filters, chunk_rows)
+    return [EXPORT_TABLES[table](analyzer, filters)]
+
+
+def _excel_rows(chunk):
+    """Строки части для openpyxl: пропуски (NaN, NaT, NA) - пустые ячейки"""
+    values = chunk.astype(object).where(chunk.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def write_xlsx(sheets, target):
+    """
+    Запись листов в XLSX в режиме write-only (строки не хранятся в памяти)
+
+    Parameters:
+    -----------
+    sheets : dict
+        Название листа -> последовательность pandas DataFrame
+    target : str или бинарный файловый объект
+    """
+    if openpyxl is None:
+        raise ImportError("Для выгрузки в Excel установите пакет openpyxl: pip install openpyxl")
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, chunks in sheets.items():
+        sheet, part, rows = None, 1, 0
+        for chunk in chunks:
+            for row in _excel_rows(chunk):
+                # Лист заполнен: продолжение на следующем (users, users_2, ...)
+                if sheet is None or rows == EXCEL_MAX_ROWS:
+                    sheet = workbook.create_sheet(name if part == 1 else f'{name}_{part}')
+                    sheet.append(list(chunk.columns))
+                    part, rows = part + 1, 1
+                sheet.append(row)
+                rows += 1
+            if sheet is None:
+                # Пустая таблица: лист только с заголовком
+                sheet = workbook.create_sheet(name)
+                sheet.append(list(chunk.columns))
+                part, rows = part + 1, 1
+    workbook.save(target)
+
+
+def write_csv(chunks, target):
+    """Запись частей в один CSV файл (заголовок - только у первой части)"""
+    if isinstance(target, str):
+        handle = open(target, 'w', encoding='utf-8', newline='')
+    else:
+        handle = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    try:
+        for number, chunk in enumerate(chunks):
+            chunk.to_csv(handle, header=number == 0, index=False)
+    finally:
+        if isinstance(target, str):
+            handle.close()
+        else:
+            # Файловый объект остается открытым для вызывающего кода
+            handle.flush()
+            handle.detach()
+
+
+def write_parquet(chunks, target):
+    """Запись частей в один Parquet файл, по row group на часть"""
+    if pq is None:
+        raise ImportError("Для выгрузки в Parquet установите пакет pyarrow: pip install pyarrow")
+
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(target, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_table(analyzer, table, target, file_format='csv', filters=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Выгрузка одной таблицы в CSV, Parquet или XLSX (один лист)
+
+    Parameters:
+    -----------
+    analyzer : FunnelAnalyzer
+        Анализатор (для users - с построчными данными)
+    table : str
+        Название из EXPORT_TABLES
+    target : str или бинарный файловый объект
+    filters : dict, optional
+        Фильтры сегментов и диапазона дат регистрации
+    """
+    chunks = table_chunks(analyzer, table, filters, chunk_rows)
+    if file_format == 'csv':
+        write_csv(chunks, target)
+    elif file_format == 'parquet':
+        write_parquet(chunks, target)
+    elif file_format == 'xlsx':
+        write_xlsx({table: chunks}, target)
+    else:
+        raise ValueError(f"Неизвестный формат: {file_format}. Доступны: {', '.join(EXPORT_FORMATS)}")
+
+
+def export_workbook(analyzer, target, tables=None, filters=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Выгрузка нескольких таблиц в XLSX, по листу на таблицу (по умолчанию - все таблицы)"""
+    tables = list(EXPORT_TABLES) if tables is None else tables
+    write_xlsx(
+        {table: table_chunks(analyzer, table, filters, chunk_rows) for table in tables},
+        target
+    )
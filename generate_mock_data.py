@@ -2,6 +2,73 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Списки возможных значений
+TRAFFIC_SOURCES = [
+    'google_ads', 'facebook_ads', 'instagram_ads', 'tiktok_ads',
+    'organic', 'direct', 'referral', 'email', 'affiliate', 'youtube_ads'
+]
+
+COUNTRIES = [
+    'RU', 'UA', 'BY', 'KZ', 'DE', 'PL', 'CZ', 'SK', 'LT', 'LV',
+    'EE', 'FI', 'SE', 'NO', 'DK', 'NL', 'BE', 'AT', 'CH', 'FR'
+]
+
+DEVICES = ['mobile', 'desktop', 'tablet']
+
+# Веса для более реалистичного распределения
+TRAFFIC_WEIGHTS = [0.25, 0.20, 0.15, 0.10, 0.12, 0.08, 0.05, 0.03, 0.01, 0.01]
+COUNTRY_WEIGHTS = [0.30, 0.15, 0.10, 0.08, 0.05, 0.04, 0.03, 0.03, 0.02, 0.02,
+                   0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02]
+DEVICE_WEIGHTS = [0.65, 0.30, 0.05]
+
+# Базовые вероятности конверсий и их верхние границы
+BASE_DEPOSIT_PROB = 0.25
+BASE_BET_PROB = 0.80
+BASE_SECOND_DEPOSIT_PROB = 0.35
+MAX_DEPOSIT_PROB = 0.8
+MAX_BET_PROB = 0.95
+MAX_SECOND_DEPOSIT_PROB = 0.6
+
+# Корректировка вероятностей по источнику трафика
+TRAFFIC_MULTIPLIERS = {
+    'google_ads': 1.2,
+    'facebook_ads': 1.1,
+    'instagram_ads': 0.9,
+    'tiktok_ads': 0.8,
+    'organic': 1.3,
+    'direct': 1.4,
+    'referral': 1.5,
+    'email': 1.6,
+    'affiliate': 1.1,
+    'youtube_ads': 0.9
+}
+
+# Корректировка по устройству
+DEVICE_MULTIPLIERS = {
+    'mobile': 0.9,
+    'desktop': 1.2,
+    'tablet': 1.0
+}
+
+# Корректировка по стране (некоторые страны более конвертируемые)
+COUNTRY_MULTIPLIERS = {
+    'RU': 1.0, 'UA': 0.9, 'BY': 0.8, 'KZ': 0.7, 'DE': 1.3,
+    'PL': 1.1, 'CZ': 1.0, 'SK': 0.9, 'LT': 0.8, 'LV': 0.8,
+    'EE': 0.9, 'FI': 1.4, 'SE': 1.3, 'NO': 1.5, 'DK': 1.4,
+    'NL': 1.3, 'BE': 1.2, 'AT': 1.2, 'CH': 1.6, 'FR': 1.1
+}
+
 
 def generate_mock_data(n_users=5000, start_date=None, end_date=None):
     """
@@ -31,84 +98,32 @@ def generate_mock_data(n_users=5000, start_date=None, end_date=None):
     np.random.seed(42)
     random.seed(42)
     
-    # Списки возможных значений
-    traffic_sources = [
-        'google_ads', 'facebook_ads', 'instagram_ads', 'tiktok_ads',
-        'organic', 'direct', 'referral', 'email', 'affiliate', 'youtube_ads'
-    ]
-    
-    countries = [
-        'RU', 'UA', 'BY', 'KZ', 'DE', 'PL', 'CZ', 'SK', 'LT', 'LV',
-        'EE', 'FI', 'SE', 'NO', 'DK', 'NL', 'BE', 'AT', 'CH', 'FR'
-    ]
-    
-    devices = ['mobile', 'desktop', 'tablet']
-    
-    # Веса для более реалистичного распределения
-    traffic_weights = [0.25, 0.20, 0.15, 0.10, 0.12, 0.08, 0.05, 0.03, 0.01, 0.01]
-    country_weights = [0.30, 0.15, 0.10, 0.08, 0.05, 0.04, 0.03, 0.03, 0.02, 0.02,
-                      0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02, 0.02]
-    device_weights = [0.65, 0.30, 0.05]
-    
     # Нормализация весов для обеспечения суммы = 1
-    traffic_weights = np.array(traffic_weights) / np.sum(traffic_weights)
-    country_weights = np.array(country_weights) / np.sum(country_weights)
-    device_weights = np.array(device_weights) / np.sum(device_weights)
+    traffic_weights = np.array(TRAFFIC_WEIGHTS) / np.sum(TRAFFIC_WEIGHTS)
+    country_weights = np.array(COUNTRY_WEIGHTS) / np.sum(COUNTRY_WEIGHTS)
+    device_weights = np.array(DEVICE_WEIGHTS) / np.sum(DEVICE_WEIGHTS)
     
     users_data = []
     
     for user_id in range(1, n_users + 1):
         # Базовые характеристики пользователя
-        traffic_source = np.random.choice(traffic_sources, p=traffic_weights)
-        country = np.random.choice(countries, p=country_weights)
-        device = np.random.choice(devices, p=device_weights)
+        traffic_source = np.random.choice(TRAFFIC_SOURCES, p=traffic_weights)
+        country = np.random.choice(COUNTRIES, p=country_weights)
+        device = np.random.choice(DEVICES, p=device_weights)
         
         # Время регистрации
         reg_time = start_date + timedelta(
             seconds=random.randint(0, int((end_date - start_date).total_seconds()))
         )
         
-        # Вероятности конверсий (зависят от источника трафика и устройства)
-        base_deposit_prob = 0.25
-        base_bet_prob = 0.80
-        base_second_deposit_prob = 0.35
-        
-        # Корректировка вероятностей по источнику трафика
-        traffic_multipliers = {
-            'google_ads': 1.2,
-            'facebook_ads': 1.1,
-            'instagram_ads': 0.9,
-            'tiktok_ads': 0.8,
-            'organic': 1.3,
-            'direct': 1.4,
-            'referral': 1.5,
-            'email': 1.6,
-            'affiliate': 1.1,
-            'youtube_ads': 0.9
-        }
-        
-        # Корректировка по устройству
-        device_multipliers = {
-            'mobile': 0.9,
-            'desktop': 1.2,
-            'tablet': 1.0
-        }
-        
-        # Корректировка по стране (некоторые страны более конвертируемые)
-        country_multipliers = {
-            'RU': 1.0, 'UA': 0.9, 'BY': 0.8, 'KZ': 0.7, 'DE': 1.3,
-            'PL': 1.1, 'CZ': 1.0, 'SK': 0.9, 'LT': 0.8, 'LV': 0.8,
-            'EE': 0.9, 'FI': 1.4, 'SE': 1.3, 'NO': 1.5, 'DK': 1.4,
-            'NL': 1.3, 'BE': 1.2, 'AT': 1.2, 'CH': 1.6, 'FR': 1.1
-        }
+        # Вероятности конверсий (зависят от источника трафика, устройства и страны)
+        multiplier = (TRAFFIC_MULTIPLIERS.get(traffic_source, 1.0) * 
+                     DEVICE_MULTIPLIERS.get(device, 1.0) * 
+                     COUNTRY_MULTIPLIERS.get(country, 1.0))
         
-        multiplier = (traffic_multipliers.get(traffic_source, 1.0) * 
-                     device_multipliers.get(device, 1.0) * 
-                     country_multipliers.get(country, 1.0))
-        
-        deposit_prob = min(base_deposit_prob * multiplier, 0.8)
-        bet_prob = min(base_bet_prob * multiplier, 0.95)
-        second_deposit_prob = min(base_second_deposit_prob * multiplier, 0.6)
+        deposit_prob = min(BASE_DEPOSIT_PROB * multiplier, MAX_DEPOSIT_PROB)
+        bet_prob = min(BASE_BET_PROB * multiplier, MAX_BET_PROB)
+        second_deposit_prob = min(BASE_SECOND_DEPOSIT_PROB * multiplier, MAX_SECOND_DEPOSIT_PROB)
         
         # Генерация событий
         deposit_time = None
@@ -230,7 +245,202 @@ def generate_sample_data_with_segments():
     
     return df
 
+# Шардированная генерация больших наборов данных
+SHARD_SIZE = 5_000_000  # Пользователей в шарде по умолчанию
+ROW_GROUP_SIZE = 500_000  # Строк в группе (ограничивает память процесса)
+BAD_DAY_SHARE = 0.7  # Доля пользователей "плохого" дня, теряющих депозит
+
+
+def shard_seed(seed, shard):
+    """Независимый детерминированный seed шарда (не зависит от числа шардов)"""
+    return np.random.SeedSequence(seed, spawn_key=(shard,))
+
+
+def generate_mock_batch(rng, n_users, first_user_id, start_date, end_date, bad_day_start=None):
+    """
+    Векторная генерация пачки пользователей с теми же распределениями,
+    что и generate_mock_data
+    
+    Parameters:
+    -----------
+    rng : np.random.Generator
+        Генератор случайных чисел шарда
+    n_users : int
+        Количество пользователей
+    first_user_id : int
+        user_id первого пользователя пачки
+    bad_day_start : datetime, optional
+        Начало "плохого" дня с пониженной конверсией
+    
+    Returns:
+    --------
+    pd.DataFrame
+        DataFrame в формате generate_mock_data
+    """
+    traffic_weights = np.array(TRAFFIC_WEIGHTS) / np.sum(TRAFFIC_WEIGHTS)
+    country_weights = np.array(COUNTRY_WEIGHTS) / np.sum(COUNTRY_WEIGHTS)
+    device_weights = np.array(DEVICE_WEIGHTS) / np.sum(DEVICE_WEIGHTS)
+    
+    traffic = rng.choice(len(TRAFFIC_SOURCES), size=n_users, p=traffic_weights)
+    country = rng.choice(len(COUNTRIES), size=n_users, p=country_weights)
+    device = rng.choice(len(DEVICES), size=n_users, p=device_weights)
+    
+    # Время в секундах от начала периода
+    span = int((end_date - start_date).total_seconds())
+    reg_seconds = rng.integers(0, span + 1, size=n_users)
+    
+    multiplier = (
+        np.array([TRAFFIC_MULTIPLIERS[value] for value in TRAFFIC_SOURCES])[traffic] *
+        np.array([DEVICE_MULTIPLIERS[value] for value in DEVICES])[device] *
+        np.array([COUNTRY_MULTIPLIERS[value] for value in COUNTRIES])[country]
+    )
+    
+    # Этапы воронки: каждый следующий только после предыдущего
+    has_deposit = rng.random(n_users) < np.minimum(BASE_DEPOSIT_PROB * multiplier, MAX_DEPOSIT_PROB)
+    has_bet = has_deposit & (rng.random(n_users) < np.minimum(BASE_BET_PROB * multiplier, MAX_BET_PROB))
+    has_second_deposit = has_bet & (
+        rng.random(n_users) < np.minimum(BASE_SECOND_DEPOSIT_PROB * multiplier, MAX_SECOND_DEPOSIT_PROB)
+    )
+    
+    deposit_seconds = reg_seconds + rng.integers(5, 2881, size=n_users) * 60  # 5 мин - 48 часов
+    bet_seconds = deposit_seconds + rng.integers(1, 1441, size=n_users) * 60  # 1 мин - 24 часа
+    second_deposit_seconds = bet_seconds + rng.integers(1, 169, size=n_users) * 3600  # 1 час - 7 дней
+    
+    # "Плохой" день: 70% пользователей теряют депозит
+    if bad_day_start is not None:
+        bad_offset = int((bad_day_start - start_date).total_seconds())
+        bad_day = (reg_seconds >= bad_offset) & (reg_seconds < bad_offset + 86400)
+        lost = bad_day & (rng.random(n_users) < BAD_DAY_SHARE)
+        has_deposit &= ~lost
+        has_bet &= ~lost
+        has_second_deposit &= ~lost
+    
+    start = np.datetime64(pd.Timestamp(start_date).floor('s'), 's')
+    
+    def to_time(seconds, mask=None):
+        times = start + seconds.astype('timedelta64[s]')
+        if mask is not None:
+            times[~mask] = np.datetime64('NaT')
+        return times
+    
+    return pd.DataFrame({
+        'user_id': np.arange(first_user_id, first_user_id + n_users, dtype=np.int64),
+        'registration_time': to_time(reg_seconds),
+        'deposit_time': to_time(deposit_seconds, has_deposit),
+        'first_bet_time': to_time(bet_seconds, has_bet),
+        'second_deposit_time': to_time(second_deposit_seconds, has_second_deposit),
+        'traffic_source': np.array(TRAFFIC_SOURCES, dtype=object)[traffic],
+        'country': np.array(COUNTRIES, dtype=object)[country],
+        'device': np.array(DEVICES, dtype=object)[device]
+    })
+
+
+def _write_shard(task):
+    """Генерация одного шарда по группам строк с потоковой записью в part-файл"""
+    (shard, n_users, first_user_id, seed, start_date, end_date,
+     bad_day_start, path, file_format, row_group_size) = task
+    rng = np.random.default_rng(shard_seed(seed, shard))
+    
+    writer = None
+    try:
+        for offset in range(0, n_users, row_group_size):
+            batch = generate_mock_batch(
+                rng, min(row_group_size, n_users - offset), first_user_id + offset,
+                start_date, end_date, bad_day_start
+            )
+            if file_format == 'parquet':
+                table = pa.Table.from_pandas(batch, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            else:
+                if writer is None:
+                    writer = open(path, 'w', newline='')
+                batch.to_csv(writer, header=offset == 0, index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    return path
+
+
+def generate_mock_dataset(n_users, output_dir, n_shards=None, file_format='parquet', seed=42,
+                          start_date=None, end_date=None, workers=None,
+                          row_group_size=ROW_GROUP_SIZE):
+    """
+    Шардированная генерация большого набора данных в part-файлы
+    
+    Шарды независимы и детерминированы: у каждого свой seed, производный
+    от общего, поэтому результат не зависит от числа процессов и порядка
+    их выполнения. Шарды генерируются в пуле процессов, каждый пишет свой
+    файл по группам строк, так что память процесса ограничена row_group_size.
+    
+    Parameters:
+    -----------
+    n_users : int
+        Общее количество пользователей
+    output_dir : str
+        Папка для part-файлов
+    n_shards : int, optional
+        Количество шардов (по умолчанию по SHARD_SIZE пользователей)
+    file_format : str
+        'parquet' или 'csv'
+    seed : int
+        Общий seed набора данных
+    
+    Returns:
+    --------
+    list
+        Пути к part-файлам в порядке шардов
+    """
+    if file_format not in ('parquet', 'csv'):
+        raise ValueError(f"Неизвестный формат: {file_format}. Доступны: parquet, csv")
+    if file_format == 'parquet' and pq is None:
+        raise ImportError("Для записи Parquet установите пакет pyarrow: pip install pyarrow")
+    if start_date is None:
+        start_date = datetime.now() - timedelta(days=30)
+    if end_date is None:
+        end_date = datetime.now()
+    if n_shards is None:
+        n_shards = max(1, -(-n_users // SHARD_SIZE))
+    
+    # "Плохой" день общий для всех шардов (как в generate_mock_data - с 5 по 25 день периода)
+    span_days = max((end_date - start_date).days, 1)
+    low, high = (5, 26) if span_days > 25 else (0, span_days)
+    bad_day_start = start_date + timedelta(days=int(np.random.default_rng(seed).integers(low, high)))
+    
+    os.makedirs(output_dir, exist_ok=True)
+    sizes = [n_users // n_shards + (1 if shard < n_users % n_shards else 0) for shard in range(n_shards)]
+    first_ids = np.cumsum([1] + sizes[:-1])
+    tasks = [
+        (shard, sizes[shard], int(first_ids[shard]), seed, start_date, end_date, bad_day_start,
+         os.path.join(output_dir, f'part-{shard:05d}.{file_format}'), file_format, row_group_size)
+        for shard in range(n_shards)
+    ]
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_shard, tasks))
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Генерация моковых данных')
+    parser.add_argument('--users', type=int, help='Шардированная генерация: общее число пользователей')
+    parser.add_argument('--output', default='mock_dataset', help='Папка для part-файлов')
+    parser.add_argument('--shards', type=int, help='Количество шардов')
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'csv'])
+    parser.add_argument('--workers', type=int, help='Количество процессов')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    if args.users:
+        print(f"Генерация {args.users:,} пользователей в {args.output}...")
+        paths = generate_mock_dataset(
+            args.users, args.output, n_shards=args.shards, file_format=args.format,
+            seed=args.seed, workers=args.workers
+        )
+        print(f"Записано part-файлов: {len(paths)}")
+        raise SystemExit(0)
+    
     # Генерация и сохранение тестовых данных
     print("Генерация моковых данных...")
     
@@ -0,0 +1,109 @@
+"""
+Live-режим: инкрементальное чтение растущего CSV/JSONL файла или папки с файлами
+
+FileTailer запоминает смещение в каждом файле и при каждом обращении
+читает только новые полные строки (и новые файлы в папке).
+LiveFunnelAnalyzer хранит только агрегаты по (день регистрации × сегменты)
+и дополняет их новыми строками, поэтому обновление дашборда не требует
+перечитывания и повторного разбора всех данных.
+
+Каждая новая строка считается новым пользователем (файлы только дополняются).
+"""
+
+import glob
+import io
+import os
+
+import pandas as pd
+
+from aggregates import AggregateFunnelAnalyzer, aggregate_rows, merge_aggregates
+
+TAIL_PATTERNS = ('*.csv', '*.jsonl', '*.json')
+
+
+class FileTailer:
+    """Чтение только новых строк из файла или папки с файлами"""
+
+    def __init__(self, path, patterns=TAIL_PATTERNS):
+        self.path = path
+        self.patterns = patterns
+        self.offsets = {}
+        self.headers = {}
+
+    def files(self):
+        """Отслеживаемые файлы (для папки - в порядке имен, например по часам)"""
+        if os.path.isdir(self.path):
+            found = set()
+            for pattern in self.patterns:
+                found.update(glob.glob(os.path.join(self.path, '**', pattern), recursive=True))
+            return sorted(found)
+        return [self.path] if os.path.exists(self.path) else []
+
+    def read_new(self):
+        """Новые полные строки всех файлов с момента предыдущего вызова"""
+        frames = []
+
+        for file_path in self.files():
+            size = os.path.getsize(file_path)
+            offset = self.offsets.get(file_path, 0)
+
+            # Файл перезаписан или усечен - читаем заново
+            if size < offset:
+                offset = 0
+                self.headers.pop(file_path, None)
+            if size == offset:
+                continue
+
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+
+            # Незавершенная последняя строка будет прочитана в следующий раз
+            end = chunk.rfind(b'\n')
+            if end < 0:
+                continue
+            chunk = chunk[:end + 1]
+            self.offsets[file_path] = offset + end + 1
+
+            if file_path.endswith('.csv'):
+                if file_path not in self.headers:
+                    header_end = chunk.find(b'\n') + 1
+                    self.headers[file_path] = chunk[:header_end]
+                    chunk = chunk[header_end:]
+                if chunk.strip():
+                    frames.append(pd.read_csv(io.BytesIO(self.headers[file_path] + chunk)))
+            elif chunk.strip():
+                frames.append(pd.read_json(io.BytesIO(chunk), lines=True))
+
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+
+class LiveFunnelAnalyzer(AggregateFunnelAnalyzer):
+    """Анализ воронки по инкрементально пополняемым агрегатам"""
+
+    def __init__(self, path, patterns=TAIL_PATTERNS):
+        super().__init__()
+        self.tailer = FileTailer(path, patterns)
+        self.rows_ingested = 0
+        self.last_refresh = None
+        self.refresh()
+
+    def refresh(self):
+        """Чтение новых строк и обновление агрегатов; возвращает число новых строк"""
+        batch = self.tailer.read_new()
+        self.last_refresh = pd.Timestamp.now()
+        if batch.empty:
+            return 0
+        self.ingest(batch)
+        return len(batch)
+
+    def ingest(self, batch):
+        """Добавление строк к агрегатам (объединение небольших таблиц, без сырых данных)"""
+        parts = [aggregate_rows(batch)]
+        if self.aggregates is not None:
+            parts.insert(0, (self.aggregates, self.cohort_pairs))
+        self.aggregates, self.cohort_pairs = merge_aggregates(parts)
+        self.rows_ingested += len(batch)
+        self._reset_caches()
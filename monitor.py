@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Онлайн-монитор аномалий по часовым батчам событий
+
+Для каждого ряда (все данные, значения сегментов и, по желанию, их пары)
+и каждой метрики (регистрации, депозиты, первые ставки, вторые депозиты
+за час) хранится состояние EWMA среднего и дисперсии отдельно для каждого
+часа суток. Состояние сохраняется в JSON файл и обновляется по одному
+часовому батчу за время, не зависящее от длины истории. Состояние можно
+пересобрать по всей истории за один проход.
+
+Батч - строки пользователей в формате входного CSV: регистрация
+учитывается в часе registration_time, депозит - в часе deposit_time и т.д.
+
+Использование:
+    python monitor.py --state state.json rebuild history.csv
+    python monitor.py --state state.json update batch.csv [--hour "2025-07-01 13:00"]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS, STAGE_COUNTS, _as_datetime
+from significance import CELL_SEPARATOR
+
+# Метрика -> столбец времени события
+METRIC_TIME_COLUMNS = {
+    'registrations': 'registration_time',
+    'deposits': 'deposit_time',
+    'first_bets': 'first_bet_time',
+    'second_deposits': 'second_deposit_time',
+}
+
+EWMA_SPAN_DAYS = 7  # Сглаживание по одноименным часам соседних дней
+MIN_HISTORY = 5  # Минимум наблюдений часа суток до начала детекции
+Z_THRESHOLD = 3.0
+SLOTS = 24  # Часы суток
+STATE_VERSION = 1
+OVERALL_KEY = 'all=all'
+
+
+def series_key(dimension, value):
+    """Ключ ряда в состоянии монитора"""
+    return f"{dimension}={value}"
+
+
+def hourly_series_counts(df, segments=SEGMENT_COLUMNS, max_order=1):
+    """
+    Количество событий каждой метрики по часам и рядам сегментов
+
+    Сначала данные агрегируются по (час, значения сегментов), подписи рядов
+    строятся уже по агрегатам, поэтому строковые операции не зависят от числа строк.
+
+    Returns:
+    --------
+    pd.DataFrame
+        hour, series, metric, count
+    """
+    frames = []
+    for metric, time_column in METRIC_TIME_COLUMNS.items():
+        if time_column not in df.columns:
+            continue
+        hour = _as_datetime(df[time_column]).dt.floor('h').rename('hour')
+        for order in range(0, max_order + 1):
+            for combo in combinations(segments, order):
+                combo = list(combo)
+                counts = (
+                    hour.groupby([hour] + [df[col] for col in combo], observed=True, dropna=True)
+                        .size()
+                        .reset_index(name='count')
+                )
+                if combo:
+                    label = counts[combo[0]].astype(str)
+                    for column in combo[1:]:
+                        label = label + CELL_SEPARATOR + counts[column].astype(str)
+                    key = CELL_SEPARATOR.join(combo) + '=' + label
+                else:
+                    key = pd.Series(OVERALL_KEY, index=counts.index)
+                frames.append(pd.DataFrame({
+                    'hour': counts['hour'],
+                    'series': key.to_numpy(dtype=object),
+                    'metric': metric,
+                    'count': counts['count'].to_numpy(dtype=float),
+                }))
+
+    if not frames:
+        return pd.DataFrame(columns=['hour', 'series', 'metric', 'count'])
+    return pd.concat(frames, ignore_index=True)
+
+
+class OnlineAnomalyMonitor:
+    """Онлайн-детектор аномалий с сохраняемым O(1) состоянием EWMA"""
+
+    def __init__(self, state_path=None, segments=SEGMENT_COLUMNS, max_order=None,
+                 span_days=EWMA_SPAN_DAYS, min_history=MIN_HISTORY,
+                 z_threshold=Z_THRESHOLD, alert_callback=None):
+        self.state_path = state_path
+        self.segments = list(segments)
+        self.max_order = 1 if max_order is None else max_order
+        self.alpha = 2.0 / (span_days + 1)
+        self.min_history = min_history
+        self.z_threshold = z_threshold
+        self.alert_callback = alert_callback
+        self._reset()
+
+        if state_path and os.path.exists(state_path):
+            self.load()
+            # max_order=None - порядок берется из сохраненного состояния
+            if max_order is not None and max_order != self.max_order:
+                raise ValueError(
+                    f"Состояние {state_path} собрано с max_order={self.max_order}, "
+                    f"запрошен max_order={max_order}: пересоберите состояние (rebuild)"
+                )
+
+    def _reset(self):
+        """Пустое состояние"""
+        self.series = []
+        self.series_index = {}
+        self.last_hour = None
+        self.mean = {metric: np.zeros((0, SLOTS)) for metric in STAGE_COUNTS}
+        self.var = {metric: np.zeros((0, SLOTS)) for metric in STAGE_COUNTS}
+        self.observations = np.zeros((0, SLOTS), dtype=np.int64)
+
+    def _ensure_series(self, keys):
+        """Добавление новых рядов с пустым состоянием"""
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.series_index]
+        if not new_keys:
+            return
+        for key in new_keys:
+            self.series_index[key] = len(self.series)
+            self.series.append(key)
+        extra = np.zeros((len(new_keys), SLOTS))
+        for metric in STAGE_COUNTS:
+            self.mean[metric] = np.vstack([self.mean[metric], extra])
+            self.var[metric] = np.vstack([self.var[metric], extra])
+        self.observations = np.vstack([self.observations, extra.astype(np.int64)])
+
+    def _step(self, hour, counts, emit=True):
+        """
+        Проверка и обновление состояния за один час
+
+        counts - метрика -> вектор количества событий по всем рядам (отсутствующие ряды = 0)
+        """
+        slot = hour.hour
+        seen = self.observations[:, slot]
+        ready = seen >= self.min_history
+        first = seen == 0
+        alerts = []
+
+        for metric in STAGE_COUNTS:
+            actual = counts[metric]
+            mean = self.mean[metric][:, slot]
+            var = self.var[metric][:, slot]
+
+            if emit:
+                # Пуассоновская добавка защищает ряды с почти постоянным объемом
+                std = np.sqrt(var + mean)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    z_scores = np.where(ready & (std > 0), (actual - mean) / std, np.nan)
+                for i in np.flatnonzero(np.abs(np.nan_to_num(z_scores)) > self.z_threshold):
+                    dimension, value = self.series[i].split('=', 1)
+                    alerts.append({
+                        'hour': hour.isoformat(),
+                        'dimension': dimension,
+                        'segment_value': value,
+                        'metric': metric,
+                        'actual': float(actual[i]),
+                        'expected': float(mean[i]),
+                        'z_score': float(z_scores[i]),
+                        'direction': 'drop' if z_scores[i] < 0 else 'spike',
+                    })
+
+            delta = actual - mean
+            self.mean[metric][:, slot] = np.where(first, actual, mean + self.alpha * delta)
+            self.var[metric][:, slot] = np.where(
+                first, 0.0, (1 - self.alpha) * (var + self.alpha * delta * delta)
+            )
+
+        self.observations[:, slot] += 1
+        self.last_hour = hour
+
+        alerts.sort(key=lambda alert: abs(alert['actual'] - alert['expected']), reverse=True)
+        if self.alert_callback is not None:
+            for alert in alerts:
+                self.alert_callback(alert)
+        return alerts
+
+    def update(self, events, hour=None):
+        """
+        Обработка одного часового батча
+
+        Строки батча - пользователи, у которых в этот час было событие, поэтому
+        в них есть и более ранние этапы. События уже учтенных часов пропускаются
+        (они были учтены в своих батчах), события часов между последним учтенным
+        и текущим учитываются в своих часах, а часы без событий - как нулевые
+        (как в rebuild); алерты - только за текущий час.
+
+        Parameters:
+        -----------
+        events : pd.DataFrame
+            Строки пользователей, события которых произошли в этот час
+        hour : datetime-like
+            Начало часа (по умолчанию - час самого позднего события батча
+            по всем этапам)
+
+        Returns:
+        --------
+        list
+            Алерты (словари, готовые для JSON)
+        """
+        counts = hourly_series_counts(events, self.segments, self.max_order)
+        if hour is None:
+            hour = counts['hour'].max() if not counts.empty else pd.NaT
+            if pd.isna(hour):
+                raise ValueError("Не удалось определить час батча: укажите hour")
+        hour = pd.Timestamp(hour).floor('h')
+        if self.last_hour is not None and hour <= self.last_hour:
+            raise ValueError(f"Час {hour} уже учтен (последний: {self.last_hour})")
+
+        later = counts['hour'] > hour
+        if later.any():
+            raise ValueError(
+                f"В батче есть события после часа {hour} (до {counts.loc[later, 'hour'].max()}): "
+                f"укажите час батча или разделите батч по часам"
+            )
+
+        first_hour = hour if self.last_hour is None else self.last_hour + pd.Timedelta(hours=1)
+        counts = counts[counts['hour'] >= first_hour]
+        self._ensure_series([OVERALL_KEY] + counts['series'].tolist())
+
+        by_hour = dict(tuple(counts.groupby('hour')))
+        alerts = []
+        step_hour = first_hour
+        while step_hour <= hour:
+            vectors = {metric: np.zeros(len(self.series)) for metric in STAGE_COUNTS}
+            hour_counts = by_hour.get(step_hour)
+            if hour_counts is not None:
+                for metric, metric_counts in hour_counts.groupby('metric'):
+                    rows = metric_counts['series'].map(self.series_index).to_numpy(dtype=np.int64)
+                    np.add.at(vectors[metric], rows, metric_counts['count'].to_numpy())
+            alerts = self._step(step_hour, vectors, emit=step_hour == hour)
+            step_hour += pd.Timedelta(hours=1)
+
+        if self.state_path:
+            self.save()
+        return alerts
+
+    def rebuild(self, history):
+        """
+        Пересборка состояния по всей истории за один проход
+
+        Все события агрегируются в матрицы (ряды × часы), затем состояние
+        последовательно обновляется по часам сразу для всех рядов.
+        """
+        self._reset()
+        counts = hourly_series_counts(history, self.segments, self.max_order)
+        if counts.empty:
+            return
+
+        self._ensure_series([OVERALL_KEY] + counts['series'].unique().tolist())
+        start = counts['hour'].min()
+        n_hours = int((counts['hour'].max() - start) // pd.Timedelta(hours=1)) + 1
+        hour_index = ((counts['hour'] - start) // pd.Timedelta(hours=1)).to_numpy(dtype=np.int64)
+        series_index = counts['series'].map(self.series_index).to_numpy(dtype=np.int64)
+
+        matrices = {}
+        size = len(self.series) * n_hours
+        for metric in STAGE_COUNTS:
+            mask = (counts['metric'] == metric).to_numpy()
+            flat = series_index[mask] * n_hours + hour_index[mask]
+            matrices[metric] = np.bincount(
+                flat, weights=counts['count'].to_numpy()[mask], minlength=size
+            ).reshape(len(self.series), n_hours)
+
+        for offset in range(n_hours):
+            hour = start + pd.Timedelta(hours=offset)
+            self._step(hour, {metric: matrices[metric][:, offset] for metric in STAGE_COUNTS}, emit=False)
+
+        if self.state_path:
+            self.save()
+
+    def save(self):
+        """Атомарное сохранение состояния в JSON"""
+        state = {
+            'version': STATE_VERSION,
+            'alpha': self.alpha,
+            'segments': self.segments,
+            'max_order': self.max_order,
+            'last_hour': self.last_hour.isoformat() if self.last_hour is not None else None,
+            'series': self.series,
+            'observations': self.observations.tolist(),
+            'mean': {metric: values.tolist() for metric, values in self.mean.items()},
+            'var': {metric: values.tolist() for metric, values in self.var.items()},
+        }
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def load(self):
+        """Загрузка состояния из JSON"""
+        with open(self.state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(f"Неподдерживаемая версия состояния: {state.get('version')}")
+
+        self.alpha = state['alpha']
+        self.segments = state['segments']
+        self.max_order = state['max_order']
+        self.last_hour = pd.Timestamp(state['last_hour']) if state['last_hour'] else None
+        self.series = state['series']
+        self.series_index = {key: i for i, key in enumerate(self.series)}
+        self.observations = np.array(state['observations'], dtype=np.int64).reshape(-1, SLOTS)
+        self.mean = {m: np.array(v, dtype=float).reshape(-1, SLOTS) for m, v in state['mean'].items()}
+        self.var = {m: np.array(v, dtype=float).reshape(-1, SLOTS) for m, v in state['var'].items()}
+
+
+def main():
+    """Командная строка: алерты выводятся в stdout как JSON lines"""
+    parser = argparse.ArgumentParser(description='Онлайн-монитор аномалий воронки')
+    parser.add_argument('--state', required=True, help='Файл состояния (JSON)')
+    parser.add_argument('--threshold', type=float, default=Z_THRESHOLD, help='Порог |z|')
+    parser.add_argument('--max-order', type=int, default=None,
+                        help='1 - сегменты, 2 - и их пары (по умолчанию - из состояния или 1)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    rebuild_parser = subparsers.add_parser('rebuild', help='Пересобрать состояние по истории')
+    rebuild_parser.add_argument('history', help='CSV с полной историей')
+
+    update_parser = subparsers.add_parser('update', help='Обработать часовой батч')
+    update_parser.add_argument('batch', help='CSV с событиями за час')
+    update_parser.add_argument('--hour', help='Начало часа (по умолчанию - из данных)')
+
+    args = parser.parse_args()
+
+    if args.command == 'rebuild' and os.path.exists(args.state):
+        os.remove(args.state)
+
+    monitor = OnlineAnomalyMonitor(
+        args.state,
+        max_order=args.max_order,
+        z_threshold=args.threshold,
+        alert_callback=lambda alert: print(json.dumps(alert, ensure_ascii=False))
+    )
+
+    if args.command == 'rebuild':
+        monitor.rebuild(pd.read_csv(args.history))
+        print(f"✅ Состояние пересобрано: {len(monitor.series)} рядов, последний час {monitor.last_hour}",
+              file=sys.stderr)
+    else:
+        monitor.update(pd.read_csv(args.batch), hour=args.hour)
+
+
+if __name__ == '__main__':
+    main()
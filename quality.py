@@ -0,0 +1,96 @@
+"""
+Проверка качества данных при подготовке
+
+Один векторный проход по столбцам дат (datetime64) и user_id находит строки,
+которые искажают метрики:
+
+    order_violation   - этап раньше предыдущего (отрицательное время между этапами)
+    orphaned_stage    - этап есть, а одного из предыдущих нет
+    duplicate_user    - user_id уже встречался (помечаются повторы, первая строка остается)
+    future_timestamp  - дата этапа позже момента загрузки
+    unparseable_date  - непустое исходное значение даты, которое не удалось разобрать
+
+Результат - число строк и примеры по каждой проверке и маска карантина
+(строки хотя бы с одной проблемой), которую можно использовать для их исключения.
+"""
+
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_datetime
+from engines import DATE_COLUMNS
+
+QUALITY_CHECKS = ['order_violation', 'orphaned_stage', 'duplicate_user',
+                  'future_timestamp', 'unparseable_date']
+QUALITY_EXAMPLES = 5  # Примеров строк в отчете по каждой проверке
+FUTURE_TOLERANCE = pd.Timedelta(hours=1)  # Допуск на расхождение часов источника
+
+
+def _duplicated_ids(user_ids):
+    """Повторы user_id; для упорядоченных id - сравнение соседей без хеш-таблицы"""
+    if user_ids.is_monotonic_increasing:
+        values = user_ids.to_numpy()
+        return np.concatenate([[False], values[1:] == values[:-1]])
+    return user_ids.duplicated(keep='first').to_numpy()
+
+
+def check_data_quality(df, raw=None, now=None):
+    """
+    Проверка строк данных воронки
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Данные; неразобранные столбцы дат разбираются (parse_datetime)
+    raw : pd.DataFrame, optional
+        Исходные данные до разбора дат с тем же индексом (для unparseable_date,
+        если даты в df уже разобраны)
+    now : pd.Timestamp, optional
+        Момент загрузки для future_timestamp (по умолчанию - текущее время)
+
+    Returns:
+    --------
+    dict
+        'rows' - число строк, 'counts' - проверка -> число строк,
+        'examples' - проверка -> DataFrame с примерами строк,
+        'quarantine' - pd.Series (bool, индекс df): строка не прошла хотя бы одну проверку
+    """
+    raw = df if raw is None else raw
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    future_after = np.datetime64(now + FUTURE_TOLERANCE)
+    n_rows = len(df)
+
+    flags = {check: np.zeros(n_rows, dtype=bool) for check in QUALITY_CHECKS}
+    previous_times = None
+    missing_before = np.zeros(n_rows, dtype=bool)
+
+    # Этапы по порядку: каждый сравнивается с предыдущим
+    for col in DATE_COLUMNS:
+        if col not in df.columns:
+            continue
+        # datetime64 в единицах столбца без преобразования; сравнения с NaT дают False
+        times = parse_datetime(df[col]).to_numpy()
+        present = ~np.isnat(times)
+
+        if not pd.api.types.is_datetime64_any_dtype(raw[col]):
+            flags['unparseable_date'] |= raw[col].notna().to_numpy() & ~present
+        flags['future_timestamp'] |= times > future_after
+        flags['orphaned_stage'] |= present & missing_before
+        if previous_times is not None:
+            flags['order_violation'] |= times < previous_times
+
+        missing_before |= ~present
+        previous_times = times
+
+    if 'user_id' in df.columns:
+        flags['duplicate_user'] = _duplicated_ids(df['user_id'])
+
+    quarantine = np.logical_or.reduce(list(flags.values())) if n_rows else np.zeros(0, dtype=bool)
+    return {
+        'rows': n_rows,
+        'counts': {check: int(flag.sum()) for check, flag in flags.items()},
+        'examples': {
+            check: df.iloc[np.flatnonzero(flag)[:QUALITY_EXAMPLES]] for check, flag in flags.items()
+        },
+        'quarantine': pd.Series(quarantine, index=df.index, name='quarantine')
+    }
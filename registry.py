@@ -0,0 +1,139 @@
+"""
+Общий реестр наборов данных в памяти сервера
+
+Несколько сессий Streamlit, открывших один и тот же набор данных, работают
+с одним анализатором: набор загружается один раз на процесс (из рабочего
+пространства - чтением сохраненных Arrow-файлов), а сессии держат только
+аренду (DatasetLease) и строят свои срезы и фильтры поверх общих данных.
+
+Подготовленные данные анализатора (df и массивы движка) сессии только читают.
+Общими остаются ленивые кэши анализатора (_aggregates, _sample): они
+заполняются при первом обращении из любой сессии без блокировки. Значение
+кэша вычисляется целиком и записывается одним присваиванием, поэтому сессия
+видит либо готовое значение, либо его отсутствие; при одновременном первом
+обращении одно значение может быть вычислено дважды. Реестр считает аренды: когда последняя сессия
+закрывает набор (аренда освобождена явно или удалена вместе с состоянием
+сессии), набор выгружается из памяти.
+"""
+
+import threading
+import weakref
+
+
+class _Entry:
+    """Набор данных в реестре"""
+
+    def __init__(self, name):
+        self.name = name
+        self.analyzer = None
+        self.error = None
+        self.refs = 0
+        self.ready = threading.Event()
+
+
+class DatasetLease:
+    """
+    Аренда общего набора данных
+
+    Освобождается вызовом release() или автоматически, когда объект удален
+    (например, вместе с состоянием закрытой сессии).
+    """
+
+    def __init__(self, registry, key, entry):
+        self.key = key
+        self.analyzer = entry.analyzer
+        self._finalizer = weakref.finalize(self, registry._release, key, entry)
+
+    def release(self):
+        self._finalizer()
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+
+class DatasetRegistry:
+    """Потокобезопасный реестр наборов данных со счетчиком аренд"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, loader, name=None):
+        """
+        Аренда набора данных; загрузка - только если набора еще нет в памяти
+
+        Parameters:
+        -----------
+        key : hashable
+            Ключ набора (например, хеш содержимого и движок анализа)
+        loader : callable
+            Функция без аргументов, возвращающая анализатор. Вызывается один
+            раз, даже если набор одновременно открывают несколько сессий
+        name : str, optional
+            Название набора для списка
+
+        Returns:
+        --------
+        DatasetLease
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self._entries[key] = _Entry(name)
+            entry.refs += 1
+
+        if owner:
+            try:
+                entry.analyzer = loader()
+            except BaseException as e:
+                entry.error = e
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+                raise
+            finally:
+                entry.ready.set()
+        else:
+            entry.ready.wait()
+            if entry.error is not None:
+                raise entry.error
+
+        return DatasetLease(self, key, entry)
+
+    def _release(self, key, entry):
+        with self._lock:
+            entry.refs -= 1
+            # Последняя аренда: набор выгружается (запись могла быть заменена после ошибки загрузки)
+            if entry.refs <= 0 and self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def entries(self):
+        """
+        Наборы в памяти
+
+        Returns:
+        --------
+        list
+            dict: key, name, sessions (число аренд), rows
+        """
+        with self._lock:
+            items = list(self._entries.items())
+        return [
+            {
+                'key': key,
+                'name': entry.name,
+                'sessions': entry.refs,
+                'rows': len(entry.analyzer.df) if entry.analyzer is not None and entry.analyzer.df is not None else None
+            }
+            for key, entry in items if entry.ready.is_set() and entry.error is None
+        ]
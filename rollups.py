@@ -0,0 +1,172 @@
+"""
+Календарные сводки по дням, неделям и месяцам и сравнение периодов
+
+Сводки строятся один раз из дневной агрегации (engine.daily_strata_counts):
+она уже содержит счетчики этапов по дням, поэтому неделя и месяц - это
+группировка нескольких сотен строк, а не повторный проход по данным.
+Сравнения периодов - выборка предыдущего периода по дате его начала в той же
+маленькой таблице:
+
+    previous      - период с предыдущим (день, неделя или месяц)
+    same_weekday  - день с тем же днем недели неделей раньше
+
+Неполные периоды (неделя или месяц, в которых есть не все дни) сравниваются
+по регистрациям в среднем за день с данными, конверсии - как есть.
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import STAGE_COUNTS
+
+ROLLUP_PERIODS = ['day', 'week', 'month']
+COMPARISON_MODES = ['previous', 'same_weekday']
+
+
+def _period_starts(dates, period):
+    """Начало дня, недели (понедельник) или месяца для каждой даты"""
+    days = dates.to_numpy(dtype='datetime64[D]')
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 - четверг: сдвиг на 3 дня дает понедельник = 0
+        weekday = (days.astype(np.int64) + 3) % 7
+        return days - weekday.astype('timedelta64[D]')
+    if period == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Неизвестный период: {period}. Доступны: {', '.join(ROLLUP_PERIODS)}")
+
+
+def _previous_starts(starts, period, mode):
+    """Начало периода, с которым сравнивается каждый период"""
+    if mode == 'same_weekday':
+        if period != 'day':
+            raise ValueError("Сравнение с тем же днем недели доступно только для дней")
+        return starts - np.timedelta64(7, 'D')
+    if mode != 'previous':
+        raise ValueError(f"Неизвестный режим сравнения: {mode}. Доступны: {', '.join(COMPARISON_MODES)}")
+    if period == 'month':
+        return (starts.astype('datetime64[M]') - 1).astype('datetime64[D]')
+    return starts - np.timedelta64(7 if period == 'week' else 1, 'D')
+
+
+def calendar_rollups(daily_counts):
+    """
+    Сводки по дням, неделям и месяцам
+
+    Parameters:
+    -----------
+    daily_counts : pd.DataFrame
+        Результат engine.daily_strata_counts (date + сегменты + счетчики этапов)
+
+    Returns:
+    --------
+    dict
+        Период ('day', 'week', 'month') -> pd.DataFrame: period_start, days
+        (дней с регистрациями), счетчики этапов, reg_to_deposit_conv и
+        overall_conv (%), по возрастанию period_start
+    """
+    dates = pd.to_datetime(daily_counts['date'])
+    # Сводка по дням из страт - основа для недель и месяцев
+    daily = daily_counts[STAGE_COUNTS].groupby(dates.dt.normalize().to_numpy(), sort=True).sum()
+    days = pd.Series(daily.index)
+
+    rollups = {}
+    for period in ROLLUP_PERIODS:
+        starts = _period_starts(days, period)
+        grouped = daily.groupby(starts, sort=True)
+        table = grouped.sum().astype(np.int64)
+        table.insert(0, 'days', grouped.size().to_numpy())
+        table.index = pd.DatetimeIndex(table.index, name='period_start').as_unit('ns')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            registrations = table['registrations'].to_numpy(dtype=float)
+            table['reg_to_deposit_conv'] = np.where(
+                registrations > 0, table['deposits'] / registrations * 100, 0.0
+            )
+            table['overall_conv'] = np.where(
+                registrations > 0, table['second_deposits'] / registrations * 100, 0.0
+            )
+        rollups[period] = table.reset_index()
+    return rollups
+
+
+def compare_periods(rollups, period='day', mode='previous'):
+    """
+    Сравнение каждого периода с предыдущим или с тем же днем недели
+
+    Returns:
+    --------
+    pd.DataFrame
+        period_start, compared_start, registrations, reg_to_deposit_conv и
+        их значения в периоде сравнения (*_before), изменение конверсии
+        (conv_change - относительное, conv_change_pp - в процентных пунктах)
+        и регистраций в среднем за день (registrations_change). Только
+        периоды, для которых период сравнения есть в данных
+    """
+    if period not in rollups:
+        raise ValueError(f"Неизвестный период: {period}. Доступны: {', '.join(ROLLUP_PERIODS)}")
+    table = rollups[period].set_index('period_start')
+    starts = table.index.to_numpy(dtype='datetime64[D]')
+    compared = pd.DatetimeIndex(_previous_starts(starts, period, mode)).as_unit('ns')
+
+    # Период сравнения - поиск по дате начала в той же таблице
+    before = table.reindex(compared)
+    found = before['registrations'].notna().to_numpy()
+
+    per_day = table['registrations'] / table['days']
+    per_day_before = (before['registrations'] / before['days']).to_numpy()
+    conv = table['reg_to_deposit_conv'].to_numpy()
+    conv_before = before['reg_to_deposit_conv'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        conv_change = np.where(conv_before > 0, (conv - conv_before) / conv_before * 100, np.nan)
+        registrations_change = np.where(
+            per_day_before > 0, (per_day.to_numpy() - per_day_before) / per_day_before * 100, np.nan
+        )
+
+    result = pd.DataFrame({
+        'period_start': table.index,
+        'compared_start': compared,
+        'days': table['days'].to_numpy(),
+        'registrations': table['registrations'].to_numpy(),
+        'registrations_before': before['registrations'].to_numpy(),
+        'registrations_change': registrations_change,
+        'reg_to_deposit_conv': conv,
+        'reg_to_deposit_conv_before': conv_before,
+        'conv_change': conv_change,
+        'conv_change_pp': conv - conv_before
+    })
+    return result[found].reset_index(drop=True)
+
+
+def find_period_anomalies(comparison, threshold=0.5):
+    """
+    Резкие изменения конверсии в депозит и регистраций между периодами
+
+    Parameters:
+    -----------
+    comparison : pd.DataFrame
+        Результат compare_periods
+    threshold : float
+        Относительное изменение (0.5 = 50%), которое считается аномалией
+
+    Returns:
+    --------
+    list
+        Описания аномалий в формате detect_anomalies
+    """
+    anomalies = []
+    limit = threshold * 100
+    for row in comparison.itertuples(index=False):
+        label = f"{row.period_start.date()} к {row.compared_start.date()}"
+        if abs(row.conv_change) > limit:
+            direction = "упала" if row.conv_change < 0 else "выросла"
+            anomalies.append(
+                f"Конверсия в депозит {direction} на {abs(row.conv_change):.1f}% "
+                f"({row.reg_to_deposit_conv_before:.1f}% → {row.reg_to_deposit_conv:.1f}%, {label})"
+            )
+        if abs(row.registrations_change) > limit:
+            direction = "упали" if row.registrations_change < 0 else "выросли"
+            anomalies.append(
+                f"Регистрации в среднем за день {direction} на {abs(row.registrations_change):.1f}% ({label})"
+            )
+    return anomalies
@@ -7,6 +7,7 @@
     python run.py              # Запуск с настройками по умолчанию
     python run.py --port 8502   # Запуск на другом порту
     python run.py --debug       # Запуск в режиме отладки
+    python run.py --api --data data.csv   # Запуск HTTP JSON API (порт 8000)
 """
 
 import os
@@ -82,6 +83,28 @@ def run_streamlit_app(port=8501, debug=False):
     
     return True
 
+def run_api_server(data_path, port=8000, engine='pandas'):
+    """Запуск HTTP JSON API для загруженного набора данных"""
+    if not data_path or not Path(data_path).exists():
+        print(f"❌ Файл данных не найден: {data_path}")
+        return False
+    
+    from api import FunnelAPI, load_analyzer
+    
+    print(f"📂 Загрузка данных: {data_path}")
+    analyzer = load_analyzer(data_path, engine=engine)
+    
+    print(f"🌐 API доступно по адресу: http://localhost:{port}/metrics/funnel")
+    print("⏹️  Для остановки нажмите Ctrl+C")
+    print("-" * 50)
+    
+    try:
+        FunnelAPI(analyzer).run(port=port)
+    except KeyboardInterrupt:
+        print("\n👋 API остановлено пользователем")
+    
+    return True
+
 def main():
     """Главная функция"""
     parser = argparse.ArgumentParser(
@@ -107,6 +130,30 @@ def main():
         help='Пропустить проверку зависимостей'
     )
     
+    parser.add_argument(
+        '--api', 
+        action='store_true',
+        help='Запустить HTTP JSON API вместо веб-интерфейса'
+    )
+    
+    parser.add_argument(
+        '--data', 
+        help='CSV/Parquet файл, папка с партициями или база SQLite/DuckDB для API'
+    )
+    
+    parser.add_argument(
+        '--api-port', 
+        type=int, 
+        default=8000,
+        help='Порт HTTP API (по умолчанию: 8000)'
+    )
+    
+    parser.add_argument(
+        '--engine', 
+        default='pandas',
+        help='Движок анализа для API: pandas или polars'
+    )
+    
     args = parser.parse_args()
     
     print("📊 FunnelAnalyzerApp - Анализ воронки конверсий в гемблинге")
@@ -118,7 +165,10 @@ def main():
             sys.exit(1)
     
     # Запуск приложения
-    success = run_streamlit_app(port=args.port, debug=args.debug)
+    if args.api:
+        success = run_api_server(args.data, port=args.api_port, engine=args.engine)
+    else:
+        success = run_streamlit_app(port=args.port, debug=args.debug)
     
     if not success:
         sys.exit(1)
@@ -0,0 +1,133 @@
+"""
+Приближенный режим анализа по стратифицированной выборке
+
+Выборка строится один раз на набор данных (страты - комбинации сегментов
+traffic_source × country × device), поэтому любые фильтры по сегментам
+остаются несмещенными: фильтр просто отбирает целые страты. Оценки
+счетчиков взвешиваются весами страт, конверсии сопровождаются 95%
+доверительными интервалами Вильсона по эффективному размеру выборки (Киш).
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import (SEGMENT_COLUMNS, STAGE_TRANSITIONS, CONVERSIONS, SEGMENT_CONVERSION_COLUMNS,
+                     metrics_from_counts, wilson_interval)
+
+APPROX_SAMPLE_SIZE = 100_000  # Размер выборки по умолчанию
+CONFIDENCE_Z = 1.96  # 95% доверительный интервал
+
+
+def _weighted_stage_sums(sample, codes=None, n_groups=1):
+    """
+    Взвешенные суммы (и суммы квадратов весов) по этапам для каждой группы
+
+    Returns:
+    --------
+    dict
+        этап -> (сумма весов, сумма квадратов весов), массивы длины n_groups
+    """
+    weights = sample['sample_weight'].to_numpy(dtype=float)
+    if codes is None:
+        codes = np.zeros(len(sample), dtype=np.int64)
+
+    stages = {
+        'registrations': np.ones(len(sample), dtype=bool),
+        'deposits': sample['deposit_time'].notna().to_numpy(),
+        'first_bets': sample['first_bet_time'].notna().to_numpy(),
+        'second_deposits': sample['second_deposit_time'].notna().to_numpy(),
+    }
+    return {
+        stage: (
+            np.bincount(codes, weights=weights * flags, minlength=n_groups),
+            np.bincount(codes, weights=weights * weights * flags, minlength=n_groups)
+        )
+        for stage, flags in stages.items()
+    }
+
+
+def _conversion_estimates(sums, z=CONFIDENCE_Z):
+    """Оценки конверсий и интервалы Вильсона по взвешенным суммам"""
+    estimates = {}
+    for key, numerator, denominator in CONVERSIONS:
+        success, _ = sums[numerator]
+        trials, trials_sq = sums[denominator]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where(trials > 0, success / trials, 0.0)
+            # Эффективный размер выборки знаменателя (Киш), доля успехов сохраняется
+            n_eff = np.where(trials_sq > 0, trials * trials / trials_sq, 0.0)
+        low, high = wilson_interval(rate * n_eff, n_eff, z)
+        estimates[key] = (rate * 100, low, high)
+    return estimates
+
+
+def approximate_funnel_metrics(sample, z=CONFIDENCE_Z):
+    """
+    Приближенные метрики воронки по взвешенной выборке
+
+    Формат совпадает с calculate_funnel_metrics, дополнительно возвращаются
+    'intervals' (нижняя и верхняя граница каждой конверсии в %) и
+    'sample' (размер выборки и оценка размера совокупности).
+    """
+    sums = _weighted_stage_sums(sample)
+    estimates = _conversion_estimates(sums, z)
+    weights = sample['sample_weight'].to_numpy(dtype=float)
+
+    avg_times = {}
+    for key, start, end in STAGE_TRANSITIONS:
+        hours = ((sample[end] - sample[start]).dt.total_seconds() / 3600).to_numpy()
+        valid = ~np.isnan(hours)
+        avg_times[key] = (
+            float(np.average(hours[valid], weights=weights[valid])) if valid.any() else None
+        )
+
+    counts = {stage: int(round(total[0][0])) for stage, total in sums.items()}
+    metrics = metrics_from_counts(
+        counts['registrations'], counts['deposits'],
+        counts['first_bets'], counts['second_deposits'],
+        avg_times
+    )
+    # Конверсии считаются по неокругленным взвешенным суммам
+    metrics['conversions'] = {key: float(rate[0]) for key, (rate, _, _) in estimates.items()}
+    metrics['intervals'] = {
+        key: (float(low[0]), float(high[0])) for key, (_, low, high) in estimates.items()
+    }
+    metrics['sample'] = {
+        'size': len(sample),
+        'population': counts['registrations']
+    }
+    return metrics
+
+
+def approximate_segment_metrics(sample, segments=SEGMENT_COLUMNS, z=CONFIDENCE_Z):
+    """
+    Приближенный анализ по сегментам
+
+    Формат совпадает с analyze_by_segments (users - оценка числа пользователей),
+    для каждой конверсии добавлены столбцы *_low и *_high, а также sample_users.
+    """
+    results = {}
+
+    for segment in segments:
+        codes, values = pd.factorize(sample[segment], use_na_sentinel=True)
+        keep = codes >= 0
+        segment_sample = sample[keep]
+        codes = codes[keep]
+
+        sums = _weighted_stage_sums(segment_sample, codes, len(values))
+        estimates = _conversion_estimates(sums, z)
+
+        table = pd.DataFrame({
+            'segment_value': np.asarray(values, dtype=object),
+            'users': np.round(sums['registrations'][0]).astype(np.int64),
+        })
+        for key, column in SEGMENT_CONVERSION_COLUMNS.items():
+            rate, low, high = estimates[key]
+            table[column] = rate
+            table[f'{column}_low'] = low
+            table[f'{column}_high'] = high
+        table['sample_users'] = np.bincount(codes, minlength=len(values))
+
+        results[segment] = table
+
+    return results
@@ -0,0 +1,281 @@
+"""
+Сценарии аномалий и бенчмарк детекторов
+
+Сценарий - декларативное описание (dict или JSON) изменения данных
+в формате generate_mock_data. Все сценарии применяются векторно:
+
+    outage              - пропажа регистраций сегмента (сбой трекинга источника)
+    conversion_drop     - падение конверсии в депозит сегмента
+    registration_spike  - всплеск регистраций сегмента
+    weekly_seasonality  - недельная сезонность регистраций (не аномалия)
+    drift               - постепенное падение конверсии до strength к концу окна
+
+Общие поля: name, type, segment ({'traffic_source': 'google_ads'}, пусто -
+все пользователи), start_day (день от начала данных), days, strength, label
+(считать ли дни сценария аномалиями; сезонность не размечается никогда).
+
+Бенчмарк применяет каждый сценарий к данным нескольких размеров и считает
+полноту (recall) и точность (precision) детекторов detect_anomalies и
+detect_segment_anomalies, а также время их работы:
+
+    python scenarios.py --sizes 10000 100000
+"""
+
+import argparse
+import json
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from engines import DATE_COLUMNS, SEGMENT_COLUMNS
+from generate_mock_data import generate_mock_batch
+from segment_anomalies import OVERALL_DIMENSION
+from significance import CELL_SEPARATOR
+from utils import FunnelAnalyzer
+
+SCENARIO_TYPES = ['outage', 'conversion_drop', 'registration_spike', 'weekly_seasonality', 'drift']
+BENCHMARK_SIZES = [10_000, 50_000, 200_000]
+BENCHMARK_START = datetime(2025, 1, 1)
+BENCHMARK_END = datetime(2025, 3, 2)  # 60 дней
+
+DEFAULT_SCENARIOS = [
+    {'name': 'google_ads_outage', 'type': 'outage',
+     'segment': {'traffic_source': 'google_ads'}, 'start_day': 20, 'days': 1},
+    {'name': 'ru_conversion_drop', 'type': 'conversion_drop',
+     'segment': {'country': 'RU'}, 'start_day': 30, 'days': 2, 'strength': 0.6},
+    {'name': 'mobile_registration_spike', 'type': 'registration_spike',
+     'segment': {'device': 'mobile'}, 'start_day': 40, 'days': 1, 'strength': 1.5},
+    {'name': 'weekly_seasonality', 'type': 'weekly_seasonality',
+     'weights': [1.0, 1.0, 1.0, 1.0, 1.1, 0.8, 0.7]},
+    {'name': 'conversion_drift', 'type': 'drift',
+     'segment': {}, 'start_day': 45, 'days': 15, 'strength': 0.5},
+]
+
+_ANOMALY_DATE = re.compile(r'\((\d{4}-\d{2}-\d{2})\)$')
+
+
+def _check_scenario(scenario):
+    """Проверка описания сценария"""
+    if scenario.get('type') not in SCENARIO_TYPES:
+        raise ValueError(
+            f"Неизвестный тип сценария: {scenario.get('type')}. Доступны: {', '.join(SCENARIO_TYPES)}"
+        )
+    for column in scenario.get('segment', {}):
+        if column not in SEGMENT_COLUMNS:
+            raise ValueError(f"Сегмент {column} не поддерживается")
+
+
+def _segment_label(segment):
+    """Сегмент сценария в формате dimension / segment_value детектора сегментов"""
+    columns = [col for col in SEGMENT_COLUMNS if col in segment]
+    if not columns:
+        return OVERALL_DIMENSION, OVERALL_DIMENSION
+    return (CELL_SEPARATOR.join(columns),
+            CELL_SEPARATOR.join(str(segment[col]) for col in columns))
+
+
+def _drop_conversions(df, lost):
+    """Потеря депозита (и всех следующих этапов) для строк маски"""
+    for col in DATE_COLUMNS[1:]:
+        df[col] = df[col].mask(lost)
+    return df
+
+
+def apply_scenarios(df, scenarios, seed=0):
+    """
+    Применение сценариев к данным в формате generate_mock_data
+
+    Parameters:
+    -----------
+    df : pd.DataFrame
+        Исходные данные с типизированными датами
+    scenarios : list
+        Описания сценариев (dict)
+    seed : int
+        Seed случайных решений сценариев
+
+    Returns:
+    --------
+    tuple
+        (измененные данные, разметка: name, type, dimension, segment_value, date -
+        дни и сегменты, которые детектор должен найти)
+    """
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    first_day = df['registration_time'].min().normalize()
+    labels = []
+
+    for scenario in scenarios:
+        _check_scenario(scenario)
+        kind = scenario['type']
+        segment = scenario.get('segment', {})
+        strength = scenario.get('strength', 1.0)
+
+        reg_day = ((df['registration_time'] - first_day) // pd.Timedelta(days=1)).to_numpy()
+        in_segment = np.ones(len(df), dtype=bool)
+        for column, value in segment.items():
+            in_segment &= (df[column] == value).to_numpy()
+
+        if kind == 'weekly_seasonality':
+            weights = np.asarray(scenario['weights'], dtype=float)
+            keep_prob = (weights / weights.max())[df['registration_time'].dt.weekday.to_numpy()]
+            df = df[rng.random(len(df)) < keep_prob].reset_index(drop=True)
+            # Сезонность - нормальное поведение: детекции в эти дни снижают точность
+            continue
+
+        start_day = scenario['start_day']
+        days = scenario.get('days', 1)
+        in_window = in_segment & (reg_day >= start_day) & (reg_day < start_day + days)
+
+        if kind == 'outage':
+            df = df[~(in_window & (rng.random(len(df)) < strength))].reset_index(drop=True)
+        elif kind == 'conversion_drop':
+            df = _drop_conversions(df, in_window & (rng.random(len(df)) < strength))
+        elif kind == 'drift':
+            # Доля потерянных депозитов растет линейно от 0 до strength
+            progress = np.clip((reg_day - start_day + 1) / days, 0, 1)
+            df = _drop_conversions(df, in_window & (rng.random(len(df)) < strength * progress))
+        elif kind == 'registration_spike':
+            # Дополнительные пользователи - копии случайных пользователей сегмента в окне
+            source = np.flatnonzero(in_window)
+            picked = rng.choice(source, size=int(len(source) * strength)) if len(source) else source
+            extra = df.iloc[picked].copy()
+            extra['user_id'] = np.arange(len(extra)) + int(df['user_id'].max()) + 1
+            df = pd.concat([df, extra], ignore_index=True)
+
+        if scenario.get('label', True):
+            dimension, segment_value = _segment_label(segment)
+            for offset in range(days):
+                labels.append({
+                    'name': scenario.get('name', kind),
+                    'type': kind,
+                    'dimension': dimension,
+                    'segment_value': segment_value,
+                    'date': (first_day + pd.Timedelta(days=start_day + offset)).date()
+                })
+
+    labels = pd.DataFrame(labels, columns=['name', 'type', 'dimension', 'segment_value', 'date'])
+    return df, labels
+
+
+def _cells(dimension, segment_value):
+    """Ячейка сегмента как dict {сегмент: значение}"""
+    if dimension == OVERALL_DIMENSION:
+        return {}
+    return dict(zip(dimension.split(CELL_SEPARATOR), segment_value.split(CELL_SEPARATOR)))
+
+
+def _consistent(label_cell, detected_cell):
+    """Обнаруженная ячейка не противоречит сегменту сценария (общий ряд подходит всегда)"""
+    return all(detected_cell.get(column, value) == value for column, value in label_cell.items())
+
+
+def score_detections(labels, detections):
+    """
+    Полнота и точность детекций относительно разметки
+
+    Parameters:
+    -----------
+    labels : pd.DataFrame
+        Разметка apply_scenarios
+    detections : pd.DataFrame
+        dimension, segment_value, date (для дневного детектора - общий ряд)
+
+    Returns:
+    --------
+    dict
+        recall, precision (NaN, если нечего считать), detections
+    """
+    detections = detections.drop_duplicates(['dimension', 'segment_value', 'date'])
+    label_cells = [(row.date, _cells(row.dimension, row.segment_value)) for row in labels.itertuples()]
+    detected_cells = [(row.date, _cells(row.dimension, row.segment_value)) for row in detections.itertuples()]
+
+    def matches(label, detection):
+        return label[0] == detection[0] and _consistent(label[1], detection[1])
+
+    found = sum(any(matches(label, det) for det in detected_cells) for label in label_cells)
+    correct = sum(any(matches(label, det) for label in label_cells) for det in detected_cells)
+    return {
+        'recall': found / len(label_cells) if label_cells else np.nan,
+        'precision': correct / len(detected_cells) if detected_cells else np.nan,
+        'detections': len(detected_cells),
+    }
+
+
+def _daily_detections(anomalies):
+    """Даты из сообщений detect_anomalies как детекции общего ряда"""
+    dates = [
+        pd.Timestamp(match.group(1)).date()
+        for match in (_ANOMALY_DATE.search(message) for message in anomalies) if match
+    ]
+    return pd.DataFrame({
+        'dimension': OVERALL_DIMENSION,
+        'segment_value': OVERALL_DIMENSION,
+        'date': dates
+    }, columns=['dimension', 'segment_value', 'date'])
+
+
+def run_benchmark(sizes=BENCHMARK_SIZES, scenarios=DEFAULT_SCENARIOS, seed=42,
+                  threshold=0.5, z_threshold=3.0, engine='pandas'):
+    """
+    Полнота, точность и время детекторов для каждого сценария и размера данных
+
+    Returns:
+    --------
+    pd.DataFrame
+        size, scenario, detector, recall, precision, detections, runtime_s
+    """
+    rows = []
+    for size in sizes:
+        base = generate_mock_batch(np.random.default_rng(seed), size, 1, BENCHMARK_START, BENCHMARK_END)
+
+        for scenario in scenarios:
+            df, labels = apply_scenarios(base, [scenario], seed)
+            analyzer = FunnelAnalyzer(df, engine=engine)
+
+            started = time.perf_counter()
+            daily = _daily_detections(analyzer.detect_anomalies(threshold))
+            daily_runtime = time.perf_counter() - started
+
+            started = time.perf_counter()
+            segments = analyzer.detect_segment_anomalies(z_threshold=z_threshold)
+            segment_runtime = time.perf_counter() - started
+
+            for detector, detections, runtime in [
+                ('detect_anomalies', daily, daily_runtime),
+                ('detect_segment_anomalies', segments, segment_runtime),
+            ]:
+                rows.append({
+                    'size': size,
+                    'scenario': scenario.get('name', scenario['type']),
+                    'detector': detector,
+                    **score_detections(labels, detections),
+                    'runtime_s': runtime,
+                })
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк детекторов аномалий на сценариях')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCHMARK_SIZES)
+    parser.add_argument('--scenarios', help='JSON файл со списком сценариев')
+    parser.add_argument('--engine', default='pandas')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    scenarios = DEFAULT_SCENARIOS
+    if args.scenarios:
+        with open(args.scenarios, encoding='utf-8') as f:
+            scenarios = json.load(f)
+
+    results = run_benchmark(args.sizes, scenarios, args.seed, engine=args.engine)
+    with pd.option_context('display.width', 160, 'display.max_rows', None):
+        print(results.to_string(index=False, float_format=lambda value: f'{value:.3f}'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""
+Детекция аномалий по всем сегментам одновременно
+
+Для каждого ряда "сегмент × день" (все данные, отдельные сегменты и пары
+сегментов: country, traffic_source × device и т.д.) строятся матрицы
+регистраций и депозитов размером (ряды × дни). Базовый уровень - EWMA по
+предыдущим дням, отклонение оценивается z-статистикой:
+
+    конверсия в депозит: биномиальная z по ожидаемой EWMA-конверсии ряда
+    регистрации: z по EWMA среднего и дисперсии регистраций ряда
+
+Дни, где регистраций меньше MIN_REGISTRATIONS (а для объема - и фактически,
+и по ожиданию), не оцениваются: единичная регистрация в редкой ячейке
+(например, KZ × tablet при ожидании ~0.04) иначе дает |z| > 3.
+
+Цикл идет только по дням, все ряды обрабатываются одной векторной операцией,
+поэтому проход по ~5000 рядов занимает доли секунды. Аномалии ранжируются
+по влиянию: сколько депозитов (регистраций) потеряно или получено сверх ожидания.
+"""
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS
+from significance import CELL_SEPARATOR
+
+EWMA_SPAN = 7  # Период сглаживания базового уровня (дни)
+MIN_HISTORY = 7  # Минимум дней истории до начала детекции
+Z_THRESHOLD = 3.0  # Порог |z| для аномалии
+MIN_REGISTRATIONS = 20  # Минимум регистраций в день для оценки конверсии и объема
+OVERALL_DIMENSION = 'all'
+
+
+def build_series_matrices(daily_strata, segments=SEGMENT_COLUMNS, max_order=2):
+    """
+    Матрицы (ряды × дни) регистраций и депозитов для всех комбинаций сегментов
+
+    Parameters:
+    -----------
+    daily_strata : pd.DataFrame
+        Результат engine.daily_strata_counts
+    segments : list
+        Поля сегментов
+    max_order : int
+        Максимальное число сегментов в ряду (0 - только общий ряд)
+
+    Returns:
+    --------
+    dict
+        dates, dimension, segment_value, registrations, deposits
+    """
+    dates = pd.DatetimeIndex(daily_strata['date']).normalize()
+    if len(dates) == 0:
+        return {
+            'dates': pd.DatetimeIndex([]),
+            'dimension': np.array([], dtype=object),
+            'segment_value': np.array([], dtype=object),
+            'registrations': np.zeros((0, 0)),
+            'deposits': np.zeros((0, 0)),
+        }
+
+    start = dates.min()
+    day_index = ((dates - start) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+    n_days = int(day_index.max()) + 1
+    registrations = daily_strata['registrations'].to_numpy(dtype=float)
+    deposits = daily_strata['deposits'].to_numpy(dtype=float)
+
+    # Коды значений каждого сегмента (-1 - пустое значение)
+    codes = {}
+    for segment in segments:
+        segment_codes, uniques = pd.factorize(daily_strata[segment])
+        codes[segment] = (segment_codes, np.asarray(uniques, dtype=object).astype(str))
+
+    dimension_parts, value_parts, registration_parts, deposit_parts = [], [], [], []
+
+    for order in range(0, max_order + 1):
+        for combo in combinations(segments, order):
+            key = np.zeros(len(daily_strata), dtype=np.int64)
+            valid = np.ones(len(daily_strata), dtype=bool)
+            shape = []
+            for segment in combo:
+                segment_codes, uniques = codes[segment]
+                key = key * len(uniques) + segment_codes
+                valid &= segment_codes >= 0
+                shape.append(len(uniques))
+            n_series = int(np.prod(shape)) if shape else 1
+
+            # Плотные матрицы одной операцией bincount по индексу ряд * дни + день
+            flat = key[valid] * n_days + day_index[valid]
+            size = n_series * n_days
+            reg_matrix = np.bincount(flat, weights=registrations[valid], minlength=size).reshape(n_series, n_days)
+            dep_matrix = np.bincount(flat, weights=deposits[valid], minlength=size).reshape(n_series, n_days)
+
+            present = np.flatnonzero(reg_matrix.sum(axis=1) > 0)
+            if combo:
+                value_codes = np.unravel_index(present, shape)
+                labels = pd.Series(codes[combo[0]][1][value_codes[0]])
+                for segment, segment_codes in zip(combo[1:], value_codes[1:]):
+                    labels = labels + CELL_SEPARATOR + codes[segment][1][segment_codes]
+                labels = labels.to_numpy(dtype=object)
+            else:
+                labels = np.array([OVERALL_DIMENSION], dtype=object)
+
+            dimension_parts.append(np.full(len(present), CELL_SEPARATOR.join(combo) or OVERALL_DIMENSION, dtype=object))
+            value_parts.append(labels)
+            registration_parts.append(reg_matrix[present])
+            deposit_parts.append(dep_matrix[present])
+
+    return {
+        'dates': pd.date_range(start, periods=n_days, freq='D'),
+        'dimension': np.concatenate(dimension_parts),
+        'segment_value': np.concatenate(value_parts),
+        'registrations': np.vstack(registration_parts),
+        'deposits': np.vstack(deposit_parts),
+    }
+
+
+def score_series(registrations, deposits, span=EWMA_SPAN, min_history=MIN_HISTORY,
+                 min_registrations=MIN_REGISTRATIONS):
+    """
+    z-оценки и ожидаемые значения для матриц (ряды × дни)
+
+    Базовый уровень дня d строится только по дням до d. Конверсия ряда -
+    отношение EWMA депозитов к EWMA регистраций, поэтому дни с малым
+    объемом влияют на базу пропорционально своему весу. Объем регистраций
+    оценивается, если фактический или ожидаемый объем не меньше min_registrations.
+
+    Returns:
+    --------
+    dict
+        expected_rate, conversion_z, expected_registrations, registrations_z
+        (матрицы той же формы, NaN - оценка невозможна)
+    """
+    n_series, n_days = registrations.shape
+    alpha = 2.0 / (span + 1)
+
+    expected_rate = np.full((n_series, n_days), np.nan)
+    expected_registrations = np.full((n_series, n_days), np.nan)
+    registrations_std = np.full((n_series, n_days), np.nan)
+
+    ewma_registrations = np.zeros(n_series)
+    ewma_deposits = np.zeros(n_series)
+    mean_registrations = np.zeros(n_series)
+    var_registrations = np.zeros(n_series)
+
+    for day in range(n_days):
+        if day >= min_history:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                expected_rate[:, day] = np.where(
+                    ewma_registrations > 0, ewma_deposits / ewma_registrations, np.nan
+                )
+            expected_registrations[:, day] = mean_registrations
+            # Пуассоновская добавка защищает ряды с почти постоянным объемом
+            registrations_std[:, day] = np.sqrt(var_registrations + mean_registrations)
+
+        reg_today = registrations[:, day]
+        if day == 0:
+            ewma_registrations = reg_today.copy()
+            ewma_deposits = deposits[:, day].copy()
+            mean_registrations = reg_today.copy()
+            continue
+
+        ewma_registrations = alpha * reg_today + (1 - alpha) * ewma_registrations
+        ewma_deposits = alpha * deposits[:, day] + (1 - alpha) * ewma_deposits
+        delta = reg_today - mean_registrations
+        mean_registrations = mean_registrations + alpha * delta
+        var_registrations = (1 - alpha) * (var_registrations + alpha * delta * delta)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = np.clip(expected_rate, 1e-3, 1 - 1e-3)
+        conversion_z = (deposits - registrations * p) / np.sqrt(registrations * p * (1 - p))
+        conversion_z[(registrations < min_registrations) | np.isnan(expected_rate)] = np.nan
+        registrations_z = (registrations - expected_registrations) / registrations_std
+        registrations_z[~(registrations_std > 0)] = np.nan
+        # Единичные регистрации в редких ячейках (ожидается ~0) - не аномалия объема
+        registrations_z[
+            (registrations < min_registrations) & ~(expected_registrations >= min_registrations)
+        ] = np.nan
+
+    return {
+        'expected_rate': expected_rate,
+        'conversion_z': conversion_z,
+        'expected_registrations': expected_registrations,
+        'registrations_z': registrations_z,
+    }
+
+
+def find_segment_anomalies(daily_strata, segments=SEGMENT_COLUMNS, max_order=2,
+                           z_threshold=Z_THRESHOLD, span=EWMA_SPAN, min_history=MIN_HISTORY,
+                           min_registrations=MIN_REGISTRATIONS):
+    """
+    Аномалии по всем рядам сегмент × день, отсортированные по влиянию
+
+    Returns:
+    --------
+    pd.DataFrame
+        dimension, segment_value, date, metric ('deposit_conversion' или
+        'registrations'), registrations, actual, expected, z_score, impact
+        (депозиты или регистрации сверх ожидания; отрицательное - потери)
+    """
+    series = build_series_matrices(daily_strata, segments, max_order)
+    registrations = series['registrations']
+    deposits = series['deposits']
+    scores = score_series(registrations, deposits, span, min_history, min_registrations)
+
+    frames = []
+
+    # Конверсия в депозит: влияние - депозиты относительно ожидаемой конверсии
+    rows, days = np.nonzero(np.abs(np.nan_to_num(scores['conversion_z'])) > z_threshold)
+    if len(rows):
+        expected_rate = scores['expected_rate'][rows, days]
+        day_registrations = registrations[rows, days]
+        frames.append(pd.DataFrame({
+            'dimension': series['dimension'][rows],
+            'segment_value': series['segment_value'][rows],
+            'date': series['dates'][days].date,
+            'metric': 'deposit_conversion',
+            'registrations': day_registrations.astype(np.int64),
+            'actual': deposits[rows, days] / day_registrations * 100,
+            'expected': expected_rate * 100,
+            'z_score': scores['conversion_z'][rows, days],
+            'impact': deposits[rows, days] - day_registrations * expected_rate,
+        }))
+
+    # Объем регистраций
+    rows, days = np.nonzero(np.abs(np.nan_to_num(scores['registrations_z'])) > z_threshold)
+    if len(rows):
+        frames.append(pd.DataFrame({
+            'dimension': series['dimension'][rows],
+            'segment_value': series['segment_value'][rows],
+            'date': series['dates'][days].date,
+            'metric': 'registrations',
+            'registrations': registrations[rows, days].astype(np.int64),
+            'actual': registrations[rows, days],
+            'expected': scores['expected_registrations'][rows, days],
+            'z_score': scores['registrations_z'][rows, days],
+            'impact': registrations[rows, days] - scores['expected_registrations'][rows, days],
+        }))
+
+    columns = ['dimension', 'segment_value', 'date', 'metric', 'registrations',
+               'actual', 'expected', 'z_score', 'impact']
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    anomalies = pd.concat(frames, ignore_index=True)
+    order = np.argsort(-np.abs(anomalies['impact'].to_numpy()), kind='stable')
+    return anomalies.iloc[order].reset_index(drop=True)[columns]
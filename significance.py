@@ -0,0 +1,212 @@
+"""
+Статистическая значимость конверсий по всем ячейкам сегментов
+
+Ячейка - значение одного сегмента (country = RU) или комбинация значений
+двух сегментов (traffic_source × country). Все ячейки собираются из одной
+таблицы счетчиков по комбинациям сегментов (engine.strata_counts), после
+чего интервалы Вильсона, z-тест против общей конверсии и поправка
+Бенджамини-Хохберга считаются одной векторной операцией над матрицей
+ячейки × конверсии. Это дешево даже для десятков тысяч ячеек.
+
+Перекрестная таблица двух сегментов (segment_crosstab) строится так же:
+одна группировка таблицы страт по паре сегментов. Хранятся только непустые
+комбинации; в матрице для тепловой карты (crosstab_matrix) пустые - NaN.
+"""
+
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from engines import (SEGMENT_COLUMNS, STAGE_COUNTS, CONVERSIONS, SEGMENT_CONVERSION_COLUMNS,
+                     wilson_interval)
+
+CONFIDENCE_Z = 1.96  # 95% доверительный интервал
+SIGNIFICANCE_LEVEL = 0.05  # Порог q-value (доля ложных открытий)
+CELL_SEPARATOR = ' × '
+
+
+def normal_two_sided_p_value(z):
+    """
+    Двусторонний p-value нормального распределения, векторизованно
+
+    erfc(|z| / sqrt(2)) по аппроксимации Абрамовица-Стиган 7.1.26
+    (абсолютная погрешность < 1.5e-7), без зависимости от scipy.
+    """
+    x = np.abs(np.asarray(z, dtype=float)) / np.sqrt(2)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return np.clip(poly * np.exp(-x * x), 0.0, 1.0)
+
+
+def benjamini_hochberg(p_values):
+    """q-values Бенджамини-Хохберга для массива p-values любой формы (NaN пропускаются)"""
+    p_values = np.asarray(p_values, dtype=float)
+    flat = p_values.ravel()
+    valid = np.flatnonzero(~np.isnan(flat))
+    q_values = np.full(flat.shape, np.nan)
+
+    if len(valid):
+        order = np.argsort(flat[valid])
+        ranked = flat[valid][order] * len(valid) / np.arange(1, len(valid) + 1)
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        q_values[valid[order]] = np.minimum(ranked, 1.0)
+
+    return q_values.reshape(p_values.shape)
+
+
+def segment_cells(strata, segments=SEGMENT_COLUMNS, max_order=2):
+    """
+    Счетчики этапов для всех ячеек сегментов порядка 1..max_order
+
+    Parameters:
+    -----------
+    strata : pd.DataFrame
+        Результат engine.strata_counts (сегменты + счетчики этапов)
+    segments : list
+        Поля сегментов
+    max_order : int
+        Максимальное число сегментов в комбинации
+
+    Returns:
+    --------
+    pd.DataFrame
+        dimension, segment_value, order + счетчики этапов
+    """
+    frames = []
+    for order in range(1, max_order + 1):
+        for combo in combinations(segments, order):
+            combo = list(combo)
+            cells = (
+                strata.dropna(subset=combo)
+                      .groupby(combo, sort=True, observed=True)[STAGE_COUNTS]
+                      .sum()
+                      .reset_index()
+            )
+            label = cells[combo[0]].astype(str)
+            for column in combo[1:]:
+                label = label + CELL_SEPARATOR + cells[column].astype(str)
+
+            frame = pd.DataFrame({
+                'dimension': CELL_SEPARATOR.join(combo),
+                'segment_value': label.to_numpy(dtype=object),
+                'order': order,
+            })
+            for stage in STAGE_COUNTS:
+                frame[stage] = cells[stage].to_numpy(dtype=np.int64)
+            frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=['dimension', 'segment_value', 'order'] + STAGE_COUNTS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def score_cells(cells, overall, z=CONFIDENCE_Z, alpha=SIGNIFICANCE_LEVEL):
+    """
+    Интервалы и тесты для всех ячеек и всех конверсий одной векторной операцией
+
+    Parameters:
+    -----------
+    cells : pd.DataFrame
+        Ячейки со счетчиками этапов (segment_cells)
+    overall : dict
+        Общие счетчики этапов, с которыми сравнивается каждая ячейка
+
+    Returns:
+    --------
+    pd.DataFrame
+        Для каждой конверсии (например, reg_to_deposit_conv): значение в %,
+        границы интервала *_low / *_high, z-статистика *_z, *_p_value,
+        *_q_value (поправка на множественные сравнения) и флаг *_significant
+    """
+    numerators = cells[[numerator for _, numerator, _ in CONVERSIONS]].to_numpy(dtype=float)
+    denominators = cells[[denominator for _, _, denominator in CONVERSIONS]].to_numpy(dtype=float)
+    overall_num = np.array([overall[numerator] for _, numerator, _ in CONVERSIONS], dtype=float)
+    overall_den = np.array([overall[denominator] for _, _, denominator in CONVERSIONS], dtype=float)
+
+    # Матрицы ячейки × конверсии
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(denominators > 0, numerators / denominators, np.nan)
+        baseline = np.where(overall_den > 0, overall_num / overall_den, np.nan)
+        std_error = np.sqrt(baseline * (1 - baseline) / denominators)
+        z_stats = np.where((denominators > 0) & (std_error > 0), (rates - baseline) / std_error, np.nan)
+    low, high = wilson_interval(numerators, denominators, z)
+    p_values = np.where(np.isnan(z_stats), np.nan, normal_two_sided_p_value(z_stats))
+    q_values = benjamini_hochberg(p_values)
+
+    result = cells[['dimension', 'segment_value', 'order']].copy()
+    result['users'] = cells['registrations'].to_numpy()
+    for i, (key, _, _) in enumerate(CONVERSIONS):
+        column = SEGMENT_CONVERSION_COLUMNS[key]
+        result[column] = np.nan_to_num(rates[:, i]) * 100
+        result[f'{column}_low'] = low[:, i]
+        result[f'{column}_high'] = high[:, i]
+        result[f'{column}_z'] = z_stats[:, i]
+        result[f'{column}_p_value'] = p_values[:, i]
+        result[f'{column}_q_value'] = q_values[:, i]
+        result[f'{column}_significant'] = q_values[:, i] < alpha
+
+    return result
+
+
+def segment_significance(strata, segments=SEGMENT_COLUMNS, max_order=2,
+                         z=CONFIDENCE_Z, alpha=SIGNIFICANCE_LEVEL):
+    """Значимость конверсий всех ячеек сегментов относительно общей конверсии выборки"""
+    overall = {stage: strata[stage].sum() for stage in STAGE_COUNTS}
+    cells = segment_cells(strata, segments, max_order)
+    return score_cells(cells, overall, z, alpha)
+
+
+def segment_crosstab(strata, rows, columns, z=CONFIDENCE_Z, alpha=SIGNIFICANCE_LEVEL):
+    """
+    Перекрестный анализ двух сегментов: счетчики, конверсии и значимость по ячейкам
+
+    Parameters:
+    -----------
+    strata : pd.DataFrame
+        Результат engine.strata_counts
+    rows, columns : str
+        Два разных поля сегментов
+
+    Returns:
+    --------
+    pd.DataFrame
+        row_value, column_value + счетчики этапов + столбцы score_cells
+        (конверсии, интервалы, z, p, q и флаг значимости относительно общей
+        конверсии). Только непустые комбинации, по возрастанию значений
+    """
+    if rows == columns:
+        raise ValueError("Для перекрестного анализа нужны два разных сегмента")
+    for segment in (rows, columns):
+        if segment not in strata.columns:
+            raise ValueError(f"Неизвестный сегмент: {segment}")
+
+    overall = {stage: strata[stage].sum() for stage in STAGE_COUNTS}
+    counts = (
+        strata.dropna(subset=[rows, columns])
+              .groupby([rows, columns], sort=True, observed=True)[STAGE_COUNTS]
+              .sum()
+              .reset_index()
+    )
+    cells = pd.DataFrame({
+        'dimension': f'{rows}{CELL_SEPARATOR}{columns}',
+        'segment_value': (counts[rows].astype(str) + CELL_SEPARATOR + counts[columns].astype(str)).to_numpy(dtype=object),
+        'order': 2,
+    })
+    for stage in STAGE_COUNTS:
+        cells[stage] = counts[stage].to_numpy(dtype=np.int64)
+    scores = score_cells(cells, overall, z, alpha)
+
+    result = pd.DataFrame({
+        'row_value': counts[rows].to_numpy(dtype=object),
+        'column_value': counts[columns].to_numpy(dtype=object)
+    })
+    for stage in STAGE_COUNTS:
+        result[stage] = cells[stage].to_numpy()
+    score_columns = [col for col in scores.columns if col not in ('dimension', 'segment_value', 'order', 'users')]
+    return pd.concat([result, scores[score_columns]], axis=1)
+
+
+def crosstab_matrix(crosstab, value='reg_to_deposit_conv'):
+    """Матрица значения для тепловой карты: строки × столбцы, пустые комбинации - NaN"""
+    return crosstab.pivot(index='row_value', columns='column_value', values=value)
@@ -0,0 +1,313 @@
+"""
+SQL-бэкенд для FunnelAnalyzer поверх локальной встраиваемой БД (SQLite или DuckDB)
+
+Все агрегаты (счетчики этапов, конверсии, среднее время, сегменты, дневные
+метрики и когорты) считаются запросами внутри базы. В pandas возвращаются
+только небольшие итоговые таблицы той же структуры, что и у FunnelAnalyzer,
+поэтому app.py и PDF отчет работают без изменений.
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from engines import (DATE_COLUMNS, DATE_RANGE_FILTER, SEGMENT_COLUMNS, STAGE_TRANSITIONS, _safe_rate,
+                     metrics_from_counts, segment_table, daily_table,
+                     cohorts_from_month_counts, find_daily_anomalies)
+from date_parsing import detect_datetime_format, parse_datetime
+from utils import FunnelAnalyzer
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Выражения, зависящие от диалекта. Некорректные даты превращаются в NULL,
+# как errors='coerce' в pandas
+DIALECTS = {
+    'sqlite': {
+        'valid': "julianday({col})",
+        'hours': "(julianday({end}) - julianday({start})) * 24.0",
+        'day': "date({col})",
+        'month': "strftime('%Y-%m', {col})",
+        'date_param': "?",
+    },
+    'duckdb': {
+        'valid': "TRY_CAST({col} AS TIMESTAMP)",
+        'hours': ("date_diff('second', TRY_CAST({start} AS TIMESTAMP), "
+                  "TRY_CAST({end} AS TIMESTAMP)) / 3600.0"),
+        'day': "CAST(TRY_CAST({col} AS TIMESTAMP) AS DATE)",
+        'month': "strftime(TRY_CAST({col} AS TIMESTAMP), '%Y-%m')",
+        'date_param': "CAST(? AS DATE)",
+    },
+}
+
+
+def connect_database(database):
+    """Подключение к файлу БД: *.duckdb через DuckDB, остальное через SQLite"""
+    if str(database).endswith('.duckdb'):
+        if duckdb is None:
+            raise ImportError("Для файлов .duckdb установите пакет duckdb: pip install duckdb")
+        return duckdb.connect(str(database), read_only=True), 'duckdb'
+
+    # check_same_thread=False: Streamlit выполняет скрипт в разных потоках
+    return sqlite3.connect(str(database), check_same_thread=False), 'sqlite'
+
+
+def load_csv_to_database(csv_path, database, table='users', chunksize=500_000):
+    """
+    Загрузка CSV в локальную БД по частям (без чтения файла целиком в память)
+
+    Parameters:
+    -----------
+    csv_path : str
+        Путь к CSV файлу
+    database : str
+        Путь к файлу БД (*.duckdb - DuckDB, иначе SQLite)
+    table : str
+        Имя таблицы
+    chunksize : int
+        Количество строк в одной порции для SQLite
+    """
+    if str(database).endswith('.duckdb'):
+        if duckdb is None:
+            raise ImportError("Для файлов .duckdb установите пакет duckdb: pip install duckdb")
+        con = duckdb.connect(str(database))
+        try:
+            con.execute(
+                f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_csv_auto(?)",
+                [os.fspath(csv_path)]
+            )
+        finally:
+            con.close()
+        return
+
+    con = sqlite3.connect(str(database))
+    try:
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+        formats = {}
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            # Даты хранятся в ISO формате, понятном julianday();
+            # формат исходных дат определяется по первому чанку
+            for col in DATE_COLUMNS:
+                if col in chunk.columns:
+                    if formats.get(col) is None:
+                        formats[col] = detect_datetime_format(chunk[col])
+                    chunk[col] = parse_datetime(chunk[col], formats[col]).dt.strftime('%Y-%m-%d %H:%M:%S')
+            chunk.to_sql(table, con, if_exists='append', index=False)
+
+        # Индексы для фильтров по сегментам и дате регистрации
+        for col in SEGMENT_COLUMNS + ['registration_time']:
+            con.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{col} ON {table} ({col})")
+        con.commit()
+    finally:
+        con.close()
+
+
+class SQLFunnelAnalyzer(FunnelAnalyzer):
+    """Анализ воронки агрегирующими SQL запросами во встраиваемой БД"""
+
+    def __init__(self, database, table='users'):
+        self.database = database
+        self.table = table
+        self.connection, self.dialect = connect_database(database)
+        self.sql = DIALECTS[self.dialect]
+        # Сырые данные в pandas не загружаются
+        self.df = None
+        self._reset_caches()
+
+    def close(self):
+        """Закрытие соединения с БД"""
+        self.connection.close()
+
+    def _query(self, sql, params=()):
+        """Выполнение запроса и возврат небольшого результата как DataFrame"""
+        cursor = self.connection.execute(sql, list(params))
+        columns = [d[0] for d in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+    def _where(self, filters):
+        """
+        WHERE для фильтров вида {'country': ['RU', 'UA'], 'registration_date': (начало, конец)}
+
+        Имена столбцов проверяются по списку сегментов, значения передаются параметрами.
+        Диапазон дат регистрации включает оба дня, как и у FunnelAnalyzer; строки
+        без даты регистрации в него не входят.
+        """
+        if not filters:
+            return "", []
+
+        clauses = []
+        params = []
+        for column, values in filters.items():
+            if column == DATE_RANGE_FILTER:
+                clause, range_params = self._date_range_clause(*values)
+                clauses.append(clause)
+                params.extend(range_params)
+                continue
+            if column not in SEGMENT_COLUMNS:
+                raise ValueError(f"Фильтр по полю {column} не поддерживается")
+            values = list(values)
+            if not values:
+                clauses.append("1 = 0")
+                continue
+            clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+
+        return "WHERE " + " AND ".join(clauses), params
+
+    def _date_range_clause(self, start=None, end=None):
+        """Условие на день регистрации: BETWEEN для двух границ, сравнение для одной"""
+        day = self.sql['day'].format(col='registration_time')
+        param = self.sql['date_param']
+        bounds = [None if value is None else pd.Timestamp(value).strftime('%Y-%m-%d') for value in (start, end)]
+
+        if start is not None and end is not None:
+            return f"{day} BETWEEN {param} AND {param}", bounds
+        if start is not None:
+            return f"{day} >= {param}", bounds[:1]
+        if end is not None:
+            return f"{day} <= {param}", bounds[1:]
+        return f"{day} IS NOT NULL", []
+
+    def _stage_counts_sql(self):
+        """Общая часть SELECT: количество пользователей на каждом этапе"""
+        valid = self.sql['valid']
+        return (
+            "COUNT(*) AS registrations, "
+            f"COUNT({valid.format(col='deposit_time')}) AS deposits, "
+            f"COUNT({valid.format(col='first_bet_time')}) AS first_bets, "
+            f"COUNT({valid.format(col='second_deposit_time')}) AS second_deposits"
+        )
+
+    def prepare_data(self):
+        """Подготовка не требуется: типы и флаги вычисляются в запросах"""
+
+    def calculate_funnel_metrics(self, filters=None, approximate=False):
+        """Расчет основных метрик воронки (запрос в БД точный, approximate не требуется)"""
+        where, params = self._where(filters)
+        hours = self.sql['hours']
+
+        row = self._query(
+            f"SELECT {self._stage_counts_sql()}, "
+            f"AVG({hours.format(start='registration_time', end='deposit_time')}) AS reg_to_deposit, "
+            f"AVG({hours.format(start='deposit_time', end='first_bet_time')}) AS deposit_to_bet, "
+            f"AVG({hours.format(start='first_bet_time', end='second_deposit_time')}) AS bet_to_second_deposit "
+            f"FROM {self.table} {where}",
+            params
+        ).iloc[0]
+
+        # AVG по пустому набору возвращает NULL, в pandas это NaN
+        return metrics_from_counts(
+            int(row['registrations']),
+            int(row['deposits']),
+            int(row['first_bets']),
+            int(row['second_deposits']),
+            {key: None if pd.isna(row[key]) else float(row[key]) for key, _, _ in STAGE_TRANSITIONS}
+        )
+
+    def analyze_by_segments(self, filters=None, approximate=False):
+        """Анализ по сегментам: один GROUP BY на каждое измерение (approximate не требуется)"""
+        where, params = self._where(filters)
+        results = {}
+
+        for segment in SEGMENT_COLUMNS:
+            condition = f"{segment} IS NOT NULL"
+            segment_where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+
+            counts = self._query(
+                f"SELECT {segment} AS segment_value, {self._stage_counts_sql()} "
+                f"FROM {self.table} {segment_where} "
+                f"GROUP BY {segment} ORDER BY {segment}",
+                params
+            )
+
+            results[segment] = segment_table(
+                counts['segment_value'],
+                counts['registrations'],
+                counts['deposits'],
+                counts['first_bets'],
+                counts['second_deposits']
+            )
+
+        return results
+
+    def calculate_strata_counts(self, filters=None):
+        """Счетчики этапов по комбинациям всех сегментов: один GROUP BY"""
+        where, params = self._where(filters)
+        segments = ', '.join(SEGMENT_COLUMNS)
+
+        return self._query(
+            f"SELECT {segments}, {self._stage_counts_sql()} "
+            f"FROM {self.table} {where} GROUP BY {segments}",
+            params
+        )
+
+    def calculate_daily_strata_counts(self, filters=None):
+        """Счетчики этапов по дням и комбинациям всех сегментов: один GROUP BY"""
+        where, params = self._where(filters)
+        day = self.sql['day'].format(col='registration_time')
+        segments = ', '.join(SEGMENT_COLUMNS)
+        condition = f"{day} IS NOT NULL"
+        day_where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+
+        counts = self._query(
+            f"SELECT {day} AS date, {segments}, {self._stage_counts_sql()} "
+            f"FROM {self.table} {day_where} GROUP BY {day}, {segments}",
+            params
+        )
+        counts['date'] = pd.to_datetime(counts['date'])
+        return counts
+
+    def _daily_counts(self, filters=None):
+        """Количество регистраций и депозитов по дням регистрации"""
+        where, params = self._where(filters)
+        day = self.sql['day'].format(col='registration_time')
+        condition = f"{day} IS NOT NULL"
+        day_where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+
+        daily = self._query(
+            f"SELECT {day} AS date, {self._stage_counts_sql()} "
+            f"FROM {self.table} {day_where} GROUP BY 1 ORDER BY 1",
+            params
+        )
+        daily['date'] = pd.to_datetime(daily['date']).dt.date
+        return daily
+
+    def calculate_daily_metrics(self, filters=None):
+        """Расчет ежедневных метрик"""
+        daily = self._daily_counts(filters)
+
+        return daily_table(
+            daily['date'],
+            daily['registrations'],
+            daily['deposits'],
+            daily['second_deposits']
+        )
+
+    def detect_anomalies(self, threshold=0.5, filters=None):
+        """Детекция аномалий по дневным агрегатам из БД"""
+        daily = self._daily_counts(filters)
+        daily['conv_rate'] = _safe_rate(daily['deposits'], daily['registrations'])
+        return find_daily_anomalies(daily, threshold)
+
+    def calculate_cohort_analysis(self, filters=None):
+        """Когортный анализ: в pandas возвращается только матрица месяц регистрации × месяц депозита"""
+        where, params = self._where(filters)
+        reg_month = self.sql['month'].format(col='registration_time')
+        deposit_month = self.sql['month'].format(col='deposit_time')
+        condition = f"{reg_month} IS NOT NULL"
+        month_where = f"{where} AND {condition}" if where else f"WHERE {condition}"
+
+        pairs = self._query(
+            f"SELECT {reg_month} AS reg_month, {deposit_month} AS deposit_month, COUNT(*) AS users "
+            f"FROM {self.table} {month_where} GROUP BY 1, 2 ORDER BY 1",
+            params
+        )
+
+        return cohorts_from_month_counts(
+            pd.PeriodIndex(pairs['reg_month'], freq='M'),
+            pd.PeriodIndex(pairs['deposit_month'], freq='M'),
+            pairs['users']
+        )
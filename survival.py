@@ -0,0 +1,134 @@
+"""
+Время до конверсии: кривые дожития Каплана-Мейера
+
+Средние time_* считаются только по дошедшим до следующего этапа, поэтому
+свежие когорты выглядят быстрее и меньше, чем есть. Здесь пользователи,
+еще не сделавшие следующий шаг, учитываются как цензурированные в момент
+последнего наблюдения (самая поздняя дата в данных).
+
+Длительности - целые часы, поэтому кривые всех значений сегмента строятся
+без сортировки и без циклов по пользователям или моментам времени: один
+bincount по (значение сегмента, час) дает матрицу событий и выбывших,
+а число под риском и вероятность дожития получаются накопительными
+суммой и произведением по строкам матрицы.
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS, STAGE_TRANSITIONS
+from segment_anomalies import OVERALL_DIMENSION
+
+SURVIVAL_HORIZONS = [24, 72, 168]  # Часы для доли конверсий в сводке
+CURVE_COLUMNS = ['transition', 'dimension', 'segment_value', 'hours',
+                 'at_risk', 'events', 'censored', 'survival']
+
+
+def kaplan_meier(hours, events, groups, n_groups):
+    """
+    Кривые Каплана-Мейера для нескольких групп одной матричной операцией
+
+    Parameters:
+    -----------
+    hours : np.ndarray
+        Целые неотрицательные длительности
+    events : np.ndarray
+        bool: событие произошло (иначе наблюдение цензурировано)
+    groups : np.ndarray
+        Номер группы каждого наблюдения от 0 до n_groups - 1
+
+    Returns:
+    --------
+    tuple
+        (группа, час, под риском, события, цензурировано, дожитие) - только
+        часы, в которые в группе было событие или цензурирование
+    """
+    width = int(hours.max()) + 1 if len(hours) else 1
+    cells = groups * width + hours
+    size = n_groups * width
+    removed = np.bincount(cells, minlength=size).reshape(n_groups, width)
+    occurred = np.bincount(cells[events], minlength=size).reshape(n_groups, width)
+
+    # Под риском в час t - все, кто не выбыл раньше t
+    at_risk = removed.sum(axis=1, keepdims=True) - np.cumsum(removed, axis=1) + removed
+    hazard = np.divide(occurred, at_risk, out=np.zeros(at_risk.shape), where=at_risk > 0)
+    survival = np.cumprod(1 - hazard, axis=1)
+
+    group, hour = np.nonzero(removed)
+    return (group, hour, at_risk[group, hour], occurred[group, hour],
+            removed[group, hour] - occurred[group, hour], survival[group, hour])
+
+
+def survival_curves(durations, segments=SEGMENT_COLUMNS, transitions=STAGE_TRANSITIONS):
+    """
+    Кривые дожития по переходам для всех пользователей и каждого значения сегментов
+
+    Parameters:
+    -----------
+    durations : pd.DataFrame
+        Результат engine.conversion_durations
+
+    Returns:
+    --------
+    pd.DataFrame
+        transition, dimension ('all' или сегмент), segment_value, hours,
+        at_risk, events, censored, survival (доля еще не сделавших переход)
+    """
+    frames = []
+    for key, _, _ in transitions:
+        hours = durations[f'hours_{key}'].to_numpy(dtype=float)
+        started = ~np.isnan(hours)
+        if not started.any():
+            continue
+        hours = hours[started].astype(np.int64)
+        events = durations[f'event_{key}'].to_numpy(dtype=bool)[started]
+
+        dimensions = [(OVERALL_DIMENSION, np.zeros(len(hours), dtype=np.int64), [OVERALL_DIMENSION])]
+        for segment in segments:
+            codes, values = pd.factorize(durations[segment][started], use_na_sentinel=False)
+            dimensions.append((segment, codes, [str(value) for value in values]))
+
+        for dimension, codes, values in dimensions:
+            group, hour, at_risk, occurred, censored, survival = kaplan_meier(
+                hours, events, codes, len(values)
+            )
+            frames.append(pd.DataFrame({
+                'transition': key,
+                'dimension': dimension,
+                'segment_value': np.asarray(values, dtype=object)[group],
+                'hours': hour,
+                'at_risk': at_risk,
+                'events': occurred,
+                'censored': censored,
+                'survival': survival
+            }))
+
+    if not frames:
+        return pd.DataFrame(columns=CURVE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def survival_summary(curves, horizons=SURVIVAL_HORIZONS):
+    """
+    Сводка кривых: пользователи, события, медианное время и доля конверсий к горизонтам
+
+    Returns:
+    --------
+    pd.DataFrame
+        transition, dimension, segment_value, users, events, censored,
+        median_hours (NaN, если половина группы не сделала переход),
+        conversion_<h>h - доля (%) сделавших переход за h часов с учетом цензурирования
+    """
+    keys = ['transition', 'dimension', 'segment_value']
+    grouped = curves.groupby(keys, sort=False)
+    summary = pd.DataFrame({
+        'users': grouped['at_risk'].first(),
+        'events': grouped['events'].sum(),
+        'censored': grouped['censored'].sum(),
+        'median_hours': curves[curves['survival'] <= 0.5].groupby(keys, sort=False)['hours'].first()
+    })
+    for horizon in horizons:
+        # Дожитие к горизонту - значение в последний момент не позже него (до первого - 1)
+        survival = curves[curves['hours'] <= horizon].groupby(keys, sort=False)['survival'].last()
+        summary[f'conversion_{horizon}h'] = (1 - survival.reindex(summary.index).fillna(1.0)) * 100
+    return summary.reset_index()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест HTTP JSON API: ответы совпадают с FunnelAnalyzer, ошибки запроса
+дают 400/404/405, а повторный запрос с теми же фильтрами в другом порядке
+отдается из кэша без пересчета
+"""
+
+import asyncio
+import json
+
+import numpy as np
+
+from api import FunnelAPI
+from generate_mock_data import generate_mock_data
+from utils import FunnelAnalyzer
+
+print("Тестирование HTTP JSON API...")
+print("=" * 50)
+
+analyzer = FunnelAnalyzer(generate_mock_data(1000))
+api = FunnelAPI(analyzer, workers=2)
+
+computed = []
+compute = api.compute
+
+
+def counting_compute(path, filters, params):
+    """Учет фактических расчетов мимо кэша"""
+    computed.append(path)
+    return compute(path, filters, params)
+
+
+api.compute = counting_compute
+
+
+def request(target, method='GET'):
+    status, body = asyncio.run(api.handle(method, target))
+    return status, json.loads(body)
+
+
+try:
+    # Ответ совпадает с прямым расчетом
+    status, body = request('/metrics/funnel?country=RU,UA&device=mobile')
+    expected = analyzer.calculate_funnel_metrics({'country': ['RU', 'UA'], 'device': ['mobile']})
+    assert status == 200
+    assert body['counts'] == expected['counts']
+    for key, value in expected['conversions'].items():
+        assert np.isclose(body['conversions'][key], value)
+    print(f"✓ /metrics/funnel: {body['counts']['registrations']} регистраций по фильтру")
+
+    # Те же фильтры в другом порядке и повтором параметра - попадание в кэш
+    status, cached = request('/metrics/funnel?device=mobile&country=UA&country=RU')
+    assert status == 200 and cached == body
+    assert computed == ['/metrics/funnel']
+    assert (api.cache.hits, api.cache.misses) == (1, 1)
+
+    # Другой параметр - другой ключ и новый расчет
+    assert request('/anomalies?threshold=0.3')[0] == 200
+    assert request('/anomalies?threshold=0.3')[0] == 200
+    assert computed == ['/metrics/funnel', '/anomalies']
+
+    status, health = request('/health')
+    assert status == 200 and health['cache'] == {'hits': 2, 'misses': 2}
+    print("✓ Кэш: повторные запросы отдаются без пересчета")
+
+    # Ошибки запроса не доходят до расчета
+    errors = [
+        ('/metrics/unknown', 404),
+        ('/metrics/funnel?segment=RU', 400),
+        ('/anomalies?threshold=high', 400),
+    ]
+    for target, expected_status in errors:
+        status, body = request(target)
+        assert status == expected_status and 'error' in body, (target, status, body)
+    assert request('/metrics/funnel', method='POST')[0] == 405
+    assert computed == ['/metrics/funnel', '/anomalies']
+    print("✓ Ошибки: 404 для неизвестного маршрута, 400 для параметров, 405 для POST")
+finally:
+    api.executor.shutdown()
+
+print("\n🎉 HTTP JSON API работает корректно!")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест разбора дат: определение формата и порядок дня и месяца
+"""
+
+import pandas as pd
+
+from date_parsing import detect_datetime_format, parse_datetime, parse_datetime_columns
+
+print("Тестирование разбора дат...")
+print("=" * 50)
+
+# ISO и формат с точками определяются по выборке
+iso = pd.Series(['2025-03-04 10:00:00', '2025-03-05 11:30:00', None])
+assert detect_datetime_format(iso) == '%Y-%m-%d %H:%M:%S'
+assert parse_datetime(iso).iloc[0] == pd.Timestamp('2025-03-04 10:00:00')
+assert detect_datetime_format(pd.Series(['04.03.2025', '05.03.2025'])) == '%d.%m.%Y'
+
+# В начале столбца все числа не больше 12, но дальше есть день 25: месяц первым
+us_dates = pd.Series(['03/04/2025 10:00:00'] * 2000 + ['03/25/2025 10:00:00'])
+assert detect_datetime_format(us_dates) == '%m/%d/%Y %H:%M:%S'
+assert parse_datetime(us_dates).iloc[0] == pd.Timestamp('2025-03-04 10:00:00')
+
+# То же для дня первым
+eu_dates = pd.Series(['03/04/2025 10:00:00'] * 2000 + ['25/03/2025 10:00:00'])
+assert detect_datetime_format(eu_dates) == '%d/%m/%Y %H:%M:%S'
+assert parse_datetime(eu_dates).iloc[0] == pd.Timestamp('2025-04-03 10:00:00')
+
+# Порядок не определить ни по одной дате: месяц первым (как pd.to_datetime) и предупреждение
+ambiguous = pd.DataFrame({'registration_time': ['03/04/2025', '05/06/2025', '11/12/2025']})
+parsed, report = parse_datetime_columns(ambiguous, ['registration_time'])
+assert report['registration_time']['format'] == '%m/%d/%Y'
+assert report['registration_time']['warning'] is not None
+assert parsed['registration_time'].tolist() == list(pd.to_datetime(ambiguous['registration_time']))
+
+_, report = parse_datetime_columns(pd.DataFrame({'registration_time': iso}), ['registration_time'])
+assert report['registration_time']['warning'] is None and report['registration_time']['failed'] == 0
+print("✓ Порядок дня и месяца")
+
+print("\n🎉 Разбор дат работает корректно!")
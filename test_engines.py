@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест движков вычислений: polars должен давать те же результаты, что и pandas
+
+Вычисления, общие для обоих движков, дополнительно проверяются на небольших
+наборах с известным (посчитанным вручную) результатом
+"""
+
+import numpy as np
+import pandas as pd
+
+from comparison import compare_datasets
+from engines import DATE_COLUMNS, STAGE_TRANSITIONS, available_engines
+from generate_mock_data import generate_mock_data, generate_sample_data_with_segments
+from survival import survival_curves, survival_summary
+from utils import FunnelAnalyzer
+from windows import window_grid, windowed_counts
+
+
+def assert_metrics_equal(expected, actual):
+    assert expected['counts'] == actual['counts']
+    for group in ['conversions', 'avg_times_hours']:
+        for key, value in expected[group].items():
+            assert np.isclose(value, actual[group][key], equal_nan=True), (group, key)
+
+
+def assert_engines_equal(df, filters):
+    pandas_analyzer = FunnelAnalyzer(df, engine='pandas')
+    polars_analyzer = FunnelAnalyzer(df, engine='polars')
+    filtered_df = df[np.logical_and.reduce([df[col].isin(vals) for col, vals in filters.items()])]
+
+    # Весь набор, фильтры по сегментам и внешний срез
+    for selection in [None, filters, filtered_df]:
+        assert_metrics_equal(
+            pandas_analyzer.calculate_funnel_metrics(selection),
+            polars_analyzer.calculate_funnel_metrics(selection)
+        )
+
+        expected_segments = pandas_analyzer.analyze_by_segments(selection)
+        actual_segments = polars_analyzer.analyze_by_segments(selection)
+        for segment, expected_table in expected_segments.items():
+            pd.testing.assert_frame_equal(expected_table, actual_segments[segment], check_dtype=False)
+
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.calculate_daily_metrics(selection),
+            polars_analyzer.calculate_daily_metrics(selection),
+            check_dtype=False
+        )
+        assert (pandas_analyzer.detect_anomalies(df=selection) ==
+                polars_analyzer.detect_anomalies(df=selection))
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.calculate_cohort_analysis(selection),
+            polars_analyzer.calculate_cohort_analysis(selection),
+            check_dtype=False
+        )
+
+        curve_keys = ['transition', 'dimension', 'segment_value', 'hours']
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.calculate_survival_curves(selection).sort_values(curve_keys, ignore_index=True),
+            polars_analyzer.calculate_survival_curves(selection).sort_values(curve_keys, ignore_index=True),
+            check_dtype=False
+        )
+
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.analyze_segment_crosstab('traffic_source', 'country', selection),
+            polars_analyzer.analyze_segment_crosstab('traffic_source', 'country', selection),
+            check_dtype=False
+        )
+        
+        window_keys = ['transition', 'dimension', 'segment_value', 'window_hours']
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.calculate_window_conversion(window_grid(), selection).sort_values(window_keys, ignore_index=True),
+            polars_analyzer.calculate_window_conversion(window_grid(), selection).sort_values(window_keys, ignore_index=True),
+            check_dtype=False
+        )
+        
+        for period in ['day', 'week']:
+            pd.testing.assert_frame_equal(
+                pandas_analyzer.calculate_cohort_triangle('deposits', period, df=selection),
+                polars_analyzer.calculate_cohort_triangle('deposits', period, df=selection)
+            )
+        
+        pandas_rollups = pandas_analyzer.calculate_calendar_rollups(selection)
+        polars_rollups = polars_analyzer.calculate_calendar_rollups(selection)
+        for period, table in pandas_rollups.items():
+            pd.testing.assert_frame_equal(table, polars_rollups[period], check_dtype=False)
+        pd.testing.assert_frame_equal(
+            pandas_analyzer.compare_periods('day', 'same_weekday', selection),
+            polars_analyzer.compare_periods('day', 'same_weekday', selection),
+            check_dtype=False
+        )
+        
+        # Порядок равных значений в распределениях зависит от порядка страт
+        pandas_overview = pandas_analyzer.calculate_overview(selection)
+        polars_overview = polars_analyzer.calculate_overview(selection)
+        for key, value in pandas_overview.items():
+            if isinstance(value, pd.Series):
+                pd.testing.assert_series_equal(value.sort_index(), polars_overview[key].sort_index())
+            else:
+                assert value == polars_overview[key], key
+
+    # Сравнение A/B одного набора на двух движках: разниц и значимых изменений нет
+    comparison = compare_datasets(pandas_analyzer, polars_analyzer)
+    for table in [comparison['funnel']['conversions'], comparison['segments'],
+                  comparison['daily'], comparison['time_to_convert']['windows']]:
+        assert np.allclose(table['delta_pp'].dropna(), 0) and not table['significant'].any()
+    assert np.allclose(comparison['time_to_convert']['medians']['delta_hours'].dropna(), 0)
+
+
+def funnel_frame(users, deposits, bets, second_deposits, deposit_hours=2, bet_hours=30, start='2024-01-01'):
+    """
+    Набор с известными счетчиками: первые deposits пользователей сделали депозит
+    через deposit_hours после регистрации, первые bets - ставку через bet_hours и т.д.
+    """
+    position = np.arange(users)
+    registration = pd.Timestamp(start) + pd.Timedelta(hours=10) + pd.to_timedelta(position % 7, unit='D')
+
+    def stage(count, hours):
+        return (registration + pd.Timedelta(hours=hours)).where(position < count)
+
+    return pd.DataFrame({
+        'user_id': position,
+        'registration_time': registration,
+        'deposit_time': stage(deposits, deposit_hours),
+        'first_bet_time': stage(bets, bet_hours),
+        'second_deposit_time': stage(second_deposits, 200),
+        'traffic_source': 'organic',
+        'country': 'RU',
+        'device': 'mobile'
+    })
+
+
+def check_known_comparison():
+    """A/B сравнение двух разных наборов с известными разницами"""
+    # Депозит: 20% -> 40% (z = 0.2 / sqrt(0.3 * 0.7 * 2 / 200) = 4.36); ставка после депозита: 75% и 75%
+    analyzer_a = FunnelAnalyzer(funnel_frame(200, 40, 30, 15))
+    analyzer_b = FunnelAnalyzer(funnel_frame(200, 80, 60, 30, deposit_hours=5))
+    comparison = compare_datasets(analyzer_a, analyzer_b)
+
+    conversions = comparison['funnel']['conversions'].set_index('conversion')
+    assert np.isclose(conversions.loc['reg_to_deposit', 'delta_pp'], 20.0)
+    assert np.isclose(conversions.loc['reg_to_deposit', 'z'], 0.2 / np.sqrt(0.3 * 0.7 * 2 / 200))
+    assert conversions.loc['reg_to_deposit', 'significant']
+    assert np.isclose(conversions.loc['deposit_to_bet', 'delta_pp'], 0.0)
+    assert not conversions.loc['deposit_to_bet', 'significant']
+    assert comparison['funnel']['counts']['relative'].tolist() == [0.0, 100.0, 100.0, 100.0]
+
+    segments = comparison['segments'].set_index(['dimension', 'segment_value'])
+    assert np.isclose(segments.loc[('country', 'RU'), 'delta_pp'], 20.0)
+    assert segments.loc[('country', 'RU'), 'users_b'] == 200
+
+    # Ставка через 28 ч после депозита в A и через 25 ч в B; за 24 ч - никто, за 7 дней - 75% в обоих
+    windows = comparison['time_to_convert']['windows'].set_index(['transition', 'window_hours'])
+    assert np.isclose(windows.loc[('reg_to_deposit', 1.0), 'delta_pp'], 0.0)
+    assert np.isclose(windows.loc[('reg_to_deposit', 24.0), 'delta_pp'], 20.0)
+    assert np.isclose(windows.loc[('deposit_to_bet', 168.0), 'rate_a'], 75.0)
+    assert not windows.loc[('deposit_to_bet', 168.0), 'significant']
+    medians = comparison['time_to_convert']['medians'].set_index('transition')
+    assert np.isclose(medians.loc['deposit_to_bet', 'delta_hours'], -3.0)
+
+    # Смена базового набора меняет знак разниц
+    swapped = compare_datasets(analyzer_b, analyzer_a)['funnel']['conversions'].set_index('conversion')
+    assert np.isclose(swapped.loc['reg_to_deposit', 'delta_pp'], -20.0)
+    print("✓ A/B сравнение: известные разницы и значимость")
+
+
+def check_known_kaplan_meier():
+    """Кривые Каплана-Мейера, посчитанные вручную: цензурирование, совпадающие моменты, группа без событий"""
+    # RU: часы 1, 2, 2, 2, 3, 5; в час 2 - два события и одно цензурирование.
+    # S(1) = 5/6, S(2) = 5/6 * 3/5 = 0.5, S(3) = 0.5 * 1/2 = 0.25, в час 5 - только цензурирование
+    # DE: все цензурированы - дожитие 1, медианы нет
+    durations = pd.DataFrame({
+        'hours_reg_to_deposit': [1, 2, 2, 2, 3, 5, 4, 4, 6],
+        'event_reg_to_deposit': [True, True, True, False, True, False, False, False, False],
+        'country': ['RU'] * 6 + ['DE'] * 3
+    })
+    curves = survival_curves(durations, segments=['country'], transitions=STAGE_TRANSITIONS[:1])
+    ru = curves[curves['segment_value'] == 'RU']
+    assert ru['hours'].tolist() == [1, 2, 3, 5]
+    assert ru['at_risk'].tolist() == [6, 5, 2, 1]
+    assert ru['events'].tolist() == [1, 2, 1, 0]
+    assert ru['censored'].tolist() == [0, 1, 0, 1]
+    assert np.allclose(ru['survival'], [5 / 6, 0.5, 0.25, 0.25])
+
+    de = curves[curves['segment_value'] == 'DE']
+    assert de['hours'].tolist() == [4, 6] and de['at_risk'].tolist() == [3, 1]
+    assert (de['events'] == 0).all() and (de['survival'] == 1.0).all()
+
+    summary = survival_summary(curves).set_index('segment_value')
+    assert summary.loc['RU', 'median_hours'] == 2 and np.isnan(summary.loc['DE', 'median_hours'])
+    assert np.isclose(summary.loc['RU', 'conversion_24h'], 75.0)
+    assert summary.loc['DE', 'conversion_24h'] == 0.0
+    # Все пользователи: в час 2 под риском 8 из 9
+    overall = curves[curves['dimension'] == 'all']
+    assert overall['at_risk'].tolist() == [9, 8, 5, 4, 2, 1]
+    print("✓ Каплан-Мейер: известные кривые и медианы")
+
+
+def check_windowed_counts():
+    """Конверсии в окнах одной сортировкой против прямого подсчета (hours <= w) по группам"""
+    rng = np.random.default_rng(7)
+    hours = np.concatenate([rng.exponential(30, 500).round(2), [0.0, 0.0, 24.0, 24.0, 168.0]])
+    converted = rng.random(len(hours)) < 0.6
+    converted[-5:] = True
+    groups = rng.integers(0, 3, len(hours))  # группа 3 пустая
+    windows = np.array([0.0, 0.5, 1.0, 24.0, 100.0, 168.0, 1000.0])
+
+    started, matrix = windowed_counts(hours, converted, groups, 4, windows)
+    for group in range(4):
+        in_group = groups == group
+        assert started[group] == in_group.sum()
+        for column, window in enumerate(windows):
+            assert matrix[group, column] == (in_group & converted & (hours <= window)).sum(), (group, window)
+    assert started[3] == 0 and (matrix[3] == 0).all()
+    print("✓ Окна конверсии: прямой подсчет")
+
+
+def check_cohort_triangles():
+    """Когортные треугольники по дням и неделям против прямого подсчета по строкам"""
+    df = generate_mock_data(3000)
+    triangle_analyzer = FunnelAnalyzer(df)
+    registration_day = df['registration_time'].dt.normalize()
+    deposit_offset = (df['deposit_time'].dt.normalize() - registration_day).dt.days
+    last_day = max(df[col].max() for col in DATE_COLUMNS).normalize()
+    last_registration = registration_day.max()
+
+    def assert_row(row, users, observable_until, offset_days):
+        """Доля когорты с депозитом не позже offset_days(k); после observable_until(k) - NaN"""
+        assert row['users'] == users.sum()
+        for k in row.index.drop('users'):
+            if observable_until(k) > last_day:
+                assert np.isnan(row[k]), k
+            else:
+                expected = (users & (deposit_offset <= offset_days(k))).sum() / users.sum() * 100
+                assert np.isclose(row[k], expected), k
+
+    # День: когорта в середине периода - часть ячеек наблюдаема, часть еще нет
+    daily = triangle_analyzer.calculate_cohort_triangle('deposits', 'day')
+    cohort = daily.index[len(daily) // 2]
+    assert_row(
+        daily.loc[cohort], registration_day == cohort,
+        lambda k: cohort + pd.Timedelta(days=k), lambda k: k
+    )
+    assert daily.iloc[-1].drop('users').isna().sum() > 0
+
+    # Неделя с понедельника: неделя k наблюдаема, когда ее дожил последний день когорты
+    weekly = triangle_analyzer.calculate_cohort_triangle('deposits', 'week')
+    assert (weekly.index.dayofweek == 0).all()
+    week_start = registration_day - pd.to_timedelta(registration_day.dt.dayofweek, unit='D')
+    for cohort in [weekly.index[0], weekly.index[len(weekly) // 2]]:
+        latest = min(cohort + pd.Timedelta(days=6), last_registration)
+        assert_row(
+            weekly.loc[cohort], week_start == cohort,
+            lambda k: latest + pd.Timedelta(days=(k + 1) * 7 - 1), lambda k: 7 * k + 6
+        )
+    print("✓ Когортные треугольники: прямой подсчет, недели и ненаблюдаемые ячейки")
+
+
+def check_registration_order():
+    """Упорядоченные данные не копируются, остальные переставляются с сохранением индекса"""
+    df = generate_mock_data(500).sort_values('registration_time', ignore_index=True)
+    ordered = FunnelAnalyzer(df)
+    assert np.shares_memory(ordered.df['user_id'].to_numpy(), df['user_id'].to_numpy())
+
+    shuffled = df.sample(frac=1, random_state=0)
+    reordered = FunnelAnalyzer(shuffled)
+    assert reordered.df['registration_time'].is_monotonic_increasing
+    assert (reordered.df['user_id'] == shuffled.loc[reordered.df.index, 'user_id']).all()
+    assert np.array_equal(reordered.registration_times, ordered.registration_times)
+
+    # Без дат регистрации (все NaT) порядок не строится, но анализ работает
+    empty_dates = df.head(4).assign(registration_time=pd.NaT)
+    for engine in available_engines():
+        undated = FunnelAnalyzer(empty_dates, engine=engine)
+        assert len(undated.registration_times) == 0
+        assert undated.calculate_funnel_metrics()['counts']['registrations'] == 4, engine
+    print("✓ Порядок регистрации: без копии для упорядоченных данных")
+
+
+def check_caller_frame_unchanged():
+    """Анализатор не меняет DataFrame вызывающего кода и не добавляет столбцов к данным"""
+    df = generate_mock_data(500)
+    for col in DATE_COLUMNS:
+        df[col] = df[col].astype(str).where(df[col].notna(), None)  # Даты строками, как из CSV
+    original = df.copy(deep=True)
+    filters = {'country': ['RU', 'UA'], 'registration_date': ('2024-01-15', '2024-03-01')}
+
+    for engine in available_engines():
+        engine_analyzer = FunnelAnalyzer(df, engine=engine)
+        engine_analyzer.calculate_funnel_metrics(filters)
+        engine_analyzer.calculate_funnel_metrics(filters, approximate=True)
+        engine_analyzer.analyze_by_segments(filters)
+        engine_analyzer.calculate_daily_metrics()
+        engine_analyzer.calculate_cohort_analysis(filters)
+        engine_analyzer.detect_anomalies()
+        engine_analyzer.detect_segment_anomalies()
+        engine_analyzer.calculate_overview()
+        list(engine_analyzer.iter_user_rows(filters, chunk_rows=100))
+        if engine == 'pandas':
+            assert list(engine_analyzer.df.columns) == list(df.columns), engine_analyzer.df.columns
+        assert list(df.columns) == list(original.columns), engine
+        pd.testing.assert_frame_equal(df, original)
+    print("✓ Исходный DataFrame не изменяется, подготовка не добавляет столбцов")
+
+
+print("Тестирование движков вычислений...")
+print("=" * 50)
+
+# Проверки на данных с известным результатом (не зависят от polars)
+check_known_comparison()
+check_known_kaplan_meier()
+check_windowed_counts()
+check_cohort_triangles()
+check_registration_order()
+check_caller_frame_unchanged()
+
+if 'polars' not in available_engines():
+    print("⚠ polars не установлен, тест пропущен")
+else:
+    filters = {'traffic_source': ['google_ads', 'organic', 'email'], 'device': ['mobile', 'tablet']}
+
+    # Типизированные даты (как после загрузки в app.py)
+    assert_engines_equal(generate_mock_data(3000), filters)
+    assert_engines_equal(generate_sample_data_with_segments(), filters)
+
+    # Строковые даты (как после pd.read_csv)
+    raw_df = generate_mock_data(2000)
+    for col in ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']:
+        raw_df[col] = raw_df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    assert_engines_equal(raw_df, filters)
+
+    print("\n🎉 Результаты polars совпадают с pandas!")
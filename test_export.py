@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест потоковой выгрузки: результат не зависит от размера части, CSV
+содержит один заголовок, Parquet - одну схему на все части, XLSX
+продолжается на следующем листе, пустой срез дает только заголовок
+"""
+
+import io
+import os
+import tempfile
+
+import openpyxl
+import pandas as pd
+import pyarrow.parquet as pq
+
+import export
+from export import export_table, export_workbook
+from generate_mock_data import generate_mock_data
+from utils import FunnelAnalyzer
+
+df = generate_mock_data(500)
+# Первые по дате регистрации пользователи без вторых депозитов: в первой части столбец целиком пуст
+df.loc[df['registration_time'].rank(method='first') <= 40, 'second_deposit_time'] = pd.NaT
+analyzer = FunnelAnalyzer(df)
+filters = {'country': ['RU']}
+empty_filters = {'country': ['нет такой страны']}
+
+print("Тестирование выгрузки...")
+print("=" * 50)
+
+
+def csv_export(table, filters=None, chunk_rows=export.EXPORT_CHUNK_ROWS):
+    buffer = io.BytesIO()
+    export_table(analyzer, table, buffer, 'csv', filters, chunk_rows)
+    return buffer.getvalue().decode('utf-8')
+
+
+def sheet_rows(workbook, name):
+    return list(workbook[name].iter_rows(values_only=True))
+
+
+# Границы частей: 7 строк на часть (в том числе неполная последняя) дают тот же файл
+whole = csv_export('users', filters)
+for chunk_rows in [1, 7, 50, 10_000]:
+    assert csv_export('users', filters, chunk_rows) == whole, chunk_rows
+lines = whole.splitlines()
+expected_rows = int((df['country'] == 'RU').sum())
+assert len(lines) == expected_rows + 1
+assert sum(line.startswith('user_id,') for line in lines) == 1
+users = pd.read_csv(io.StringIO(whole))
+assert sorted(users['user_id']) == sorted(df.loc[df['country'] == 'RU', 'user_id'])
+print(f"✓ CSV: {expected_rows} строк, один заголовок при любом размере части")
+
+with tempfile.TemporaryDirectory() as root:
+    # Parquet: схема первой части (пустой столбец второго депозита) общая для всех частей
+    path = os.path.join(root, 'users.parquet')
+    export_table(analyzer, 'users', path, 'parquet', chunk_rows=40)
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == (len(df) + 39) // 40
+    assert parquet.metadata.num_rows == len(df)
+    assert str(parquet.schema_arrow.field('second_deposit_time').type).startswith('timestamp')
+    restored = parquet.read().to_pandas()
+    whole_file = os.path.join(root, 'whole.parquet')
+    export_table(analyzer, 'users', whole_file, 'parquet')
+    pd.testing.assert_frame_equal(restored, pd.read_parquet(whole_file))
+    assert restored['second_deposit_time'].notna().sum() == df['second_deposit_time'].notna().sum()
+    print(f"✓ Parquet: {parquet.metadata.num_row_groups} row group с одной схемой")
+
+    # XLSX: при заполнении листа строки продолжаются на users_2, users_3 с заголовком
+    excel_max_rows, export.EXCEL_MAX_ROWS = export.EXCEL_MAX_ROWS, 10
+    try:
+        path = os.path.join(root, 'users.xlsx')
+        export_workbook(analyzer, path, ['users', 'funnel'], filters={'country': ['KZ']}, chunk_rows=4)
+    finally:
+        export.EXCEL_MAX_ROWS = excel_max_rows
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    kz_rows = int((df['country'] == 'KZ').sum())
+    user_sheets = [name for name in workbook.sheetnames if name.startswith('users')]
+    assert user_sheets == ['users'] + [f'users_{part}' for part in range(2, len(user_sheets) + 1)]
+    assert len(user_sheets) == -(-kz_rows // 9)
+    sheets = [sheet_rows(workbook, name) for name in user_sheets]
+    assert all(rows[0][0] == 'user_id' for rows in sheets)
+    assert all(len(rows) == 10 for rows in sheets[:-1])
+    assert sum(len(rows) - 1 for rows in sheets) == kz_rows
+    assert 'funnel' in workbook.sheetnames
+    print(f"✓ XLSX: {kz_rows} строк на {len(user_sheets)} листах по 9 строк и заголовку")
+
+    # Пустой срез: только заголовки во всех форматах
+    assert csv_export('users', empty_filters).splitlines() == [whole.splitlines()[0]]
+    path = os.path.join(root, 'empty.parquet')
+    export_table(analyzer, 'users', path, 'parquet', empty_filters)
+    empty = pd.read_parquet(path)
+    assert empty.empty and list(empty.columns) == list(users.columns)
+    path = os.path.join(root, 'empty.xlsx')
+    export_workbook(analyzer, path, ['users', 'cohorts'], empty_filters)
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    assert sheet_rows(workbook, 'users') == [tuple(users.columns)]
+    assert workbook.sheetnames == ['users', 'cohorts']
+    print("✓ Пустой срез: только заголовки")
+
+print("\n🎉 Выгрузка работает корректно!")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест Live-режима: FileTailer читает только новые полные строки,
+незавершенная строка дочитывается при следующем вызове, а агрегаты
+LiveFunnelAnalyzer совпадают с FunnelAnalyzer по всему файлу
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from generate_mock_data import generate_mock_data
+from live_tail import FileTailer, LiveFunnelAnalyzer
+from utils import FunnelAnalyzer
+
+df = generate_mock_data(600)
+
+print("Тестирование Live-режима...")
+print("=" * 50)
+
+
+def csv_lines(frame, header=False):
+    return frame.to_csv(index=False, header=header).encode('utf-8')
+
+
+with tempfile.TemporaryDirectory() as root:
+    path = os.path.join(root, 'events.csv')
+    with open(path, 'wb') as f:
+        f.write(csv_lines(df.iloc[:200], header=True))
+
+    tailer = FileTailer(path)
+    live = LiveFunnelAnalyzer(path)
+    first = tailer.read_new()
+    assert len(first) == 200
+    assert first['user_id'].tolist() == df['user_id'].iloc[:200].tolist()
+    assert tailer.offsets[path] == os.path.getsize(path)
+    assert tailer.read_new().empty
+    print("✓ Первое чтение: заголовок и 200 строк, смещение - конец файла")
+
+    # Дописаны полные строки и начало следующей без перевода строки
+    full_size = os.path.getsize(path)
+    tail = csv_lines(df.iloc[200:400])
+    cut = tail.index(b'\n', len(tail) // 2) + 10
+    with open(path, 'ab') as f:
+        f.write(tail[:cut])
+    partial = tailer.read_new()
+    complete_rows = tail[:cut].count(b'\n')
+    assert len(partial) == complete_rows
+    assert partial['user_id'].tolist() == df['user_id'].iloc[200:200 + complete_rows].tolist()
+    assert tailer.offsets[path] == full_size + tail.rindex(b'\n', 0, cut) + 1
+    print(f"✓ Незавершенная строка не прочитана: {complete_rows} полных строк")
+
+    with open(path, 'ab') as f:
+        f.write(tail[cut:])
+    rest = tailer.read_new()
+    assert rest['user_id'].tolist() == df['user_id'].iloc[200 + complete_rows:400].tolist()
+    print("✓ Незавершенная строка дочитана после завершения")
+
+    # Агрегаты Live-режима совпадают с полным расчетом
+    assert live.refresh() == 200
+    assert live.rows_ingested == 400
+    expected = FunnelAnalyzer(pd.read_csv(path)).calculate_funnel_metrics()
+    assert live.calculate_funnel_metrics()['counts'] == expected['counts']
+    print(f"✓ LiveFunnelAnalyzer: {live.rows_ingested} строк, счетчики совпадают")
+
+    # Перезаписанный (более короткий) файл читается с начала, с новым заголовком
+    with open(path, 'wb') as f:
+        f.write(csv_lines(df.iloc[400:450], header=True))
+    rewritten = tailer.read_new()
+    assert rewritten['user_id'].tolist() == df['user_id'].iloc[400:450].tolist()
+    print("✓ Усеченный файл прочитан заново")
+
+    # Строки без даты регистрации: в метриках по всему набору, но не в дневных таблицах
+    undated = df.copy()
+    undated.loc[undated.index[::50], 'registration_time'] = pd.NaT
+    undated_path = os.path.join(root, 'undated.csv')
+    undated.to_csv(undated_path, index=False)
+    live_undated = LiveFunnelAnalyzer(undated_path)
+    full = FunnelAnalyzer(pd.read_csv(undated_path))
+    assert live_undated.calculate_funnel_metrics()['counts'] == full.calculate_funnel_metrics()['counts']
+    assert live_undated.calculate_funnel_metrics()['counts']['registrations'] == len(df)
+    for segment, table in full.analyze_by_segments().items():
+        live_table = live_undated.analyze_by_segments()[segment]
+        pd.testing.assert_frame_equal(
+            live_table.sort_values('segment_value').reset_index(drop=True),
+            table.sort_values('segment_value').reset_index(drop=True),
+            check_dtype=False
+        )
+    live_daily = live_undated.calculate_daily_metrics()
+    full_daily = full.calculate_daily_metrics()
+    assert live_daily['registrations'].sum() == full_daily['registrations'].sum() == len(df) - 12
+    assert (live_daily['registrations'].to_numpy() == full_daily['registrations'].to_numpy()).all()
+    print("✓ Строки без даты регистрации: те же метрики, что у FunnelAnalyzer")
+
+    # Папка: новые файлы подхватываются, JSONL читается построчно
+    folder = os.path.join(root, 'drops')
+    os.makedirs(folder)
+    folder_tailer = FileTailer(folder)
+    df.iloc[:50].to_csv(os.path.join(folder, '00.csv'), index=False)
+    assert len(folder_tailer.read_new()) == 50
+    df.iloc[50:80].to_json(os.path.join(folder, '01.jsonl'), orient='records', lines=True,
+                           date_format='iso')
+    added = folder_tailer.read_new()
+    assert added['user_id'].tolist() == df['user_id'].iloc[50:80].tolist()
+    assert folder_tailer.read_new().empty
+    print("✓ Папка: новый JSONL файл прочитан, старые файлы не перечитываются")
+
+print("\n🎉 Live-режим работает корректно!")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест шардированной генерации: part-файлы не зависят от числа процессов,
+user_id идут подряд без повторов через все шарды, CSV шарда содержит
+один заголовок, Parquet - по группе строк на каждые row_group_size строк
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from generate_mock_data import generate_mock_dataset
+
+N_USERS = 2000  # 3 шарда по 667, 667 и 666 пользователей
+N_SHARDS = 3
+ROW_GROUP_SIZE = 150  # Несколько групп строк на шард, последняя неполная
+START_DATE = datetime(2024, 1, 1)
+END_DATE = datetime(2024, 1, 31)
+
+print("Тестирование шардированной генерации...")
+print("=" * 50)
+
+
+def generate(output_dir, file_format, workers):
+    return generate_mock_dataset(
+        N_USERS, output_dir, n_shards=N_SHARDS, file_format=file_format, seed=7,
+        start_date=START_DATE, end_date=END_DATE, workers=workers, row_group_size=ROW_GROUP_SIZE
+    )
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+frames = {}
+with tempfile.TemporaryDirectory() as root:
+    for file_format in ['parquet', 'csv']:
+        serial = generate(os.path.join(root, f'{file_format}-1'), file_format, workers=1)
+        parallel = generate(os.path.join(root, f'{file_format}-3'), file_format, workers=N_SHARDS)
+        assert [os.path.basename(path) for path in serial] == \
+            [f'part-{shard:05d}.{file_format}' for shard in range(N_SHARDS)]
+
+        # Одинаковые файлы при любом числе процессов
+        for serial_path, parallel_path in zip(serial, parallel):
+            assert read_bytes(serial_path) == read_bytes(parallel_path), serial_path
+
+        if file_format == 'parquet':
+            parts = [pd.read_parquet(path) for path in serial]
+            for path, part in zip(serial, parts):
+                assert pq.ParquetFile(path).metadata.num_row_groups == -(-len(part) // ROW_GROUP_SIZE)
+        else:
+            for path in serial:
+                with open(path) as f:
+                    lines = f.read().splitlines()
+                assert sum(line.startswith('user_id,') for line in lines) == 1 and lines[0].startswith('user_id,')
+            parts = [pd.read_csv(path, parse_dates=['registration_time']) for path in serial]
+
+        # user_id подряд с 1 через все шарды, без повторов
+        assert [len(part) for part in parts] == [667, 667, 666]
+        frames[file_format] = pd.concat(parts, ignore_index=True)
+        assert frames[file_format]['user_id'].tolist() == list(range(1, N_USERS + 1))
+        times = frames[file_format]['registration_time']
+        assert times.min() >= pd.Timestamp(START_DATE) and times.max() <= pd.Timestamp(END_DATE)
+        print(f"✓ {file_format}: одинаковые файлы при 1 и {N_SHARDS} процессах, user_id 1-{N_USERS}")
+
+# Форматы дают одни и те же строки
+csv, parquet = frames['csv'], frames['parquet']
+assert (csv['country'] == parquet['country']).all()
+assert (csv['registration_time'] == parquet['registration_time']).all()
+print("✓ CSV и Parquet содержат одинаковые строки")
+
+try:
+    generate_mock_dataset(10, tempfile.gettempdir(), file_format='json')
+    raise AssertionError("Неизвестный формат должен отклоняться")
+except ValueError:
+    pass
+print("✓ Неизвестный формат отклоняется")
+
+print("\n🎉 Шардированная генерация работает корректно!")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест онлайн-монитора: пересборка по истории, алерт на падение в батче,
+пропущенные часы между батчами, час батча по всем этапам и сохранение состояния
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from monitor import OVERALL_KEY, OnlineAnomalyMonitor, series_key
+
+
+def hourly_users(hour, users, deposits):
+    """users регистраций в час hour, первые deposits из них вносят депозит в тот же час"""
+    registration = pd.Timestamp(hour) + pd.to_timedelta(np.arange(users) % 60, unit='min')
+    deposit = pd.Series(pd.NaT, index=range(users), dtype='datetime64[ns]')
+    deposit[:deposits] = registration[:deposits] + pd.Timedelta(seconds=30)
+    return pd.DataFrame({
+        'user_id': range(users),
+        'registration_time': registration,
+        'deposit_time': deposit,
+        'first_bet_time': pd.NaT,
+        'second_deposit_time': pd.NaT,
+        'traffic_source': np.where(np.arange(users) % 2 == 0, 'google', 'facebook'),
+        'country': 'RU',
+        'device': 'mobile',
+    })
+
+
+print("Тестирование онлайн-монитора...")
+print("=" * 50)
+
+start = pd.Timestamp('2025-06-01')
+history = pd.concat(
+    [hourly_users(start + pd.Timedelta(hours=h), 40 + h % 3, 30) for h in range(24 * 10)],
+    ignore_index=True
+)
+last_hour = start + pd.Timedelta(hours=24 * 10 - 1)
+
+with tempfile.TemporaryDirectory() as root:
+    state_path = os.path.join(root, 'state.json')
+
+    monitor = OnlineAnomalyMonitor(state_path)
+    monitor.rebuild(history)
+    assert monitor.last_hour == last_hour
+    assert monitor.observations[monitor.series_index[OVERALL_KEY]].tolist() == [10] * 24
+    print(f"✓ Пересборка: {len(monitor.series)} рядов, последний час {monitor.last_hour}")
+
+    # Состояние после перезагрузки совпадает с пересобранным
+    restored = OnlineAnomalyMonitor(state_path)
+    assert restored.series == monitor.series
+    assert restored.last_hour == monitor.last_hour
+    assert np.array_equal(restored.observations, monitor.observations)
+    for metric in monitor.mean:
+        assert np.allclose(restored.mean[metric], monitor.mean[metric])
+        assert np.allclose(restored.var[metric], monitor.var[metric])
+    print("✓ Состояние сохраняется и загружается без потерь")
+
+    # Порядок сегментов из состояния нельзя молча подменить
+    try:
+        OnlineAnomalyMonitor(state_path, max_order=2)
+        raise AssertionError("max_order=2 не должен загружать состояние с max_order=1")
+    except ValueError:
+        pass
+    print("✓ Несовпадение max_order отклоняется")
+
+    # Батч через два часа после истории: пропущенный час учтен как нулевой, депозиты упали
+    batch_hour = last_hour + pd.Timedelta(hours=2)
+    alerts = restored.update(hourly_users(batch_hour, 41, 1))
+    gap_slot = (last_hour + pd.Timedelta(hours=1)).hour
+    overall = restored.series_index[OVERALL_KEY]
+    assert restored.last_hour == batch_hour
+    assert restored.observations[overall, gap_slot] == 11
+    assert restored.observations[overall, batch_hour.hour] == 11
+    assert all(pd.Timestamp(alert['hour']) == batch_hour for alert in alerts)
+
+    drops = {
+        (alert['dimension'], alert['segment_value'])
+        for alert in alerts if alert['metric'] == 'deposits' and alert['direction'] == 'drop'
+    }
+    assert ('all', 'all') in drops, alerts
+    assert series_key('traffic_source', 'google') in {f"{d}={v}" for d, v in drops}
+    assert not any(alert['metric'] == 'registrations' for alert in alerts)
+    print(f"✓ Падение депозитов обнаружено: {len(alerts)} алертов")
+
+    # Обновленное состояние записано в файл
+    reloaded = OnlineAnomalyMonitor(state_path)
+    assert reloaded.last_hour == batch_hour
+    assert np.array_equal(reloaded.observations, restored.observations)
+    try:
+        reloaded.update(hourly_users(batch_hour, 40, 30))
+        raise AssertionError("Повторный час не должен учитываться")
+    except ValueError:
+        pass
+    print("✓ Состояние после update сохранено, повтор часа отклоняется")
+
+    def expected_mean(monitor, metric, hour, actual):
+        """EWMA среднего часа суток после одного наблюдения actual"""
+        mean = monitor.mean[metric][overall, hour.hour]
+        return mean + monitor.alpha * (actual - mean)
+
+    # Депозиты в 1-й час от пользователей, зарегистрированных в уже учтенный час:
+    # час батча - по самому позднему событию, регистрации повторно не учитываются
+    next_hour = batch_hour + pd.Timedelta(hours=1)
+    late_deposits = hourly_users(batch_hour, 40, 25)
+    late_deposits['deposit_time'] = late_deposits['deposit_time'] + pd.Timedelta(hours=1)
+    deposits_mean = expected_mean(reloaded, 'deposits', next_hour, 25)
+    registrations_mean = expected_mean(reloaded, 'registrations', next_hour, 0)
+    reloaded.update(late_deposits)
+    assert reloaded.last_hour == next_hour
+    assert np.isclose(reloaded.mean['deposits'][overall, next_hour.hour], deposits_mean)
+    assert np.isclose(reloaded.mean['registrations'][overall, next_hour.hour], registrations_mean)
+    print("✓ Час батча определяется по всем этапам, а не только по регистрациям")
+
+    # События пропущенного часа учитываются в своем часе, а не заменяются нулями
+    gap_hour = next_hour + pd.Timedelta(hours=1)
+    batch_hour = next_hour + pd.Timedelta(hours=2)
+    gap_mean = expected_mean(reloaded, 'registrations', gap_hour, 40)
+    batch = pd.concat([hourly_users(gap_hour, 40, 0), hourly_users(batch_hour, 40, 30)], ignore_index=True)
+    reloaded.update(batch, hour=batch_hour)
+    assert np.isclose(reloaded.mean['registrations'][overall, gap_hour.hour], gap_mean)
+    print("✓ События пропущенного часа учтены в своем часе")
+
+    # События позже указанного часа не отбрасываются молча
+    try:
+        reloaded.update(hourly_users(batch_hour + pd.Timedelta(hours=2), 40, 30),
+                        hour=batch_hour + pd.Timedelta(hours=1))
+        raise AssertionError("События после часа батча должны отклоняться")
+    except ValueError:
+        pass
+    assert reloaded.last_hour == batch_hour
+    print("✓ События после часа батча отклоняются")
+
+print("\n🎉 Онлайн-монитор работает корректно!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест партиционированных наборов: агрегаты партиций должны давать те же
+результаты, что и FunnelAnalyzer по тем же строкам
+"""
+
+import os
+import tempfile
+
+import pandas as pd
+
+from generate_mock_data import generate_mock_data
+import partitions as partitions_module
+from partitions import (PartitionedFunnelAnalyzer, discover_partitions, partitions_fingerprint,
+                        prune_partitions, read_partitions)
+from utils import FunnelAnalyzer
+
+df = generate_mock_data(3000)
+filters = {'country': ['RU'], 'device': ['mobile', 'desktop']}
+
+print("Тестирование партиционированных наборов...")
+print("=" * 50)
+
+
+def sorted_cohorts(cohorts):
+    return cohorts.sort_values(['cohort', 'period']).reset_index(drop=True)
+
+
+read_files = []
+read_partition = partitions_module.read_partition
+
+
+def recording_read_partition(files):
+    """Учет фактически прочитанных файлов партиций"""
+    read_files.extend(files)
+    return read_partition(files)
+
+
+with tempfile.TemporaryDirectory() as root:
+    days = df['registration_time'].dt.normalize()
+    for day, part in df.groupby(days):
+        folder = os.path.join(root, f"dt={day.date()}")
+        os.makedirs(folder)
+        part.to_csv(os.path.join(folder, 'users.csv'), index=False)
+
+    analyzer = FunnelAnalyzer(df)
+    partitioned = PartitionedFunnelAnalyzer(root)
+
+    # Когорты с фильтрами по сегментам считаются по отфильтрованным пользователям
+    for selection in [None, filters]:
+        expected = sorted_cohorts(analyzer.calculate_cohort_analysis(selection))
+        actual = sorted_cohorts(partitioned.calculate_cohort_analysis(selection))
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+    total = partitioned.calculate_cohort_analysis()
+    only_ru = partitioned.calculate_cohort_analysis({'country': ['RU']})
+    assert only_ru.groupby('cohort')['users'].first().sum() == (df['country'] == 'RU').sum()
+    assert only_ru['users'].sum() < total['users'].sum()
+    print("✓ Когорты с фильтрами")
+
+    # Диапазон дат: читаются только партиции внутри него, границы включительно
+    dates = list(partitioned.partitions)
+    start, end = dates[3], dates[9]
+    pruned = prune_partitions(partitioned.partitions, start, end)
+    assert list(pruned) == dates[3:10]
+
+    partitions_module.read_partition = recording_read_partition
+    try:
+        ranged = PartitionedFunnelAnalyzer(root, start, end)
+        assert ranged.partitions_read == 7
+        assert sorted(read_files) == sorted(path for files in pruned.values() for path in files)
+        ranged.set_date_range(start, dates[11])
+        assert ranged.partitions_read == 9 and len(read_files) == 9
+        ranged.set_date_range(start, end)
+        assert len(read_files) == 9
+    finally:
+        partitions_module.read_partition = read_partition
+
+    in_range = df[(days >= start) & (days <= end)]
+    assert ranged.calculate_funnel_metrics()['counts'] == \
+        FunnelAnalyzer(in_range).calculate_funnel_metrics()['counts']
+    rows = read_partitions(root, start, end)
+    assert sorted(rows['user_id']) == sorted(in_range['user_id'])
+    print("✓ Отсечение партиций по диапазону дат")
+
+    # Чужие строки: в партицию диапазона попали пользователи, зарегистрированные после него
+    # (в другом месяце), они не входят ни в метрики, ни в когорты
+    late = df[days > end].tail(200).copy()
+    late['user_id'] = late['user_id'] + len(df)
+    late_file = os.path.join(root, f"dt={end.date()}", 'late.csv')
+    late.to_csv(late_file, index=False)
+    late_range = PartitionedFunnelAnalyzer(root, start, end)
+    assert late_range.calculate_funnel_metrics(filters)['counts'] == \
+        FunnelAnalyzer(in_range).calculate_funnel_metrics(filters)['counts']
+    pd.testing.assert_frame_equal(
+        sorted_cohorts(late_range.calculate_cohort_analysis()),
+        sorted_cohorts(FunnelAnalyzer(in_range).calculate_cohort_analysis()),
+        check_dtype=False
+    )
+    whole = PartitionedFunnelAnalyzer(root)
+    assert whole.calculate_funnel_metrics()['counts']['registrations'] == len(df) + len(late)
+    os.remove(late_file)
+    print(f"✓ {len(late)} строк с регистрацией вне диапазона не попали в когорты")
+
+    # Ключ диапазона - без чтения файлов; дописанная партиция дает новый ключ
+    partitions = discover_partitions(root)
+    last_week = prune_partitions(partitions, list(partitions)[-7], None)
+    key = partitions_fingerprint(last_week)
+    assert key == partitions_fingerprint(prune_partitions(discover_partitions(root), list(partitions)[-7], None))
+    assert key != partitions_fingerprint(partitions)
+    with open(last_week[list(last_week)[-1]][0], 'a') as f:
+        f.write(df.head(1).to_csv(index=False, header=False))
+    assert key != partitions_fingerprint(last_week)
+    print("✓ Ключ выбранных партиций")
+
+print("\n🎉 Результаты партиционированных наборов совпадают с FunnelAnalyzer!")
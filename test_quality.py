@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест проверок качества данных: каждая проверка срабатывает ровно на
+подготовленной для нее строке, чистые строки не попадают в карантин
+"""
+
+import pandas as pd
+
+from quality import QUALITY_CHECKS, check_data_quality
+
+print("Тестирование проверок качества данных...")
+print("=" * 50)
+
+# Строка -> проверка, которая должна на ней сработать (None - чистая строка)
+rows = [
+    (None, [10, '2025-01-01 10:00', '2025-01-01 12:00', '2025-01-02 09:00', '2025-01-03 09:00']),
+    ('order_violation', [11, '2025-01-01 10:00', '2025-01-01 08:00', None, None]),
+    ('orphaned_stage', [12, '2025-01-01 10:00', None, '2025-01-02 09:00', None]),
+    ('duplicate_user', [10, '2025-01-02 10:00', None, None, None]),
+    ('future_timestamp', [13, '2030-01-01 10:00', None, None, None]),
+    ('unparseable_date', [14, '2025-01-01 10:00', 'вчера вечером', None, None]),
+    (None, [15, '2025-01-03 10:00', None, None, None]),
+]
+raw = pd.DataFrame(
+    [values for _, values in rows],
+    columns=['user_id', 'registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
+)
+now = pd.Timestamp('2025-06-01')
+
+report = check_data_quality(raw, now=now)
+assert report['rows'] == len(rows)
+for check in QUALITY_CHECKS:
+    expected = [i for i, (flag, _) in enumerate(rows) if flag == check]
+    assert report['counts'][check] == len(expected), (check, report['counts'])
+    assert report['examples'][check].index.tolist() == expected, check
+    print(f"✓ {check}: строка {expected}")
+
+clean = [i for i, (flag, _) in enumerate(rows) if flag is None]
+assert report['quarantine'].tolist() == [i not in clean for i in range(len(rows))]
+print("✓ Карантин: все строки с проблемами, чистые строки не затронуты")
+
+# Уже разобранные даты: неразобранное значение определяется по исходным данным
+parsed = raw.copy()
+for col in ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']:
+    parsed[col] = pd.to_datetime(parsed[col], errors='coerce')
+assert check_data_quality(parsed, now=now)['counts']['unparseable_date'] == 0
+assert check_data_quality(parsed, raw=raw, now=now)['counts'] == report['counts']
+print("✓ Разобранные даты проверяются по исходным значениям (raw)")
+
+# Упорядоченные user_id проверяются сравнением соседей, результат тот же
+ordered = raw.sort_values('user_id', kind='stable')
+assert ordered['user_id'].is_monotonic_increasing
+ordered_report = check_data_quality(ordered, now=now)
+assert ordered_report['examples']['duplicate_user'].index.tolist() == [3]
+print("✓ duplicate_user для упорядоченных user_id")
+
+print("\n🎉 Проверки качества данных работают корректно!")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест общего реестра наборов данных: набор загружается один раз на все
+сессии и выгружается, когда последняя аренда освобождена явно или удалена
+сборщиком мусора вместе с состоянием сессии
+"""
+
+import gc
+import threading
+import weakref
+
+import pandas as pd
+
+from registry import DatasetRegistry
+
+
+class StubAnalyzer:
+    """Анализатор-заглушка: реестру нужен только атрибут df"""
+
+    def __init__(self, rows):
+        self.df = pd.DataFrame({'user_id': range(rows)})
+
+
+print("Тестирование реестра наборов данных...")
+print("=" * 50)
+
+registry = DatasetRegistry()
+loads = []
+
+
+def loader():
+    loads.append(1)
+    return StubAnalyzer(10)
+
+
+# Две сессии - одна загрузка и общий анализатор
+first = registry.acquire('dataset', loader, name='events.csv')
+second = registry.acquire('dataset', loader)
+assert len(loads) == 1 and first.analyzer is second.analyzer
+assert registry.entries() == [{'key': 'dataset', 'name': 'events.csv', 'sessions': 2, 'rows': 10}]
+analyzer_ref = weakref.ref(first.analyzer)
+print("✓ Две аренды - одна загрузка")
+
+# Удаленная сессия освобождает аренду при сборке мусора
+session_state = {'lease': first}
+del first
+del session_state
+gc.collect()
+assert 'dataset' in registry and registry.entries()[0]['sessions'] == 1
+
+second.release()
+assert second.released and 'dataset' not in registry and len(registry) == 0
+second.release()  # Повторное освобождение не уменьшает счетчик второй раз
+del second
+gc.collect()
+assert analyzer_ref() is None
+print("✓ Аренда удаленной сессии освобождена сборщиком мусора, набор выгружен")
+
+# Цикл ссылок (сессия ссылается сама на себя) освобождается при gc.collect()
+session = {'lease': registry.acquire('dataset', loader)}
+session['self'] = session
+assert len(loads) == 2
+del session
+gc.collect()
+assert 'dataset' not in registry
+print("✓ Аренда из цикла ссылок освобождена при сборке мусора")
+
+# Одновременное открытие: загрузка одна, остальные ждут ее завершения
+started = threading.Event()
+release_loader = threading.Event()
+
+
+def slow_loader():
+    started.set()
+    release_loader.wait()
+    loads.append(1)
+    return StubAnalyzer(5)
+
+
+leases = []
+threads = [
+    threading.Thread(target=lambda: leases.append(registry.acquire('slow', slow_loader)))
+    for _ in range(4)
+]
+for thread in threads:
+    thread.start()
+started.wait()
+release_loader.set()
+for thread in threads:
+    thread.join()
+assert len(loads) == 3 and len({id(lease.analyzer) for lease in leases}) == 1
+assert registry.entries()[0]['sessions'] == 4
+leases.clear()
+gc.collect()
+assert len(registry) == 0
+print("✓ Одновременные сессии ждут одну загрузку")
+
+# Ошибка загрузки не оставляет записи, следующая попытка загружает заново
+try:
+    registry.acquire('broken', lambda: 1 / 0)
+    raise AssertionError("Ошибка загрузки должна передаваться вызывающему")
+except ZeroDivisionError:
+    pass
+assert 'broken' not in registry
+lease = registry.acquire('broken', loader)
+assert len(loads) == 4 and 'broken' in registry
+print("✓ Ошибка загрузки не остается в реестре")
+
+print("\n🎉 Реестр наборов данных работает корректно!")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест приближенного режима: по многим независимым стратифицированным
+выборкам 95% интервалы Вильсона накрывают точные конверсии примерно
+в 95% случаев, а взвешенные числа пользователей совпадают с точными
+"""
+
+import numpy as np
+
+from engines import SEGMENT_CONVERSION_COLUMNS
+from generate_mock_data import generate_mock_data
+from sampling import approximate_funnel_metrics, approximate_segment_metrics
+from utils import FunnelAnalyzer
+
+SAMPLES = 200  # Число независимых выборок (разные seed)
+SAMPLE_SIZE = 1000
+MIN_COVERAGE = 0.9  # Номинал 95%; запас на разброс по SAMPLES выборкам
+
+analyzer = FunnelAnalyzer(generate_mock_data(20000))
+exact = analyzer.calculate_funnel_metrics()
+exact_segments = analyzer.analyze_by_segments()['country'].set_index('segment_value')
+
+print("Тестирование приближенного режима...")
+print("=" * 50)
+
+hits = {key: 0 for key in exact['conversions']}
+segment_hits = {column: 0 for column in SEGMENT_CONVERSION_COLUMNS.values()}
+segment_trials = 0
+
+for seed in range(SAMPLES):
+    sample = analyzer.engine.sample(analyzer.data, SAMPLE_SIZE, seed=seed)
+    metrics = approximate_funnel_metrics(sample)
+
+    # Веса страт восстанавливают размер совокупности и каждого сегмента точно
+    assert metrics['counts']['registrations'] == len(analyzer.df)
+    for key, (low, high) in metrics['intervals'].items():
+        assert low <= metrics['conversions'][key] <= high
+        hits[key] += low <= exact['conversions'][key] <= high
+
+    segments = approximate_segment_metrics(sample, ['country'])['country'].set_index('segment_value')
+    assert (segments['users'] == exact_segments.loc[segments.index, 'users']).all()
+    for column in segment_hits:
+        truth = exact_segments.loc[segments.index, column]
+        segment_hits[column] += int(
+            ((segments[f'{column}_low'] <= truth) & (truth <= segments[f'{column}_high'])).sum()
+        )
+    segment_trials += len(segments)
+
+for key, count in hits.items():
+    coverage = count / SAMPLES
+    assert coverage >= MIN_COVERAGE, (key, coverage)
+    print(f"✓ {key}: интервал накрывает точное значение в {coverage:.1%} выборок")
+
+for column, count in segment_hits.items():
+    coverage = count / segment_trials
+    assert coverage >= MIN_COVERAGE, (column, coverage)
+print(f"✓ Сегменты (country): покрытие интервалов не ниже {MIN_COVERAGE:.0%}")
+
+# Интервалы сужаются с ростом выборки
+small = approximate_funnel_metrics(analyzer.engine.sample(analyzer.data, 500))
+large = approximate_funnel_metrics(analyzer.engine.sample(analyzer.data, 5000))
+for key in exact['conversions']:
+    assert np.diff(large['intervals'][key]) < np.diff(small['intervals'][key])
+print("✓ Интервалы сужаются с ростом выборки")
+
+print("\n🎉 Приближенный режим работает корректно!")
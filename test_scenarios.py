@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест сценариев аномалий: даты и сегменты разметки apply_scenarios
+совпадают с днями регистрации, которые сценарий действительно изменил,
+а детектор сегментов находит внесенные аномалии без шума на чистых данных
+"""
+
+import numpy as np
+import pandas as pd
+
+from generate_mock_data import generate_mock_batch
+from scenarios import BENCHMARK_END, BENCHMARK_START, apply_scenarios
+from segment_anomalies import OVERALL_DIMENSION
+from significance import CELL_SEPARATOR
+from utils import FunnelAnalyzer
+
+print("Тестирование сценариев аномалий...")
+print("=" * 50)
+
+df = generate_mock_batch(np.random.default_rng(7), 20000, 1, BENCHMARK_START, BENCHMARK_END)
+first_day = df['registration_time'].min().normalize()
+
+
+def daily(frame, mask=None):
+    """Число регистраций по дням (маска - строки сегмента)"""
+    frame = frame if mask is None else frame[mask(frame)]
+    return frame['registration_time'].dt.normalize().value_counts().sort_index()
+
+
+def changed_dates(before, after):
+    """Дни, в которых число регистраций изменилось"""
+    before, after = before.align(after, fill_value=0)
+    return sorted(day.date() for day in before.index[before != after])
+
+
+def scenario_dates(start_day, days):
+    return [(first_day + pd.Timedelta(days=start_day + offset)).date() for offset in range(days)]
+
+
+def google(frame):
+    return frame['traffic_source'] == 'google_ads'
+
+
+def in_pair(frame):
+    return (frame['device'] == 'mobile') & google(frame)
+
+
+# Сбой: регистрации сегмента пропадают ровно в размеченные дни
+outage = {'name': 'outage', 'type': 'outage', 'segment': {'traffic_source': 'google_ads'},
+          'start_day': 20, 'days': 2}
+changed, labels = apply_scenarios(df, [outage])
+assert labels['date'].tolist() == scenario_dates(20, 2)
+assert set(labels['dimension']) == {'traffic_source'} and set(labels['segment_value']) == {'google_ads'}
+assert changed_dates(daily(df, google), daily(changed, google)) == labels['date'].tolist()
+assert not google(changed)[changed['registration_time'].dt.date.isin(labels['date'])].any()
+print(f"✓ outage: разметка {labels['date'].min()} - {labels['date'].max()}, регистрации сегмента пропали")
+
+# Падение конверсии: строки на месте, депозиты сегмента пропали только в размеченные дни
+russia = {'country': 'RU'}
+drop = {'name': 'drop', 'type': 'conversion_drop', 'segment': russia, 'start_day': 30, 'days': 3}
+changed, labels = apply_scenarios(df, [drop])
+assert len(changed) == len(df) and labels['date'].tolist() == scenario_dates(30, 3)
+lost = df['deposit_time'].notna() & changed['deposit_time'].isna()
+assert sorted(set(df.loc[lost, 'registration_time'].dt.date)) == labels['date'].tolist()
+assert (df.loc[lost, 'country'] == 'RU').all()
+print("✓ conversion_drop: депозиты потеряны только в размеченные дни")
+
+# Всплеск: регистрации пар сегментов удваиваются в размеченный день, подпись - в порядке SEGMENT_COLUMNS
+pair = {'device': 'mobile', 'traffic_source': 'google_ads'}
+spike = {'name': 'spike', 'type': 'registration_spike', 'segment': pair, 'start_day': 40,
+         'days': 1, 'strength': 1.0}
+changed, labels = apply_scenarios(df, [spike])
+label = labels.iloc[0]
+assert label['dimension'] == f'traffic_source{CELL_SEPARATOR}device'
+assert label['segment_value'] == f'google_ads{CELL_SEPARATOR}mobile'
+assert changed_dates(daily(df, in_pair), daily(changed, in_pair)) == [label['date']]
+day = pd.Timestamp(label['date'])
+assert daily(changed, in_pair)[day] == 2 * daily(df, in_pair)[day]
+assert changed['user_id'].is_unique
+print("✓ registration_spike: подпись пары сегментов и день всплеска")
+
+# Сценарий без сегмента размечает общий ряд; сезонность и label=False не размечаются
+drift = {'name': 'drift', 'type': 'drift', 'segment': {}, 'start_day': 50, 'days': 5, 'strength': 0.5}
+seasonality = {'name': 'seasonality', 'type': 'weekly_seasonality', 'weights': [1, 1, 1, 1, 1, 0.5, 0.5]}
+silent = dict(outage, name='silent', label=False)
+changed, labels = apply_scenarios(df, [drift, seasonality, silent])
+assert labels['name'].tolist() == ['drift'] * 5
+assert set(labels['dimension']) == {OVERALL_DIMENSION} and set(labels['segment_value']) == {OVERALL_DIMENSION}
+assert labels['date'].tolist() == scenario_dates(50, 5)
+print("✓ drift размечен по общему ряду, сезонность и label=False - без разметки")
+
+# Детектор сегментов: на чистых данных почти нет срабатываний, внесенные сбой и всплеск найдены
+clean = FunnelAnalyzer(df).detect_segment_anomalies()
+# Сотни рядов × 60 дней: единичные срабатывания конверсии ожидаемы при |z| > 3
+assert len(clean) <= 20 and (clean['metric'] == 'registrations').sum() <= 3, clean
+spike = {'name': 'spike', 'type': 'registration_spike', 'segment': {'device': 'mobile'},
+         'start_day': 40, 'days': 1, 'strength': 1.5}
+changed, labels = apply_scenarios(df, [outage, spike])
+found = FunnelAnalyzer(changed).detect_segment_anomalies()
+volume = found[found['metric'] == 'registrations']
+# Первый день каждого сценария найден (после него база EWMA уже сдвинута самой аномалией)
+for _, label in labels.drop_duplicates('name').iterrows():
+    hits = volume[
+        (volume['dimension'] == label['dimension']) & (volume['segment_value'] == label['segment_value'])
+        & (volume['date'] == label['date'])
+    ]
+    assert len(hits) == 1, (label.to_dict(), volume)
+    assert (hits['impact'] < 0).all() == (label['type'] == 'outage')
+print(f"✓ Детектор сегментов: {len(clean)} срабатываний на чистых данных, сбой и всплеск найдены")
+
+try:
+    apply_scenarios(df, [{'type': 'meteor'}])
+    raise AssertionError("Неизвестный тип сценария должен отклоняться")
+except ValueError:
+    pass
+print("✓ Неизвестный тип сценария отклоняется")
+
+print("\n🎉 Сценарии аномалий работают корректно!")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест значимости по ячейкам сегментов на посчитанных вручную значениях:
+интервал Вильсона, z против общей конверсии, p-value по аппроксимации erfc
+и q-value Бенджамини-Хохберга
+"""
+
+import numpy as np
+import pandas as pd
+
+from significance import benjamini_hochberg, normal_two_sided_p_value, score_cells
+
+print("Тестирование значимости конверсий...")
+print("=" * 50)
+
+# Двусторонний p-value: табличные квантили нормального распределения
+for z, p in [(0.0, 1.0), (1.644854, 0.10), (1.959964, 0.05), (2.575829, 0.01), (3.290527, 0.001)]:
+    assert np.isclose(normal_two_sided_p_value(z), p, rtol=0, atol=2e-7), (z, p)
+    assert np.isclose(normal_two_sided_p_value(-z), p, rtol=0, atol=2e-7), (-z, p)
+assert np.isclose(normal_two_sided_p_value(1.96), 0.049996, atol=1e-6)
+assert normal_two_sided_p_value(40.0) == 0.0
+print("✓ p-value: z = 1.96 -> 0.05, z = 2.576 -> 0.01, симметрия по знаку")
+
+# BH: m = 4 (NaN не входит), p·m/rank = 0.02, 0.02, 0.04, 0.04 по возрастанию p
+q = benjamini_hochberg([0.01, 0.04, 0.03, 0.005, np.nan])
+assert np.allclose(q[:4], [0.02, 0.04, 0.04, 0.02]) and np.isnan(q[4])
+# Пошаговый минимум сверху: 0.04·2/1 = 0.08 заменяется на 0.045·2/2 = 0.045
+assert np.allclose(benjamini_hochberg([0.04, 0.045]), [0.045, 0.045])
+assert np.allclose(benjamini_hochberg([[0.5, 0.9], [0.01, 0.6]]), [[0.8, 0.9], [0.04, 0.8]])
+print("✓ Бенджамини-Хохберг: ранги, пропуск NaN, монотонность")
+
+# Общая воронка: 1000 -> 250 -> 200 -> 60, конверсии 25%, 80%, 30%, 6%
+overall = {'registrations': 1000, 'deposits': 250, 'first_bets': 200, 'second_deposits': 60}
+cells = pd.DataFrame({
+    'dimension': ['country', 'country'],
+    'segment_value': ['A', 'B'],
+    'order': [1, 1],
+    'registrations': [400, 100],
+    'deposits': [120, 10],
+    'first_bets': [96, 8],
+    'second_deposits': [24, 2],
+})
+scores = score_cells(cells, overall).set_index('segment_value')
+
+# reg_to_deposit, ячейка A: 120 / 400 = 30%, SE = sqrt(0.25·0.75/400), z = 0.05 / SE = 4/sqrt(3)
+# Вильсон: z²/n = 0.009604, центр (0.3 + 0.004802) / 1.009604 = 30.19%, полуширина 4.47 п.п.
+expected = {
+    #      conv   low      high     z          p
+    'A': (30.0, 25.7167, 34.6638, 2.309401, 0.0209213),
+    'B': (10.0, 5.5229, 17.4367, -3.464102, 0.0005320),
+}
+for cell, (conv, low, high, z, p) in expected.items():
+    row = scores.loc[cell]
+    assert np.isclose(row['reg_to_deposit_conv'], conv)
+    assert np.isclose(row['reg_to_deposit_conv_low'], low, atol=1e-4)
+    assert np.isclose(row['reg_to_deposit_conv_high'], high, atol=1e-4)
+    assert np.isclose(row['reg_to_deposit_conv_z'], z, atol=1e-6)
+    assert np.isclose(row['reg_to_deposit_conv_p_value'], p, atol=2e-7)
+print("✓ reg_to_deposit: конверсия, интервал Вильсона, z и p совпадают с ручным расчетом")
+
+# Остальные конверсии: A совпадает с общей (z = 0, p = 1), у B - вторые депозиты 2/100 против 6%
+assert scores.loc['A', 'deposit_to_bet_conv_z'] == 0
+assert np.isclose(scores.loc['A', 'deposit_to_bet_conv_p_value'], 1.0, rtol=0, atol=2e-7)
+assert np.isclose(scores.loc['A', 'bet_to_second_deposit_conv_z'], -0.05 / np.sqrt(0.3 * 0.7 / 96))
+assert np.isclose(scores.loc['B', 'overall_conv_z'], -0.04 / np.sqrt(0.06 * 0.94 / 100))
+
+# q-value по всем 8 p-values (2 ячейки × 4 конверсии) в порядке возрастания:
+# 0.000532·8/1 = 0.004256, 0.020921·8/2 = 0.083685, 0.092123·8/3 = 0.245661, 0.285049·8/4 = 0.570099
+assert np.isclose(scores.loc['B', 'reg_to_deposit_conv_q_value'], 0.0042560, atol=2e-6)
+assert np.isclose(scores.loc['A', 'reg_to_deposit_conv_q_value'], 0.0836853, atol=2e-6)
+assert np.isclose(scores.loc['B', 'overall_conv_q_value'], 0.2456612, atol=2e-6)
+assert np.isclose(scores.loc['A', 'bet_to_second_deposit_conv_q_value'], 0.5700988, atol=2e-6)
+# 0.757621·8/5 > 1: q равно минимуму сверху, то есть p = 1 у совпадающих с общей конверсий
+assert np.isclose(scores.loc['B', 'bet_to_second_deposit_conv_q_value'], 1.0, rtol=0, atol=2e-7)
+significant = [
+    (cell, column) for cell in scores.index for column in scores.columns
+    if column.endswith('_significant') and scores.loc[cell, column]
+]
+assert significant == [('B', 'reg_to_deposit_conv_significant')]
+print("✓ q-value: значима только reg_to_deposit ячейки B (q = 0.0043)")
+
+# Ячейка без депозитов: у следующих конверсий нет знаменателя - z, p, q = NaN, интервал [0, 100]
+empty = cells.iloc[[1]].assign(segment_value='C', deposits=0, first_bets=0, second_deposits=0)
+row = score_cells(empty, overall).iloc[0]
+assert np.isnan(row['deposit_to_bet_conv_z']) and np.isnan(row['deposit_to_bet_conv_q_value'])
+assert row['deposit_to_bet_conv_low'] == 0 and row['deposit_to_bet_conv_high'] == 100
+assert not row['deposit_to_bet_conv_significant']
+assert np.isclose(row['reg_to_deposit_conv_z'], -0.25 / np.sqrt(0.25 * 0.75 / 100))
+print("✓ Ячейка без знаменателя: z, p и q не определены, интервал [0, 100]")
+
+print("\n🎉 Значимость конверсий считается корректно!")
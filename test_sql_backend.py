@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест SQL-бэкенда: результаты должны совпадать с pandas-версией FunnelAnalyzer
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from comparison import compare_datasets
+from generate_mock_data import generate_mock_data
+from sql_backend import SQLFunnelAnalyzer, load_csv_to_database
+from utils import FunnelAnalyzer, detect_anomalies, calculate_cohort_analysis
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+df = generate_mock_data(3000)
+filters = {'country': ['RU', 'UA', 'DE'], 'device': ['mobile', 'desktop']}
+filtered_df = df[df['country'].isin(filters['country']) & df['device'].isin(filters['device'])]
+days = df['registration_time'].dt.normalize().sort_values().unique()
+# Диапазоны дат: обе границы включительно, одна открытая граница, вместе с сегментами
+date_ranges = [
+    {'registration_date': (days[5], days[12])},
+    {'registration_date': (None, days[3].strftime('%Y-%m-%d'))},
+    dict(filters, registration_date=(days[-10], None)),
+]
+
+print("Тестирование SQL-бэкенда...")
+print("=" * 50)
+
+
+def check_date_ranges(analyzer, sql_analyzer):
+    """Фильтр по диапазону дат регистрации дает те же результаты, что и FunnelAnalyzer"""
+    for selection in date_ranges:
+        expected = analyzer.calculate_funnel_metrics(selection)
+        actual = sql_analyzer.calculate_funnel_metrics(selection, approximate=True)
+        assert expected['counts'] == actual['counts'], selection
+        for key, value in expected['avg_times_hours'].items():
+            assert np.isclose(value, actual['avg_times_hours'][key], atol=1e-3), (selection, key)
+
+        expected_segments = analyzer.analyze_by_segments(selection)
+        actual_segments = sql_analyzer.analyze_by_segments(selection, approximate=True)
+        for segment, expected_table in expected_segments.items():
+            expected_table = expected_table.sort_values('segment_value').reset_index(drop=True)
+            pd.testing.assert_frame_equal(expected_table, actual_segments[segment], check_dtype=False)
+
+        pd.testing.assert_frame_equal(
+            analyzer.calculate_daily_metrics(selection),
+            sql_analyzer.calculate_daily_metrics(selection),
+            check_dtype=False
+        )
+        pd.testing.assert_frame_equal(
+            analyzer.calculate_cohort_analysis(selection).sort_values(['cohort', 'period']).reset_index(drop=True),
+            sql_analyzer.calculate_cohort_analysis(selection),
+            check_dtype=False
+        )
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    csv_path = os.path.join(tmp_dir, 'users.csv')
+    db_path = os.path.join(tmp_dir, 'users.sqlite')
+    df.to_csv(csv_path, index=False)
+    load_csv_to_database(csv_path, db_path, chunksize=1000)
+
+    analyzer = FunnelAnalyzer(df)
+    sql_analyzer = SQLFunnelAnalyzer(db_path)
+
+    for expected_df, sql_filters in [(df, None), (filtered_df, filters)]:
+        expected = analyzer.calculate_funnel_metrics(expected_df)
+        actual = sql_analyzer.calculate_funnel_metrics(sql_filters)
+        assert expected['counts'] == actual['counts']
+        for group in ['conversions', 'avg_times_hours']:
+            for key, value in expected[group].items():
+                assert np.isclose(value, actual[group][key], atol=1e-3), (group, key)
+
+        expected_segments = analyzer.analyze_by_segments(expected_df)
+        actual_segments = sql_analyzer.analyze_by_segments(sql_filters)
+        for segment, expected_table in expected_segments.items():
+            expected_table = expected_table.sort_values('segment_value').reset_index(drop=True)
+            pd.testing.assert_frame_equal(expected_table, actual_segments[segment], check_dtype=False)
+
+        pd.testing.assert_frame_equal(
+            analyzer.calculate_daily_metrics(expected_df),
+            sql_analyzer.calculate_daily_metrics(sql_filters),
+            check_dtype=False
+        )
+        assert detect_anomalies(expected_df) == sql_analyzer.detect_anomalies(filters=sql_filters)
+
+        expected_cohorts = calculate_cohort_analysis(expected_df)
+        expected_cohorts = expected_cohorts.sort_values(['cohort', 'period']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            expected_cohorts,
+            sql_analyzer.calculate_cohort_analysis(sql_filters),
+            check_dtype=False
+        )
+
+    # Календарные сводки и сравнение периодов - по дневной агрегации из БД
+    for sql_filters, expected_selection in [(None, None), (filters, filters)]:
+        expected_rollups = analyzer.calculate_calendar_rollups(expected_selection)
+        actual_rollups = sql_analyzer.calculate_calendar_rollups(sql_filters)
+        for period, table in expected_rollups.items():
+            pd.testing.assert_frame_equal(table, actual_rollups[period], check_dtype=False)
+        for period, mode in [('week', 'previous'), ('day', 'same_weekday')]:
+            pd.testing.assert_frame_equal(
+                analyzer.compare_periods(period, mode, expected_selection),
+                sql_analyzer.compare_periods(period, mode, sql_filters),
+                check_dtype=False
+            )
+        assert (analyzer.detect_period_anomalies(df=expected_selection) ==
+                sql_analyzer.detect_period_anomalies(df=sql_filters))
+
+    check_date_ranges(analyzer, sql_analyzer)
+    print("✓ SQLite: сегменты и диапазоны дат регистрации")
+
+    # Обзор - по счетчикам страт из БД, кешируется как и у FunnelAnalyzer
+    expected_overview = analyzer.calculate_overview()
+    actual_overview = sql_analyzer.calculate_overview()
+    assert actual_overview is sql_analyzer.calculate_overview()
+    for key, value in expected_overview.items():
+        if isinstance(value, pd.Series):
+            pd.testing.assert_series_equal(value.sort_index(), actual_overview[key].sort_index())
+        else:
+            assert value == actual_overview[key], key
+
+    # A/B сравнение с набором из БД: без построчных данных время до конверсии не сравнивается
+    comparison = compare_datasets(analyzer, sql_analyzer)
+    assert comparison['time_to_convert'] is None
+    for table in [comparison['funnel']['conversions'], comparison['segments'], comparison['daily']]:
+        assert np.allclose(table['delta_pp'].dropna(), 0) and not table['significant'].any()
+
+    # PDF отчет строится из тех же структур
+    buffer = sql_analyzer.generate_pdf_report(filters, title="SQL backend")
+    assert buffer.getvalue().startswith(b'%PDF')
+    sql_analyzer.close()
+
+    # DuckDB: те же запросы в другом диалекте (если пакет установлен)
+    if duckdb is not None:
+        duckdb_path = os.path.join(tmp_dir, 'users.duckdb')
+        load_csv_to_database(csv_path, duckdb_path)
+        duckdb_analyzer = SQLFunnelAnalyzer(duckdb_path)
+        assert duckdb_analyzer.dialect == 'duckdb'
+        for selection in [None, filters]:
+            assert duckdb_analyzer.calculate_funnel_metrics(selection)['counts'] == \
+                analyzer.calculate_funnel_metrics(selection)['counts']
+        check_date_ranges(analyzer, duckdb_analyzer)
+        duckdb_analyzer.close()
+        print("✓ DuckDB: сегменты и диапазоны дат регистрации")
+    else:
+        print("⚠ duckdb не установлен, проверка DuckDB пропущена")
+
+print("\n🎉 Результаты SQL-бэкенда совпадают с pandas!")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тест рабочего пространства: сохраненный набор загружается с теми же
+результатами, бюджет вытесняет давно не открывавшиеся наборы, повторное
+и параллельное сохранение не падают, остатки прерванной записи удаляются
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from generate_mock_data import generate_mock_data
+from utils import FunnelAnalyzer
+from workspace import STALE_STAGING_SECONDS, Workspace, hash_dataframe
+
+
+class LateWorkspace(Workspace):
+    """Сессия, которая проверила наличие набора до того, как его сохранила другая"""
+
+    checked = False
+
+    def __contains__(self, key):
+        first, self.checked = not self.checked, True
+        return not first and super().__contains__(key)
+
+
+print("Тестирование рабочего пространства...")
+print("=" * 50)
+
+frames = [generate_mock_data(800 + 100 * i) for i in range(3)]
+analyzers = [FunnelAnalyzer(df) for df in frames]
+keys = [hash_dataframe(df) for df in frames]
+filters = {'country': ['RU'], 'registration_date': ('2024-01-10', '2024-02-10')}
+
+with tempfile.TemporaryDirectory() as root:
+    workspace = Workspace(root)
+
+    # Сохранение и загрузка: те же данные, индекс дат и результаты
+    workspace.save(keys[0], analyzers[0], 'first.csv')
+    assert keys[0] in workspace
+    loaded = workspace.load(keys[0])
+    original = analyzers[0]
+    pd.testing.assert_frame_equal(
+        loaded.df.reset_index(drop=True),
+        original.df[loaded.df.columns].reset_index(drop=True)
+    )
+    assert np.array_equal(loaded.registration_times, original.registration_times)
+    assert loaded.calculate_funnel_metrics(filters) == original.calculate_funnel_metrics(filters)
+    pd.testing.assert_frame_equal(loaded.calculate_strata_counts(), original.calculate_strata_counts())
+    entry = workspace.list()[0]
+    assert entry['name'] == 'first.csv' and entry['rows'] == len(frames[0])
+    print(f"✓ Сохранение и загрузка: {entry['rows']} строк, {entry['size_bytes']} байт")
+
+    # Повторное сохранение только отмечает открытие
+    before = entry['last_access']
+    time.sleep(0.01)
+    workspace.save(keys[0], analyzers[0], 'first.csv')
+    assert workspace.list()[0]['last_access'] > before
+
+    # Параллельная сессия: каталог набора появился между проверкой и переименованием
+    late_session = LateWorkspace(root)
+    late_session.save(keys[0], analyzers[0], 'first.csv')
+    assert [entry['key'] for entry in workspace.list()] == [keys[0]]
+    assert not [name for name in os.listdir(root) if name.startswith('.')]
+    print("✓ Повторное и параллельное сохранение не создают копий и не падают")
+
+    # Бюджет на два набора: вытесняется тот, что дольше не открывался
+    size = workspace.list()[0]['size_bytes']
+    workspace.save(keys[1], analyzers[1], 'second.csv')
+    time.sleep(0.01)
+    workspace.touch(keys[0])
+    time.sleep(0.01)
+    small = Workspace(root, budget_mb=(2.5 * size) / (1024 * 1024))
+    small.save(keys[2], analyzers[2], 'third.csv')
+    assert keys[1] not in small
+    assert keys[0] in small and keys[2] in small
+    assert small.usage_bytes() <= small.budget_bytes
+    print("✓ LRU: при превышении бюджета удален давно не открывавшийся набор")
+
+    # Остатки прерванной записи: временный каталог и каталог набора без meta.json
+    stale_staging = os.path.join(root, f'.{keys[1]}-crashed')
+    os.makedirs(stale_staging)
+    fresh_staging = os.path.join(root, f'.{keys[1]}-writing')
+    os.makedirs(fresh_staging)
+    broken = os.path.join(root, keys[1])
+    os.makedirs(broken)
+    open(os.path.join(broken, 'data.arrow'), 'wb').close()
+    old = time.time() - 2 * STALE_STAGING_SECONDS
+    os.utime(stale_staging, (old, old))
+
+    workspace.save(keys[1], analyzers[1], 'second.csv')
+    assert keys[1] in workspace
+    assert workspace.load(keys[1]).calculate_funnel_metrics() == analyzers[1].calculate_funnel_metrics()
+    assert not os.path.exists(stale_staging)
+    assert os.path.exists(fresh_staging)  # Возможно, пишется другой сессией прямо сейчас
+    print("✓ Каталог без meta.json заменен, брошенный временный каталог удален")
+
+print("\n🎉 Рабочее пространство работает корректно!")
@@ -13,7 +13,21 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
 import tempfile
-import os
+
+from engines import (get_engine, PandasEngine, DATE_COLUMNS, SEGMENT_COLUMNS,
+                     DATE_RANGE_FILTER, STAGE_TRANSITIONS, _hours_between)
+from export import EXPORT_CHUNK_ROWS
+from survival import survival_curves
+from rollups import calendar_rollups, compare_periods, find_period_anomalies
+from windows import REPORT_WINDOWS, window_conversion
+from cohorts import COHORT_HORIZON_DAYS, cohort_cube, cohort_triangle
+from comparison import compare_profile
+from quality import check_data_quality
+from significance import segment_significance, segment_crosstab, crosstab_matrix
+from segment_anomalies import Z_THRESHOLD, find_segment_anomalies
+from sampling import APPROX_SAMPLE_SIZE, approximate_funnel_metrics, approximate_segment_metrics
+
+OVERVIEW_DISTRIBUTIONS = ['traffic_source', 'country']  # Распределения на вкладке обзора
 
 def register_fonts():
     """Регистрация шрифтов с поддержкой кириллицы"""
@@ -93,103 +107,147 @@ def register_fonts():
 class FunnelAnalyzer:
     """Класс для анализа воронки конверсий в гемблинге"""
     
-    def __init__(self, df):
-        self.df = df.copy()
-        self.prepare_data()
+    def __init__(self, df, engine='pandas', quarantine=False, raw=None):
+        # Движок вычислений: 'pandas', 'polars' или экземпляр AnalysisEngine
+        self.engine = get_engine(engine)
+        self.df = df
+        # quarantine - исключить строки, не прошедшие проверку качества;
+        # raw - исходные данные до разбора дат, если df уже разобран (для отчета о неразобранных датах)
+        self.quarantine = quarantine
+        self.prepare_data(raw)
     
-    def prepare_data(self):
+    def prepare_data(self, raw=None):
         """Подготовка данных для анализа"""
-        # Преобразование дат
-        date_columns = ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
-        for col in date_columns:
-            self.df[col] = pd.to_datetime(self.df[col], errors='coerce')
-        
-        # Создание флагов для каждого этапа
-        self.df['has_registration'] = True  # Все пользователи зарегистрированы
-        self.df['has_deposit'] = self.df['deposit_time'].notna()
-        self.df['has_first_bet'] = self.df['first_bet_time'].notna()
-        self.df['has_second_deposit'] = self.df['second_deposit_time'].notna()
-        
-        # Расчет времени между этапами (в часах)
-        self.df['time_reg_to_deposit'] = (
-            self.df['deposit_time'] - self.df['registration_time']
-        ).dt.total_seconds() / 3600
-        
-        self.df['time_deposit_to_bet'] = (
-            self.df['first_bet_time'] - self.df['deposit_time']
-        ).dt.total_seconds() / 3600
-        
-        self.df['time_bet_to_second_deposit'] = (
-            self.df['second_deposit_time'] - self.df['first_bet_time']
-        ).dt.total_seconds() / 3600
-    
-    def calculate_funnel_metrics(self, df=None):
-        """Расчет основных метрик воронки"""
+        self.data = self.engine.prepare(self.df)
+        self._reset_caches()
+        
+        # Проверка качества - до сортировки, пока строки в порядке исходных данных
+        prepared = self.data if isinstance(self.data, pd.DataFrame) else self.df
+        self.quality = check_data_quality(prepared, raw=raw if raw is not None else self.df)
+        if self.quarantine and self.quality['quarantine'].any():
+            keep = ~self.quality['quarantine'].to_numpy()
+            self.data = self.engine.filter_rows(self.data, keep)
+            if not isinstance(self.data, pd.DataFrame):
+                # Исходный DataFrame других движков тоже без карантина (выгрузка, рабочее пространство)
+                self.df = self.df[keep]
+        
+        # Порядок по дате регистрации строится один раз: диапазон дат -
+        # два бинарных поиска и непрерывный срез
+        self.data, self.registration_times = self.engine.sort_by_registration(self.data)
+        
+        # В pandas-движке подготовленные данные доступны как self.df
+        if isinstance(self.data, pd.DataFrame):
+            self.df = self.data
+    
+    @classmethod
+    def from_prepared(cls, df, registration_times, engine='pandas', aggregates=None):
+        """
+        Анализатор по уже подготовленным данным без повторного разбора и сортировки
+        
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            Типизированные данные, упорядоченные по registration_time
+        registration_times : np.ndarray
+            Отсортированные непустые даты регистрации (datetime64[ns])
+        aggregates : dict, optional
+            Готовые агрегаты по всему набору ('strata_counts', 'daily_strata_counts')
+        """
+        analyzer = cls.__new__(cls)
+        analyzer.engine = get_engine(engine)
+        analyzer.df = df
+        analyzer.data = analyzer.engine.prepare(df)
+        analyzer.registration_times = registration_times
+        analyzer._reset_caches()
+        analyzer._aggregates.update(aggregates or {})
+        analyzer.quarantine = False
+        analyzer.quality = check_data_quality(df)
+        if isinstance(analyzer.data, pd.DataFrame):
+            analyzer.df = analyzer.data
+        return analyzer
+    
+    def _reset_caches(self):
+        """
+        Сброс кешей по всему набору (выборка приближенного режима, агрегаты, графики)
+        
+        Вызывается при подготовке данных и наследниками, которые не вызывают
+        FunnelAnalyzer.__init__, - а также каждый раз, когда их данные меняются
+        """
+        self._sample = None
+        self._aggregates = {}
+    
+    def _whole_dataset_aggregate(self, name, df, compute):
+        """Агрегат по всему набору считается один раз, для срезов и фильтров - каждый раз"""
+        if df is not None:
+            return compute(self._resolve_data(df))
+        if name not in self._aggregates:
+            self._aggregates[name] = compute(self.data)
+        return self._aggregates[name]
+    
+    def _range_bounds(self, start=None, end=None):
+        """Границы строк [начало, конец) для дат регистрации от start до end включительно"""
+        times = self.registration_times
+        lo = 0 if start is None else np.searchsorted(
+            times, pd.Timestamp(start).normalize().to_datetime64(), side='left'
+        )
+        hi = len(times) if end is None else np.searchsorted(
+            times, (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_datetime64(), side='left'
+        )
+        return int(lo), int(max(hi, lo))
+    
+    def select_registration_range(self, start=None, end=None):
+        """Пользователи с датой регистрации от start до end включительно (срез без маски)"""
+        return self.engine.slice_rows(self.data, *self._range_bounds(start, end))
+    
+    def _resolve_data(self, df):
+        """
+        Данные для расчета: весь набор (None), фильтры по сегментам (dict,
+        может содержать диапазон дат 'registration_date': (начало, конец))
+        или внешний pandas DataFrame
+        """
         if df is None:
-            df = self.df
-        else:
-            # Если передан другой DataFrame, подготовим его
-            df = df.copy()
-            # Преобразование дат
-            date_columns = ['registration_time', 'deposit_time', 'first_bet_time', 'second_deposit_time']
-            for col in date_columns:
-                if col in df.columns:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            
-            # Создание флагов для каждого этапа
-            df['has_deposit'] = df['deposit_time'].notna()
-            df['has_first_bet'] = df['first_bet_time'].notna()
-            df['has_second_deposit'] = df['second_deposit_time'].notna()
-            
-            # Расчет времени между этапами (в часах)
-            df['time_reg_to_deposit'] = (
-                df['deposit_time'] - df['registration_time']
-            ).dt.total_seconds() / 3600
-            
-            df['time_deposit_to_bet'] = (
-                df['first_bet_time'] - df['deposit_time']
-            ).dt.total_seconds() / 3600
-            
-            df['time_bet_to_second_deposit'] = (
-                df['second_deposit_time'] - df['first_bet_time']
-            ).dt.total_seconds() / 3600
-        
-        # Количество пользователей на каждом этапе
-        registrations = len(df)
-        deposits = len(df[df['has_deposit']])
-        first_bets = len(df[df['has_first_bet']])
-        second_deposits = len(df[df['has_second_deposit']])
-        
-        # Конверсии между этапами
-        reg_to_deposit = (deposits / registrations * 100) if registrations > 0 else 0
-        deposit_to_bet = (first_bets / deposits * 100) if deposits > 0 else 0
-        bet_to_second_deposit = (second_deposits / first_bets * 100) if first_bets > 0 else 0
-        overall_conversion = (second_deposits / registrations * 100) if registrations > 0 else 0
-        
-        # Среднее время между этапами
-        avg_time_reg_to_deposit = df['time_reg_to_deposit'].mean()
-        avg_time_deposit_to_bet = df['time_deposit_to_bet'].mean()
-        avg_time_bet_to_second_deposit = df['time_bet_to_second_deposit'].mean()
-        
-        return {
-            'counts': {
-                'registrations': registrations,
-                'deposits': deposits,
-                'first_bets': first_bets,
-                'second_deposits': second_deposits
-            },
-            'conversions': {
-                'reg_to_deposit': reg_to_deposit,
-                'deposit_to_bet': deposit_to_bet,
-                'bet_to_second_deposit': bet_to_second_deposit,
-                'overall_conversion': overall_conversion
-            },
-            'avg_times_hours': {
-                'reg_to_deposit': avg_time_reg_to_deposit,
-                'deposit_to_bet': avg_time_deposit_to_bet,
-                'bet_to_second_deposit': avg_time_bet_to_second_deposit
-            }
-        }
+            return self.data
+        if isinstance(df, dict):
+            filters = dict(df)
+            date_range = filters.pop(DATE_RANGE_FILTER, None)
+            data = self.select_registration_range(*date_range) if date_range else self.data
+            return self.engine.select(data, filters) if filters else data
+        return self.engine.wrap(df)
+    
+    def get_sample(self, sample_size=APPROX_SAMPLE_SIZE):
+        """Стратифицированная выборка для приближенного режима (строится один раз)"""
+        if self._sample is None or self._sample[0] != sample_size:
+            self._sample = (sample_size, self.engine.sample(self.data, sample_size))
+        return self._sample[1]
+    
+    def _resolve_sample(self, df):
+        """Выборка для приближенного расчета: общая (с фильтрами) или по внешнему DataFrame"""
+        if df is None or isinstance(df, dict):
+            sample = self.get_sample()
+            filters = dict(df or {})
+            date_range = filters.pop(DATE_RANGE_FILTER, None)
+            if date_range:
+                start, end = date_range
+                times = sample['registration_time']
+                in_range = times.notna()
+                if start is not None:
+                    in_range &= times >= pd.Timestamp(start).normalize()
+                if end is not None:
+                    in_range &= times < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+                sample = sample[in_range]
+            return PandasEngine().select(sample, filters) if filters else sample
+        return PandasEngine().sample(df, APPROX_SAMPLE_SIZE)
+    
+    def calculate_funnel_metrics(self, df=None, approximate=False):
+        """
+        Расчет основных метрик воронки
+        
+        approximate=True - быстрая оценка по стратифицированной выборке
+        с доверительными интервалами конверсий (ключ 'intervals')
+        """
+        if approximate:
+            return approximate_funnel_metrics(self._resolve_sample(df))
+        return self.engine.funnel_metrics(self._resolve_data(df))
     
     def create_funnel_chart(self, metrics):
         """Создание графика воронки"""
@@ -270,62 +328,214 @@ class FunnelAnalyzer:
         
         return fig
     
-    def analyze_by_segments(self, df=None):
-        """Анализ по сегментам"""
-        if df is None:
-            df = self.df
-        
-        segments = ['traffic_source', 'country', 'device']
-        results = {}
-        
-        for segment in segments:
-            segment_analysis = []
-            
-            for segment_value in df[segment].unique():
-                if pd.isna(segment_value):
-                    continue
-                    
-                segment_df = df[df[segment] == segment_value]
-                metrics = self.calculate_funnel_metrics(segment_df)
-                
-                segment_analysis.append({
-                    'segment_value': segment_value,
-                    'users': len(segment_df),
-                    'reg_to_deposit_conv': metrics['conversions']['reg_to_deposit'],
-                    'deposit_to_bet_conv': metrics['conversions']['deposit_to_bet'],
-                    'bet_to_second_deposit_conv': metrics['conversions']['bet_to_second_deposit'],
-                    'overall_conv': metrics['conversions']['overall_conversion']
-                })
-            
-            results[segment] = pd.DataFrame(segment_analysis)
-        
-        return results
+    def analyze_by_segments(self, df=None, approximate=False):
+        """
+        Анализ по сегментам
+        
+        approximate=True - оценка по выборке со столбцами интервалов *_low / *_high
+        """
+        if approximate:
+            return approximate_segment_metrics(self._resolve_sample(df))
+        return self.engine.segment_metrics(self._resolve_data(df))
+    
+    def calculate_strata_counts(self, df=None):
+        """Счетчики этапов по комбинациям всех сегментов"""
+        return self._whole_dataset_aggregate('strata_counts', df, self.engine.strata_counts)
+    
+    def calculate_overview(self, df=None):
+        """
+        Сводка для обзора данных: пользователи по этапам и распределения
+        по источникам трафика и странам (см. overview_from_strata)
+        
+        Считается по счетчикам страт; для всего набора - один раз
+        """
+        if df is not None:
+            return overview_from_strata(self.calculate_strata_counts(df))
+        if 'overview' not in self._aggregates:
+            self._aggregates['overview'] = overview_from_strata(self.calculate_strata_counts())
+        return self._aggregates['overview']
+    
+    def create_overview_charts(self, overview=None):
+        """
+        Графики распределений обзора: круговая по источникам трафика и столбцы по странам
+        
+        Для всего набора (overview=None) графики строятся один раз и хранятся
+        вместе с агрегатами: повторный вывод не пересобирает фигуры plotly express
+        
+        Returns:
+        --------
+        dict
+            'traffic_source', 'country' -> go.Figure
+        """
+        if overview is None and 'overview_charts' in self._aggregates:
+            return self._aggregates['overview_charts']
+        
+        data = self.calculate_overview() if overview is None else overview
+        traffic = data['traffic_source']
+        country = data['country']
+        charts = {
+            'traffic_source': px.pie(values=traffic.values, names=traffic.index, title="Источники трафика"),
+            'country': px.bar(x=country.index, y=country.values, title="Страны")
+        }
+        if overview is None:
+            self._aggregates['overview_charts'] = charts
+        return charts
+    
+    def analyze_segment_significance(self, df=None, max_order=2):
+        """
+        Доверительные интервалы и значимость отличия от общей конверсии
+        для всех значений сегментов и их комбинаций до max_order сегментов
+        """
+        return segment_significance(self.calculate_strata_counts(df), max_order=max_order)
+    
+    def analyze_segment_crosstab(self, rows='traffic_source', columns='country', df=None):
+        """
+        Перекрестный анализ пары сегментов (например, traffic_source × country)
+        
+        Все ячейки - из одной группировки счетчиков страт, без перебора фильтров;
+        пустые комбинации в результат не попадают (см. significance.segment_crosstab)
+        """
+        return segment_crosstab(self.calculate_strata_counts(df), rows, columns)
+    
+    def calculate_daily_strata_counts(self, df=None):
+        """Счетчики этапов по дням и комбинациям всех сегментов"""
+        return self._whole_dataset_aggregate('daily_strata_counts', df, self.engine.daily_strata_counts)
+    
+    def detect_segment_anomalies(self, df=None, max_order=2, z_threshold=Z_THRESHOLD):
+        """
+        Детекция аномалий конверсии и регистраций по всем сегментам
+        и их комбинациям до max_order сегментов, с ранжированием по влиянию
+        """
+        return find_segment_anomalies(
+            self.calculate_daily_strata_counts(df), max_order=max_order, z_threshold=z_threshold
+        )
     
     def calculate_daily_metrics(self, df=None):
         """Расчет ежедневных метрик"""
-        if df is None:
-            df = self.df
-        
-        # Группировка по дням регистрации
-        df['reg_date'] = df['registration_time'].dt.date
-        daily_stats = []
-        
-        for date in df['reg_date'].unique():
-            if pd.isna(date):
-                continue
-                
-            day_df = df[df['reg_date'] == date]
-            metrics = self.calculate_funnel_metrics(day_df)
-            
-            daily_stats.append({
-                'date': date,
-                'registrations': metrics['counts']['registrations'],
-                'deposits': metrics['counts']['deposits'],
-                'reg_to_deposit_conv': metrics['conversions']['reg_to_deposit'],
-                'overall_conv': metrics['conversions']['overall_conversion']
+        return self.engine.daily_metrics(self._resolve_data(df))
+    
+    def detect_anomalies(self, threshold=0.5, df=None):
+        """Детекция аномалий в воронке конверсий"""
+        return self.engine.detect_anomalies(self._resolve_data(df), threshold)
+    
+    def calculate_calendar_rollups(self, df=None):
+        """
+        Сводки по дням, неделям и месяцам из дневной агрегации (см. rollups.calendar_rollups)
+        
+        Агрегация берется из calculate_daily_strata_counts, поэтому SQL- и
+        агрегатные анализаторы строят сводки по своим запросам и агрегатам,
+        без строк в pandas. Для всего набора строятся один раз
+        """
+        if df is not None:
+            return calendar_rollups(self.calculate_daily_strata_counts(df))
+        if 'calendar_rollups' not in self._aggregates:
+            self._aggregates['calendar_rollups'] = calendar_rollups(self.calculate_daily_strata_counts())
+        return self._aggregates['calendar_rollups']
+    
+    def compare_periods(self, period='day', mode='previous', df=None):
+        """
+        Сравнение периодов: 'previous' - с предыдущим днем, неделей или месяцем,
+        'same_weekday' - день с тем же днем недели неделей раньше
+        """
+        return compare_periods(self.calculate_calendar_rollups(df), period, mode)
+    
+    def detect_period_anomalies(self, threshold=0.5, period='day', mode='previous', df=None):
+        """Резкие изменения конверсии и регистраций относительно периода сравнения"""
+        return find_period_anomalies(self.compare_periods(period, mode, df), threshold)
+    
+    def calculate_cohort_analysis(self, df=None):
+        """Когортный анализ"""
+        return self.engine.cohort_analysis(self._resolve_data(df))
+    
+    def calculate_cohort_cube(self, horizon=COHORT_HORIZON_DAYS, df=None):
+        """
+        Куб когорт по дням: (значение сегмента, день регистрации, смещение) -> пользователи
+        по этапам (см. cohorts.cohort_cube); для всего набора строится один раз
+        """
+        if self.df is None:
+            raise ValueError("Когорты по дням недоступны: анализатор хранит только агрегаты")
+        
+        if df is not None:
+            return cohort_cube(self.engine.stage_days(self._resolve_data(df)), horizon=horizon)
+        name = f'cohort_cube_{horizon}'
+        if name not in self._aggregates:
+            self._aggregates[name] = cohort_cube(self.engine.stage_days(self.data), horizon=horizon)
+        return self._aggregates[name]
+    
+    def calculate_cohort_triangle(self, stage='deposits', period='day', dimension='all', value='all',
+                                  cumulative=True, horizon=COHORT_HORIZON_DAYS, df=None):
+        """
+        Когортный треугольник по дням или неделям: доля когорты, дошедшей до этапа
+        к каждому дню (неделе) от регистрации
+        
+        Срез по значению сегмента берется из готового куба, без пересчета по строкам
+        """
+        return cohort_triangle(
+            self.calculate_cohort_cube(horizon, df), stage, period, dimension, value, cumulative
+        )
+    
+    def calculate_comparison_profile(self):
+        """
+        Профиль всего набора для A/B сравнения (см. comparison.compare_profile);
+        строится один раз, смена базового набора его не пересчитывает
+        """
+        if 'comparison_profile' not in self._aggregates:
+            self._aggregates['comparison_profile'] = compare_profile(self)
+        return self._aggregates['comparison_profile']
+    
+    def calculate_survival_curves(self, df=None):
+        """
+        Кривые Каплана-Мейера времени между этапами по всем пользователям и значениям сегментов
+        
+        Не дошедшие до следующего этапа цензурируются в момент самой поздней даты
+        всего набора, в том числе при расчете по срезу (см. survival.survival_curves)
+        """
+        if self.df is None:
+            raise ValueError("Кривые дожития недоступны: анализатор хранит только агрегаты")
+        
+        durations = self.engine.conversion_durations(self._resolve_data(df), self._observed_until())
+        return survival_curves(durations)
+    
+    def _observed_until(self):
+        """Момент наблюдения - самая поздняя дата всего набора (считается один раз)"""
+        if 'observed_until' not in self._aggregates:
+            self._aggregates['observed_until'] = self.engine.max_timestamp(self.data)
+        return self._aggregates['observed_until']
+    
+    def calculate_window_conversion(self, windows=REPORT_WINDOWS, df=None):
+        """
+        Конверсия в окне (переход не позже чем через w часов) для многих окон сразу
+        по всем переходам, пользователям и значениям сегментов
+        
+        Длительности сортируются один раз, окна считаются бинарным поиском,
+        поэтому сетка из тысячи окон (windows.window_grid) стоит как одно окно
+        """
+        if self.df is None:
+            raise ValueError("Конверсия в окне недоступна: анализатор хранит только агрегаты")
+        
+        durations = self.engine.conversion_durations(
+            self._resolve_data(df), self._observed_until(), fractional=True
+        )
+        return window_conversion(durations, windows)
+    
+    def iter_user_rows(self, df=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        """
+        Построчные данные пользователей по частям для потоковой выгрузки
+        
+        Yields:
+        -------
+        pd.DataFrame
+            user_id, даты этапов, сегменты и время между этапами в часах (time_*)
+        """
+        if self.df is None:
+            raise ValueError("Построчные данные недоступны: анализатор хранит только агрегаты")
+        
+        columns = ['user_id'] + DATE_COLUMNS + SEGMENT_COLUMNS
+        for chunk in self.engine.iter_rows(self._resolve_data(df), columns, chunk_rows):
+            yield chunk.assign(**{
+                f'time_{key}': _hours_between(chunk[start], chunk[end])
+                for key, start, end in STAGE_TRANSITIONS
             })
-        
-        return pd.DataFrame(daily_stats).sort_values('date')
     
     def generate_pdf_report(self, df, title="Funnel Conversion Analysis", author="Analyst", 
                           include_overview=True, include_funnel=True, 
@@ -387,15 +597,14 @@ class FunnelAnalyzer:
         )
         story.append(Paragraph(f"<b>Author:</b> {author}", info_style))
         story.append(Paragraph(f"<b>Created:</b> {datetime.now().strftime('%Y-%m-%d %H:%M')}", info_style))
-        story.append(Paragraph(f"<b>Total Records:</b> {len(df):,}", info_style))
+        metrics = self.calculate_funnel_metrics(df)
+        story.append(Paragraph(f"<b>Total Records:</b> {metrics['counts']['registrations']:,}", info_style))
         story.append(Spacer(1, 20))
         
         # Main metrics
         if include_funnel:
             story.append(Paragraph("Main Funnel Metrics", styles['Heading2']))
             
-            metrics = self.calculate_funnel_metrics(df)
-            
             # Metrics table
             data = [
                 ['Stage', 'Count', 'Conversion'],
@@ -435,26 +644,99 @@ class FunnelAnalyzer:
             )
             story.append(Paragraph("Segment Analysis", section_style))
             
-            segment_analysis = self.analyze_by_segments(df)
+            significance = self.analyze_segment_significance(df)
             
-            for segment_name, segment_df in segment_analysis.items():
+            for segment_name in SEGMENT_COLUMNS:
                 story.append(Paragraph(f"By {segment_name}:", styles['Heading3']))
                 
-                # Top-3 segments by conversion
-                top_segments = segment_df.nlargest(3, 'reg_to_deposit_conv')
+                # Top-3 segments by the lower bound of the conversion interval,
+                # so small segments with a lucky rate do not outrank large ones
+                segment_cells = significance[significance['dimension'] == segment_name]
+                top_segments = segment_cells.nlargest(3, 'reg_to_deposit_conv_low')
                 
                 for _, row in top_segments.iterrows():
+                    marker = " *" if row['reg_to_deposit_conv_significant'] else ""
                     story.append(Paragraph(
-                        f"• {row['segment_value']}: {row['reg_to_deposit_conv']:.1f}% ({row['users']} users)",
+                        f"• {row['segment_value']}: {row['reg_to_deposit_conv']:.1f}% "
+                        f"(95% CI {row['reg_to_deposit_conv_low']:.1f}–{row['reg_to_deposit_conv_high']:.1f}%, "
+                        f"{row['users']} users){marker}",
                         styles['Normal']
                     ))
                 
                 story.append(Spacer(1, 12))
+            
+            # Two-way combinations that significantly differ from the overall rate
+            significant_pairs = significance[
+                (significance['order'] == 2) & significance['reg_to_deposit_conv_significant']
+            ]
+            if not significant_pairs.empty:
+                story.append(Paragraph("Significant segment combinations:", styles['Heading3']))
+                top_pairs = significant_pairs.reindex(
+                    significant_pairs['reg_to_deposit_conv_z'].abs().sort_values(ascending=False).index
+                ).head(5)
+                for _, row in top_pairs.iterrows():
+                    direction = "above" if row['reg_to_deposit_conv_z'] > 0 else "below"
+                    story.append(Paragraph(
+                        f"• {row['segment_value']}: {row['reg_to_deposit_conv']:.1f}% "
+                        f"({direction} overall, q = {row['reg_to_deposit_conv_q_value']:.3g}, {row['users']} users)",
+                        styles['Normal']
+                    ))
+                story.append(Spacer(1, 12))
+            
+            # Cross-segment heatmap: deposit conversion for every country × traffic source
+            crosstab = self.analyze_segment_crosstab('country', 'traffic_source', df)
+            if not crosstab.empty:
+                story.append(Paragraph("Deposit conversion by country × traffic source:", styles['Heading3']))
+                heatmap = crosstab_matrix(crosstab, 'reg_to_deposit_conv')
+                significant = crosstab_matrix(crosstab, 'reg_to_deposit_conv_significant').fillna(False)
+                highest = max(float(np.nanmax(heatmap.to_numpy())), 1.0)
+                
+                data = [[''] + [str(col) for col in heatmap.columns]]
+                heatmap_style = [
+                    ('FONTNAME', (0, 0), (-1, -1), font_name),
+                    ('FONTNAME', (0, 0), (-1, 0), font_bold),
+                    ('FONTNAME', (0, 0), (0, -1), font_bold),
+                    ('FONTSIZE', (0, 0), (-1, -1), 6),
+                    ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+                    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey)
+                ]
+                for i, (row_value, values) in enumerate(heatmap.iterrows(), start=1):
+                    row = [str(row_value)]
+                    for j, value in enumerate(values, start=1):
+                        if pd.isna(value):
+                            # Empty combination: no users with both values
+                            row.append('–')
+                            heatmap_style.append(('BACKGROUND', (j, i), (j, i), colors.whitesmoke))
+                            continue
+                        row.append(f"{value:.0f}{'*' if significant.iat[i - 1, j - 1] else ''}")
+                        heatmap_style.append(('BACKGROUND', (j, i), (j, i), colors.linearlyInterpolatedColor(
+                            colors.white, colors.mediumseagreen, 0, highest, value
+                        )))
+                    data.append(row)
+                
+                label_width = 50
+                cell_width = (doc.width - label_width) / max(len(heatmap.columns), 1)
+                table = Table(data, colWidths=[label_width] + [cell_width] * len(heatmap.columns))
+                table.setStyle(TableStyle(heatmap_style))
+                story.append(table)
+                story.append(Paragraph(
+                    f"Conversion in %, {len(crosstab)} of {heatmap.size} combinations have users; "
+                    "– - no users, * - significantly differs from the overall rate.",
+                    styles['Normal']
+                ))
+                story.append(Spacer(1, 12))
+            
+            story.append(Paragraph(
+                "Segments are ranked by the lower bound of the 95% Wilson interval. "
+                "* - deposit conversion significantly differs from the overall rate "
+                "(Benjamini-Hochberg q < 0.05).",
+                styles['Italic']
+            ))
+            story.append(Spacer(1, 12))
         
         # Recommendations
         story.append(Paragraph("Recommendations", styles['Heading2']))
         
-        metrics = self.calculate_funnel_metrics(df)
         recommendations = []
         
         if metrics['conversions']['reg_to_deposit'] < 20:
@@ -487,93 +769,33 @@ class FunnelAnalyzer:
 
 def detect_anomalies(df, threshold=0.5):
     """Детекция аномалий в воронке конверсий"""
-    anomalies = []
-    
-    # Анализ по дням
-    df['reg_date'] = pd.to_datetime(df['registration_time']).dt.date
-    daily_stats = []
-    
-    for date in sorted(df['reg_date'].unique()):
-        if pd.isna(date):
-            continue
-            
-        day_df = df[df['reg_date'] == date]
-        
-        registrations = len(day_df)
-        deposits = len(day_df[day_df['deposit_time'].notna()])
-        
-        conv_rate = (deposits / registrations * 100) if registrations > 0 else 0
-        
-        daily_stats.append({
-            'date': date,
-            'registrations': registrations,
-            'deposits': deposits,
-            'conv_rate': conv_rate
-        })
-    
-    daily_df = pd.DataFrame(daily_stats)
-    
-    if len(daily_df) < 2:
-        return anomalies
-    
-    # Проверка резких падений конверсии
-    for i in range(1, len(daily_df)):
-        current_conv = daily_df.iloc[i]['conv_rate']
-        prev_conv = daily_df.iloc[i-1]['conv_rate']
-        
-        if prev_conv > 0:
-            change = (current_conv - prev_conv) / prev_conv
-            
-            if abs(change) > threshold:
-                direction = "упала" if change < 0 else "выросла"
-                anomalies.append(
-                    f"Конверсия в депозит {direction} на {abs(change)*100:.1f}% "
-                    f"({daily_df.iloc[i]['date']})"
-                )
-    
-    # Проверка аномально низких объемов регистраций
-    if len(daily_df) >= 7:
-        avg_registrations = daily_df['registrations'].mean()
-        std_registrations = daily_df['registrations'].std()
-        
-        for _, row in daily_df.iterrows():
-            if row['registrations'] < (avg_registrations - 2 * std_registrations):
-                anomalies.append(
-                    f"Аномально низкое количество регистраций: {row['registrations']} "
-                    f"({row['date']})"
-                )
-    
-    return anomalies
+    return PandasEngine().detect_anomalies(df, threshold)
 
 def calculate_cohort_analysis(df):
     """Когортный анализ (дополнительная функция)"""
-    # Группировка по месяцам регистрации
-    df['reg_month'] = pd.to_datetime(df['registration_time']).dt.to_period('M')
-    df['deposit_month'] = pd.to_datetime(df['deposit_time']).dt.to_period('M')
-    
-    cohorts = []
-    
-    for reg_month in df['reg_month'].unique():
-        if pd.isna(reg_month):
-            continue
-            
-        cohort_df = df[df['reg_month'] == reg_month]
-        
-        # Расчет retention по месяцам
-        for period in range(0, 6):  # 6 месяцев
-            target_month = reg_month + period
-            
-            retained_users = len(cohort_df[
-                (cohort_df['deposit_month'] == target_month) |
-                (cohort_df['deposit_month'] < target_month)
-            ])
-            
-            cohorts.append({
-                'cohort': str(reg_month),
-                'period': period,
-                'users': len(cohort_df),
-                'retained': retained_users,
-                'retention_rate': retained_users / len(cohort_df) * 100
-            })
+    return PandasEngine().cohort_analysis(df)
+
+def overview_from_strata(strata):
+    """
+    Сводка для обзора данных по счетчикам страт (без прохода по строкам)
     
-    return pd.DataFrame(cohorts)
\ No newline at end of file
+    Returns:
+    --------
+    dict
+        users, depositors, bettors, second_depositors - пользователи по этапам;
+        по каждому из OVERVIEW_DISTRIBUTIONS - pd.Series пользователей по
+        значению сегмента (по убыванию, без пустых значений, как value_counts)
+    """
+    overview = {
+        'users': int(strata['registrations'].sum()),
+        'depositors': int(strata['deposits'].sum()),
+        'bettors': int(strata['first_bets'].sum()),
+        'second_depositors': int(strata['second_deposits'].sum())
+    }
+    for segment in OVERVIEW_DISTRIBUTIONS:
+        overview[segment] = (
+            strata.groupby(segment, sort=False)['registrations'].sum()
+                .sort_values(ascending=False, kind='stable')
+                .astype(int)
+        )
+    return overview
@@ -0,0 +1,119 @@
+"""
+Конверсия в окне: доля сделавших переход не позже чем через w часов
+
+"Депозит в течение 1 ч / 24 ч / 7 дней после регистрации" для многих окон
+сразу. Длительности переходов сортируются один раз вместе с номером группы
+(значение сегмента): ключ = группа * span + часы, где span больше любой
+длительности и окна. Тогда число конверсий группы в окне w - это
+searchsorted(ключи, группа * span + w) минус начало группы, и вся сетка
+группы × окна считается одним вызовом searchsorted. Кривая из 1000 окон
+стоит почти столько же, сколько одно окно: основная работа - сортировка.
+
+Знаменатель - все дошедшие до начального этапа перехода. Свежие
+пользователи еще могли не прожить все окно; с учетом этого время до
+конверсии оценивают кривые Каплана-Мейера (survival.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+from engines import SEGMENT_COLUMNS, STAGE_TRANSITIONS
+from segment_anomalies import OVERALL_DIMENSION
+
+REPORT_WINDOWS = [1, 24, 168]  # Окна в часах для сводки: 1 ч, 24 ч, 7 дней
+SWEEP_MAX_HOURS = 720  # Сетка окон по умолчанию: до 30 дней
+SWEEP_POINTS = 1000
+WINDOW_COLUMNS = ['transition', 'dimension', 'segment_value', 'window_hours',
+                  'started', 'converted', 'conversion']
+
+
+def window_grid(max_hours=SWEEP_MAX_HOURS, points=SWEEP_POINTS):
+    """Равномерная сетка окон от 0 до max_hours часов"""
+    return np.linspace(0, max_hours, points)
+
+
+def windowed_counts(hours, converted, groups, n_groups, windows):
+    """
+    Число конверсий в каждом окне для каждой группы одной сортировкой
+
+    Parameters:
+    -----------
+    hours : np.ndarray
+        Длительности перехода в часах (дробные, неотрицательные)
+    converted : np.ndarray
+        bool: переход сделан
+    groups : np.ndarray
+        Номер группы от 0 до n_groups - 1
+    windows : np.ndarray
+        Окна в часах
+
+    Returns:
+    --------
+    tuple
+        (started - дошедших до начального этапа по группам,
+         matrix - конверсий в окне, группы × окна)
+    """
+    windows = np.asarray(windows, dtype=float)
+    started = np.bincount(groups, minlength=n_groups)
+
+    event_hours = hours[converted]
+    event_groups = groups[converted]
+    span = max(event_hours.max() if len(event_hours) else 0.0, windows.max() if len(windows) else 0.0) + 1.0
+    keys = np.sort(event_groups * span + event_hours)
+
+    # Начало каждой группы в отсортированных ключах и запросы группа × окно
+    group_offsets = np.arange(n_groups) * span
+    first = np.searchsorted(keys, group_offsets, side='left')
+    ends = np.searchsorted(keys, group_offsets[:, None] + windows[None, :], side='right')
+    return started, ends - first[:, None]
+
+
+def window_conversion(durations, windows=REPORT_WINDOWS, segments=SEGMENT_COLUMNS,
+                      transitions=STAGE_TRANSITIONS):
+    """
+    Конверсия в окне по переходам для всех пользователей и каждого значения сегментов
+
+    Parameters:
+    -----------
+    durations : pd.DataFrame
+        Результат engine.conversion_durations(..., fractional=True)
+    windows : list или np.ndarray
+        Окна в часах
+
+    Returns:
+    --------
+    pd.DataFrame
+        transition, dimension ('all' или сегмент), segment_value, window_hours,
+        started (дошли до начального этапа), converted (сделали переход за
+        window_hours часов), conversion (%)
+    """
+    windows = np.asarray(windows, dtype=float)
+    frames = []
+    for key, _, _ in transitions:
+        hours = durations[f'hours_{key}'].to_numpy(dtype=float)
+        started = ~np.isnan(hours)
+        if not started.any():
+            continue
+        hours = hours[started]
+        converted = durations[f'event_{key}'].to_numpy(dtype=bool)[started]
+
+        dimensions = [(OVERALL_DIMENSION, np.zeros(len(hours), dtype=np.int64), [OVERALL_DIMENSION])]
+        for segment in segments:
+            codes, values = pd.factorize(durations[segment][started], use_na_sentinel=False)
+            dimensions.append((segment, codes, [str(value) for value in values]))
+
+        for dimension, codes, values in dimensions:
+            counts, matrix = windowed_counts(hours, converted, codes, len(values), windows)
+            frames.append(pd.DataFrame({
+                'transition': key,
+                'dimension': dimension,
+                'segment_value': np.repeat(np.asarray(values, dtype=object), len(windows)),
+                'window_hours': np.tile(windows, len(values)),
+                'started': np.repeat(counts, len(windows)),
+                'converted': matrix.ravel(),
+                'conversion': (matrix / counts[:, None]).ravel() * 100
+            }))
+
+    if not frames:
+        return pd.DataFrame(columns=WINDOW_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
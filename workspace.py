@@ -0,0 +1,253 @@
+"""
+Рабочее пространство: сохраненные подготовленные наборы данных
+
+Подготовленное состояние анализатора (типизированные столбцы, упорядоченные
+по registration_time, индекс дат регистрации и агрегаты по всему набору)
+сохраняется на диск под ключом - хешем содержимого исходных данных. При
+повторном открытии столбцы читаются из несжатого Arrow IPC файла в pandas
+(одно копирование в память без разбора), а индекс дат регистрации
+отображается в память (np.load с mmap_mode). Разбор, сортировка и агрегация
+не повторяются ни в новой сессии Streamlit, ни после перезапуска сервера.
+
+Данные в память не отображаются: столбцы дат содержат пропуски, а сегменты -
+строки, и to_pandas в любом случае строит для них новые массивы.
+
+Объем на диске ограничен бюджетом: при превышении удаляются наборы,
+которые дольше всего не открывались (LRU). Набор пишется во временный
+каталог вместе с meta.json и появляется одним переименованием; каталоги,
+оставшиеся от прерванной записи, удаляются при следующих сохранениях.
+
+Каталог и бюджет задаются параметрами Workspace или переменными окружения
+FUNNEL_WORKSPACE_DIR и FUNNEL_WORKSPACE_BUDGET_MB.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+    ipc = None
+
+from engines import PandasEngine
+from utils import FunnelAnalyzer
+
+WORKSPACE_DIR = os.environ.get(
+    'FUNNEL_WORKSPACE_DIR', os.path.join(os.path.expanduser('~'), '.funnel_workspace')
+)
+WORKSPACE_BUDGET_MB = int(os.environ.get('FUNNEL_WORKSPACE_BUDGET_MB', 2048))
+
+AGGREGATE_NAMES = ['strata_counts', 'daily_strata_counts']
+STALE_STAGING_SECONDS = 3600  # Каталоги без meta.json старше этого считаются брошенными
+
+
+def hash_bytes(content):
+    """Ключ набора данных по содержимому исходного файла"""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def hash_dataframe(df):
+    """Ключ набора данных по содержимому DataFrame (значения и названия столбцов)"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('|'.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _write_arrow(df, path):
+    """DataFrame в несжатый Arrow IPC файл (пригоден для отображения в память)"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_arrow(path):
+    """Arrow IPC файл как pandas DataFrame (столбцы копируются в память pandas, файл закрывается)"""
+    with pa.memory_map(path, 'r') as source:
+        return ipc.open_file(source).read_all().to_pandas()
+
+
+def _directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path) for filename in filenames
+    )
+
+
+class Workspace:
+    """Хранилище подготовленных наборов данных с LRU-вытеснением по бюджету диска"""
+
+    def __init__(self, root=WORKSPACE_DIR, budget_mb=WORKSPACE_BUDGET_MB):
+        if pa is None:
+            raise ImportError("Для рабочего пространства установите пакет pyarrow: pip install pyarrow")
+        self.root = root
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key, *parts):
+        return os.path.join(self.root, key, *parts)
+
+    def _read_meta(self, key):
+        with open(self._path(key, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, key, meta, directory=None):
+        # Атомарная запись: сначала во временный файл рядом
+        path = os.path.join(directory or self._path(key), 'meta.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key, 'meta.json'))
+
+    def list(self):
+        """
+        Сохраненные наборы, начиная с недавно открытых
+
+        Returns:
+        --------
+        list
+            dict: key, name, rows, size_bytes, created, last_access
+        """
+        entries = []
+        for key in os.listdir(self.root):
+            if key in self:
+                try:
+                    entries.append({'key': key, **self._read_meta(key)})
+                except (OSError, ValueError):
+                    continue
+        return sorted(entries, key=lambda entry: entry['last_access'], reverse=True)
+
+    def save(self, key, analyzer, name):
+        """
+        Сохранение подготовленного состояния анализатора
+
+        Parameters:
+        -----------
+        key : str
+            Хеш содержимого исходных данных (hash_bytes / hash_dataframe)
+        analyzer : FunnelAnalyzer
+            Анализатор с данными в pandas DataFrame (analyzer.df)
+        name : str
+            Название набора в списке
+        """
+        if key in self:
+            self.touch(key)
+            return
+
+        if isinstance(analyzer.data, pd.DataFrame):
+            df, registration_times = analyzer.data, analyzer.registration_times
+        else:
+            # Другие движки хранят данные в своем формате: порядок строится по исходному DataFrame
+            df, registration_times = PandasEngine().sort_by_registration(analyzer.df)
+
+        # Запись во временный каталог (вместе с meta.json) и атомарное переименование
+        self.sweep()
+        staging = tempfile.mkdtemp(prefix=f'.{key}-', dir=self.root)
+        try:
+            _write_arrow(df, os.path.join(staging, 'data.arrow'))
+            np.save(os.path.join(staging, 'registration_times.npy'), registration_times)
+            for aggregate in AGGREGATE_NAMES:
+                table = getattr(analyzer, f'calculate_{aggregate}')()
+                _write_arrow(table, os.path.join(staging, f'{aggregate}.arrow'))
+            now = time.time()
+            self._write_meta(key, {
+                'name': name,
+                'rows': len(df),
+                'size_bytes': _directory_size(staging),
+                'created': now,
+                'last_access': now,
+            }, directory=staging)
+            os.rename(staging, self._path(key))
+        except OSError as e:
+            # Каталог набора уже есть: на Linux переименование в непустой каталог дает ENOTEMPTY
+            exists = e.errno in (errno.EEXIST, errno.ENOTEMPTY)
+            if exists and key not in self:
+                # Каталог без meta.json - остаток прерванной записи старой версии: заменяется
+                self.remove(key)
+                try:
+                    os.rename(staging, self._path(key))
+                except OSError:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    raise
+            else:
+                shutil.rmtree(staging, ignore_errors=True)
+                if not exists:
+                    raise
+                # Тот же набор уже сохранен параллельной сессией
+                return
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+
+    def touch(self, key):
+        """Отметка об открытии набора (для LRU)"""
+        meta = self._read_meta(key)
+        meta['last_access'] = time.time()
+        self._write_meta(key, meta)
+
+    def load(self, key, engine='pandas'):
+        """
+        Анализатор сохраненного набора: данные читаются из Arrow, индекс дат
+        отображается в память, подготовка и агрегация не выполняются повторно
+        """
+        if key not in self:
+            raise KeyError(f"Набор данных {key} не найден в рабочем пространстве")
+
+        df = _read_arrow(self._path(key, 'data.arrow'))
+        registration_times = np.load(self._path(key, 'registration_times.npy'), mmap_mode='r')
+        aggregates = {
+            aggregate: _read_arrow(self._path(key, f'{aggregate}.arrow'))
+            for aggregate in AGGREGATE_NAMES
+        }
+        self.touch(key)
+        return FunnelAnalyzer.from_prepared(df, registration_times, engine, aggregates)
+
+    def remove(self, key):
+        """Удаление набора"""
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def sweep(self, max_age=STALE_STAGING_SECONDS):
+        """
+        Удаление каталогов без meta.json старше max_age секунд: временных
+        каталогов прерванных сохранений и наборов без метаданных
+        """
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                stale = os.path.isdir(path) and name not in self and os.path.getmtime(path) < cutoff
+            except OSError:
+                continue
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def usage_bytes(self):
+        """Суммарный объем сохраненных наборов"""
+        return sum(entry['size_bytes'] for entry in self.list())
+
+    def evict(self, keep=None):
+        """Удаление давно не открывавшихся наборов, пока объем превышает бюджет"""
+        entries = self.list()
+        total = sum(entry['size_bytes'] for entry in entries)
+        for entry in reversed(entries):
+            if total <= self.budget_bytes:
+                break
+            if entry['key'] == keep:
+                continue
+            self.remove(entry['key'])
+            total -= entry['size_bytes']